@@ -1,20 +1,41 @@
+import multiprocessing
 import platform
 import sys
+from pathlib import Path
 
 from commod.gui import commod_flet
-from commod.helpers.parse_ops import init_input_parser
+from commod.helpers.parse_ops import init_diff_parser, init_input_parser, init_journal_parser
+from commod.tools import batch_diff, install_recovery
 
 
 def main_gui() -> None:
     commod_flet.start()
 
+def main_diff(args: list[str] | None = None) -> int:
+    options = init_diff_parser().parse_args(args)
+    return batch_diff.run_batch_diff(Path(options.vanilla_dir), Path(options.modded_dir),
+                                     Path(options.output_dir), max_workers=options.workers)
 
+def main_rollback(args: list[str] | None = None) -> int:
+    options = init_journal_parser("rollback").parse_args(args)
+    return install_recovery.run_rollback(Path(options.game_dir))
+
+def main_resume(args: list[str] | None = None) -> int:
+    options = init_journal_parser("resume").parse_args(args)
+    return install_recovery.run_resume(Path(options.game_dir))
+
+def main() -> None:
+    if sys.argv[1:2] == ["diff"]:
+        sys.exit(main_diff(sys.argv[2:]))
+    if sys.argv[1:2] == ["rollback"]:
+        sys.exit(main_rollback(sys.argv[2:]))
+    if sys.argv[1:2] == ["resume"]:
+        sys.exit(main_resume(sys.argv[2:]))
 
-if __name__ == "__main__":
     options = init_input_parser().parse_args()
     if "Windows" in platform.system():
         try:
-            from ctypes import windll
+            from ctypes import windll  # noqa: PLC0415
             windll.shcore.SetProcessDpiAwareness(2)
         except (ImportError, NameError):
             pass
@@ -23,3 +44,8 @@ if __name__ == "__main__":
         sys.exit()
     else:
         sys.exit(main_gui())
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -60,7 +60,7 @@ from commod.helpers.errors import (
     PatchedButDoesntHaveManifestError,
     WrongGameDirectoryPathError,
 )
-from commod.helpers.file_ops import get_config, load_yaml, read_yaml, running_in_venv, write_xml_to_file_async
+from commod.helpers.file_ops import get_config, load_yaml, read_yaml, running_in_venv, write_config_async
 from commod.localisation.service import SupportedLanguages, tr
 
 logger = logging.getLogger("dem")
@@ -1010,8 +1010,7 @@ class GameCopy:
             current_value = config.attrib.get(key)
             if current_value is not None:
                 config.attrib[key] = str(value)
-        await write_xml_to_file_async(
-            config, os.path.join(self.game_root_path, "data", "config.cfg"))
+        await write_config_async(config, self.game_root_path)
 
     async def switch_fullscreen(
             self, monitor_res: tuple[int, int], enable: bool = True) -> None:
@@ -1036,8 +1035,7 @@ class GameCopy:
                         config.attrib["r_desiredHeight"] = str(new_res[-1][1])
 
                 self.fullscreen_game = False
-            await write_xml_to_file_async(config,
-                                     os.path.join(self.game_root_path, "data", "config.cfg"))
+            await write_config_async(config, self.game_root_path)
 
     async def correct_fullscreen_sd(
             self, monitor_res: tuple[int, int]) -> None:
@@ -1052,8 +1050,7 @@ class GameCopy:
                 logger.debug("correct_fullscreen_config failed")
                 return
 
-            await write_xml_to_file_async(
-                config, os.path.join(self.game_root_path, "data", "config.cfg"))
+            await write_config_async(config, self.game_root_path)
 
     def correct_fullscreen_config(self, config: objectify.ObjectifiedElement,
                                   monitor_res: tuple[int, int]) -> bool:
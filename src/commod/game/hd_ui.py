@@ -148,7 +148,7 @@ def toggle_16_9_UI_xmls(root_dir: str | Path, screen_width: int, screen_height:
             config.attrib["r_width"] = new_width
             config.attrib["r_height"] = new_height
 
-    file_ops.write_xml_to_file(config, Path(root_dir, "data", "config.cfg"))
+    file_ops.write_config(config, root_dir)
 
 
 def toggle_16_9_glob_prop(root_dir: str | Path, enable: bool = True) -> None:
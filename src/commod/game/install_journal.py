@@ -0,0 +1,230 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from enum import Enum
+from pathlib import Path
+from typing import Any
+
+from commod.helpers.file_ops import (
+    ATOMIC_COPY_SUFFIX,
+    CopyMethod,
+    CopyTask,
+    copy_file,
+    copy_files_async,
+    describe_copy_methods,
+    dump_yaml,
+    get_copy_workers_count,
+    read_yaml,
+)
+
+logger = logging.getLogger("dem")
+
+# kept in the data dir of the game, next to mod_manifest.yaml
+INSTALL_JOURNAL_DIR_NAME = ".commod_install"
+JOURNAL_FILE_NAME = "journal.jsonl"
+BACKUP_DIR_NAME = "backup"
+STAGED_DIR_NAME = "staged"
+MOD_MANIFEST_NAME = "mod_manifest.yaml"
+
+
+class JournalEntry(Enum):
+    BEGIN = "begin"
+    PLAN = "plan"
+    REPLACE = "replace"
+    COMMIT = "commit"
+
+
+class InstallJournalError(Exception):
+    pass
+
+
+class InstallJournal:
+    """Append-only record of game files replaced during mod installation.
+
+    Journal starts with the plan of all files to copy into the game. Game file is moved
+    to the backup dir of the journal right before it's replaced, so an interrupted installation
+    can be rolled back, or resumed by copying only the files which weren't replaced yet.
+    Every entry is flushed to disk before the change it describes is made.
+    Journal is removed when installation is committed.
+    """
+
+    def __init__(self, game_root: str | Path) -> None:
+        self.game_root = Path(game_root)
+        self.journal_dir = self.game_root / "data" / INSTALL_JOURNAL_DIR_NAME
+        self.journal_path = self.journal_dir / JOURNAL_FILE_NAME
+        self.backup_dir = self.journal_dir / BACKUP_DIR_NAME
+        self.staged_dir = self.journal_dir / STAGED_DIR_NAME
+        self._lock = threading.Lock()
+        # target -> if it existed before the installation, loaded from the journal on first replacement
+        self._existed: dict[str, bool] | None = None
+
+    def append(self, *entries: tuple[JournalEntry, dict[str, Any]]) -> None:
+        lines = "".join(json.dumps({"entry": entry.value, **fields}, ensure_ascii=False) + "\n"
+                        for entry, fields in entries)
+        with self._lock, open(self.journal_path, "a", encoding="utf-8") as fh:
+            fh.write(lines)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def read_entries(self) -> list[dict[str, Any]]:
+        entries = []
+        with open(self.journal_path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # entry written during a crash, the change it describes wasn't made yet
+                    logger.warning(f"Incomplete entry at the end of install journal: '{line.strip()}'")
+                    break
+        return entries
+
+    def get_entries(self, entry_type: JournalEntry) -> list[dict[str, Any]]:
+        return [entry for entry in self.read_entries() if entry["entry"] == entry_type.value]
+
+    def is_pending(self) -> bool:
+        """Return True if journal of the installation which wasn't committed exists."""
+        if not self.journal_path.exists():
+            return False
+        entries = self.read_entries()
+        return not entries or entries[-1]["entry"] != JournalEntry.COMMIT.value
+
+    def begin(self, mod_name: str, manifest_entry: dict[str, Any], requires_patching: bool) -> None:
+        """Start the journal for installation of the mod.
+
+        Manifest entry is written to mod_manifest.yaml when installation is resumed,
+        unless mod also needs to patch the game, which is only done by full installation.
+        """
+        shutil.rmtree(self.journal_dir, ignore_errors=True)
+        self.backup_dir.mkdir(parents=True)
+        self.staged_dir.mkdir(parents=True)
+        self._existed = {}
+        self.append((JournalEntry.BEGIN, {"mod": mod_name, "manifest_entry": manifest_entry,
+                                          "requires_patching": requires_patching}))
+
+    def record_plan(self, tasks: list[CopyTask]) -> None:
+        """Record all files to copy, destination of every task must be inside the game root."""
+        files = [[task.source, Path(task.destination).relative_to(self.game_root).as_posix()]
+                 for task in tasks]
+        self.append((JournalEntry.PLAN, {"files": files}))
+
+    def get_plan(self) -> list[CopyTask]:
+        plans = self.get_entries(JournalEntry.PLAN)
+        if not plans:
+            raise InstallJournalError(f"Install journal doesn't have a plan of files: '{self.journal_path}'")
+        return [CopyTask(source, str(self.game_root / target), 0) for source, target in plans[-1]["files"]]
+
+    def get_existed_before(self, targets: list[Path]) -> list[bool]:
+        """Return if targets existed before the installation, file can be replaced again when resumed."""
+        with self._lock:
+            if self._existed is None:
+                # the first entry of the target knows if it existed before
+                self._existed = {entry["target"]: entry["existed"] for entry in reversed(self.read_entries())
+                                 if entry["entry"] == JournalEntry.REPLACE.value}
+            return [self._existed.setdefault(target.as_posix(), (self.game_root / target).exists())
+                    for target in targets]
+
+    def replace_batch(self, batch: list[CopyTask]) -> Counter[CopyMethod]:
+        """Replace game files, keeping backups of previous ones. Entries are recorded for the whole batch."""
+        targets = [Path(task.destination).relative_to(self.game_root) for task in batch]
+        existed_before = self.get_existed_before(targets)
+        self.append(*[(JournalEntry.REPLACE, {"target": target.as_posix(), "existed": existed})
+                      for target, existed in zip(targets, existed_before, strict=True)])
+        methods: Counter[CopyMethod] = Counter()
+        for task, target, existed in zip(batch, targets, existed_before, strict=True):
+            try:
+                methods[self.replace_file(task.source, target, existed)] += 1
+            except PermissionError as ex:
+                msg = (f"Can't overwrite path '{task.destination}', "
+                       "this file is blocked by something, possibly opened")
+                raise PermissionError(msg) from ex
+        return methods
+
+    def replace_file(self, source: str | Path, target: Path, existed: bool) -> CopyMethod:
+        """Replace game file with the copy of source, backing up the game file which existed before."""
+        game_path = self.game_root / target
+        backup_path = self.backup_dir / target
+        temp_path = Path(f"{game_path}{ATOMIC_COPY_SUFFIX}")
+        game_path.parent.mkdir(parents=True, exist_ok=True)
+        method = copy_file(source, temp_path)
+        # file replaced again already has the original backed up, new file of the mod has nothing to back up
+        if existed and not backup_path.exists() and game_path.exists():
+            backup_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(game_path, backup_path)
+        os.replace(temp_path, game_path)
+        return method
+
+    def is_replaced(self, task: CopyTask) -> bool:
+        """Check if game file is already the copy of the source, copies keep size and mtime of the source."""
+        try:
+            source_stat = os.stat(task.source)
+            game_stat = os.stat(task.destination)
+        except FileNotFoundError:
+            return False
+        return (source_stat.st_size, source_stat.st_mtime_ns) == (game_stat.st_size, game_stat.st_mtime_ns)
+
+    def commit(self) -> None:
+        self.append((JournalEntry.COMMIT, {}))
+        shutil.rmtree(self.journal_dir, ignore_errors=True)
+
+    def rollback(self) -> int:
+        """Restore all game files replaced during the installation, return their count."""
+        entries = self.read_entries()
+        # resumed installation can record the file again, the first entry knows if it existed before
+        replaced = list({entry["target"]: entry for entry in reversed(entries)
+                         if entry["entry"] == JournalEntry.REPLACE.value}.values())
+        logger.info(f"Rolling back {len(replaced)} replaced files of "
+                    f"'{entries[0].get('mod') if entries else 'unknown'}' installation")
+        for entry in replaced:
+            game_path = self.game_root / entry["target"]
+            backup_path = self.backup_dir / entry["target"]
+            with contextlib.suppress(FileNotFoundError):
+                Path(f"{game_path}{ATOMIC_COPY_SUFFIX}").unlink()
+            if not entry["existed"]:
+                game_path.unlink(missing_ok=True)
+            elif backup_path.exists():
+                os.replace(backup_path, game_path)
+            # otherwise game file wasn't moved to backup yet, so it's the original one
+        shutil.rmtree(self.journal_dir, ignore_errors=True)
+        return len(replaced)
+
+    async def resume(self, callback_progbar: Callable[[int, int, str, float], Awaitable[None]]
+                     ) -> tuple[int, int]:
+        """Copy planned files which weren't replaced yet and commit, return counts of copied and skipped ones.
+
+        Manifest entry of the mod is written if the mod doesn't need to patch the game.
+        """
+        begin_entries = self.get_entries(JournalEntry.BEGIN)
+        if not begin_entries:
+            raise InstallJournalError(f"Install journal doesn't have a start entry: '{self.journal_path}'")
+        begin = begin_entries[0]
+        plan = self.get_plan()
+        remaining = [task for task in plan if not self.is_replaced(task)]
+        for task in remaining:
+            task.size = os.stat(task.source).st_size
+
+        start = time.perf_counter()
+        methods = await copy_files_async(remaining, callback_progbar, get_copy_workers_count(self.game_root),
+                                         copy_batch_function=self.replace_batch)
+        logger.info(f"Resumed installation of '{begin['mod']}', copied {len(remaining)} of {len(plan)} files "
+                    f"in {round(time.perf_counter() - start, 3)} seconds ({describe_copy_methods(methods)})")
+        if not begin["requires_patching"]:
+            await asyncio.to_thread(self.update_manifest, begin["mod"], begin["manifest_entry"])
+        self.commit()
+        return len(remaining), len(plan) - len(remaining)
+
+    def update_manifest(self, mod_name: str, manifest_entry: dict[str, Any]) -> None:
+        manifest_path = self.game_root / "data" / MOD_MANIFEST_NAME
+        installed_content = read_yaml(manifest_path) if manifest_path.exists() else None
+        if not isinstance(installed_content, dict):
+            installed_content = {}
+        installed_content[mod_name] = manifest_entry
+        if not dump_yaml(installed_content, manifest_path, sort_keys=False):
+            raise InstallJournalError(f"Couldn't write mod manifest: '{manifest_path}'")
+
@@ -7,6 +7,7 @@ import os
 import shutil
 import time
 from collections.abc import Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
 from functools import cached_property
 from pathlib import Path
 from typing import Annotated, Any
@@ -34,6 +35,7 @@ from commod.game.data import (
     WIKI_COMREM,
     SupportedGames,
 )
+from commod.game.install_journal import InstallJournal
 from commod.game.mod_auxiliary import (
     RESERVED_CONTENT_NAMES,
     ConfigOptions,
@@ -54,17 +56,32 @@ from commod.helpers.errors import (
 )
 from commod.helpers.file_ops import (
     SUPPORTED_IMG_TYPES,
+    CopyTask,
+    collect_copy_tasks,
+    copy_files_async,
     copy_from_to_async_fast,
     copy_targets_from_to_async,
+    get_copy_workers_count,
     get_internal_file_path,
+    is_process_pool_supported,
     read_yaml,
 )
 from commod.helpers.parse_ops import parse_simple_relative_path, process_markdown, remove_substrings
-from commod.localisation.service import KnownLangFlags, SupportedLanguages, is_known_lang, tr, tr_lang
+from commod.localisation.service import (
+    KnownLangFlags,
+    SupportedLanguages,
+    get_current_lang,
+    is_known_lang,
+    set_current_lang,
+    tr,
+    tr_lang,
+)
 from commod.tools import xml_merge
 
 logger = logging.getLogger("dem")
 COMPATCH_REM = {"community_patch", "community_remaster"}
+# starting worker processes only pays off when there are enough independent files to merge
+PARALLEL_MERGE_MIN_TARGETS = 4
 
 class Mod(BaseModel):
     # base directory where manifest is located
@@ -919,118 +936,209 @@ class Mod(BaseModel):
                                  if not (temp_data / target).exists()])
         return need_to_copy
 
+    @staticmethod
+    def plan_directives(directives: list[MergeDirective]) -> dict[Path, list[MergeDirective]]:
+        """Group directives by target file, keeping the order in which they need to be applied."""
+        merge_plan: dict[Path, list[MergeDirective]] = {}
+        for directive in directives:
+            for target in directive.targets:
+                merge_plan.setdefault(target, []).append(directive)
+        return merge_plan
+
     async def apply_directives(
             self, target_dir: Path, directives: list[MergeDirective],
+            callback_progbar: Callable[[int, int, str, float], Awaitable[None]],
+            parallel: bool | None = None) -> None:
+        """Apply merge directives to files in target_dir.
+
+        Every target is parsed, patched by all its directives and written back only once.
+        Targets are independent, so in parallel mode they are processed in a pool of worker processes,
+        by default parallel mode is used when there are enough targets, more than one CPU
+        and process pools work in the current build.
+        """
+        merge_plan = self.plan_directives(directives)
+        if parallel is None:
+            parallel = (len(merge_plan) >= PARALLEL_MERGE_MIN_TARGETS
+                        and (os.cpu_count() or 1) > 1
+                        and is_process_pool_supported())
+
+        if parallel:
+            await self.apply_merge_plan_parallel(target_dir, merge_plan, callback_progbar)
+            return
+
+        total_count = len(merge_plan)
+        for current_count, (target, target_directives) in enumerate(merge_plan.items(), start=1):
+            base_path = target_dir / target
+            try:
+                target_commands = [command for directive in target_directives
+                                   for command in directive.commands]
+            except (ValueError, AssertionError) as ex:
+                raise ModFilePackagingError(f"Incorrect merge command found!\n{ex}!")  # noqa: B904
+
+            try:
+                logger.debug(f"Updating file with commands from {len(target_directives)} "
+                             f"directive(s): {base_path}")
+                await asyncio.to_thread(xml_merge.update_file_with_commands, base_path, target_commands)
+            except commod.tools.xml_helpers.InvalidMergeCommandError as ex:
+                raise ModInvalidMergeInstallationError(target,
+                                                       ex.error_desc) from ex
+            except Exception as ex:
+                raise ModInvalidMergeInstallationError(target,
+                                                      str(ex)) from ex
+
+            await callback_progbar(current_count, total_count, str(target), 0)
+            await asyncio.sleep(0.01)
+        logger.debug(f"XPath cache stats: {commod.tools.xml_helpers.compile_xpath.cache_info()}")
+
+    async def apply_merge_plan_parallel(
+            self, target_dir: Path, merge_plan: dict[Path, list[MergeDirective]],
             callback_progbar: Callable[[int, int, str, float], Awaitable[None]]) -> None:
-        total_count = sum(len(directive.targets) for directive in directives)
-        current_count = 0
-        for directive in directives:
-            for target in directive.targets:
-                current_count += 1
-                base_path = target_dir / target
+        # commands are validated here to fail early and report packaging errors the same way
+        # as sequential merge, workers receive only paths as lxml trees can't be sent between processes
+        for target_directives in merge_plan.values():
+            for directive in target_directives:
                 try:
-                    directive_commands = directive.commands
+                    directive.commands  # noqa: B018
                 except (ValueError, AssertionError) as ex:
                     raise ModFilePackagingError(f"Incorrect merge command found!\n{ex}!")  # noqa: B904
 
-                try:
-                    logger.debug(f"Updating file with commands: {base_path}")
-                    await asyncio.to_thread(xml_merge.update_file_with_commands, base_path, directive_commands)
-                except commod.tools.xml_helpers.InvalidMergeCommandError as ex:
-                    raise ModInvalidMergeInstallationError(target,
-                                                           ex.error_desc) from ex
-                except Exception as ex:
-                    raise ModInvalidMergeInstallationError(target,
-                                                          str(ex)) from ex
-
-                await callback_progbar(current_count, total_count, str(target), 0)
-                await asyncio.sleep(0.01)
+        total_count = len(merge_plan)
+        max_workers = min(total_count, os.cpu_count() or 1)
+        logger.debug(f"Applying merge directives to {total_count} targets with {max_workers} processes")
+
+        loop = asyncio.get_running_loop()
+        # workers need to use the same language for error messages as the main process
+        executor = ProcessPoolExecutor(max_workers=max_workers,
+                                       initializer=set_current_lang,
+                                       initargs=(get_current_lang(),))
+        try:
+            pending_targets = {
+                loop.run_in_executor(
+                    executor, xml_merge.update_file_with_command_files,
+                    target_dir / target,
+                    [(directive.commands_file, directive.merge_author) for directive in target_directives]
+                ): target
+                for target, target_directives in merge_plan.items()}
+
+            current_count = 0
+            pending = set(pending_targets)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    target = pending_targets[future]
+                    try:
+                        future.result()
+                    except commod.tools.xml_helpers.InvalidMergeCommandError as ex:
+                        raise ModInvalidMergeInstallationError(target,
+                                                               ex.error_desc) from ex
+                    except Exception as ex:
+                        raise ModInvalidMergeInstallationError(target,
+                                                               str(ex)) from ex
+                    current_count += 1
+                    await callback_progbar(current_count, total_count, str(target), 0)
+        finally:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    def get_manifest_entry(self, install_settings: dict[str, Any]) -> dict[str, Any]:
+        """Return description of installed mod for the mod manifest of the game."""
+        manifest_entry = install_settings.copy()
+        manifest_entry["version"] = str(self.version)
+        manifest_entry["build"] = self.build
+        manifest_entry["language"] = self.language
+        manifest_entry["installment"] = str(self.installment)
+        manifest_entry["display_name"] = self.display_name
+        return manifest_entry
+
+    def requires_patching(self, install_settings: dict[str, Any]) -> bool:
+        """Return True if installation with the settings changes game exe or config besides copying files."""
+        return (self.name in COMPATCH_REM
+                or self.vanilla_mod
+                or self.patcher_options is not None
+                or self.config_options is not None
+                or any(install_settings.get(option.name, "skip") != "skip"
+                       and option.patcher_options is not None
+                       for option in self.optional_content))
+
+    def get_install_paths(self, install_settings: dict[str, Any]
+                          ) -> tuple[list[Path], list[Path], list[MergeDirective]]:
+        """Return bin dirs, data dirs in the order of installation and merge directives for the settings."""
+        bin_paths: list[Path] = []
+        mod_files: list[Path] = []
+        merge_directives: list[MergeDirective] = []
+        install_base = install_settings.get("base")
+        if install_base is None:
+            raise KeyError(f"Installation config for base of mod '{self.name}' is broken")
+
+        if install_base == "skip":
+            logger.debug("No base content will be installed")
+        else:
+            bin_paths = [Path(self.mod_files_root, one_dir) for one_dir in self.bin_dirs]
+            data_paths = [Path(self.mod_files_root, one_dir) for one_dir in self.data_dirs]
+            mod_files.extend(data_paths)
+            merge_directives.extend(self.merge_directives)
+
+        for install_setting in install_settings:  # noqa: PLC0206
+            if install_setting == "base":
+                continue
+
+            wip_setting = self.options_dict[install_setting]
+            installation_decision = install_settings[install_setting]
+
+            if installation_decision == "yes":
+                for data_dir in wip_setting.data_dirs:
+                    simple_option_path = Path(
+                        data_dir,
+                        "data")
+                    mod_files.append(simple_option_path)
+                merge_directives.extend(wip_setting.merge_directives)
+            elif installation_decision == "skip":
+                logger.debug(f"Skipping option {install_setting}")
+                continue
+            else:
+                custom_install_method = install_settings[install_setting]
+                install_setting_obj = next(iter([sett for sett in wip_setting.install_settings
+                                       if sett.name == custom_install_method]))
+                for data_dir in wip_setting.data_dirs:
+                    for sett_data_dir in install_setting_obj.data_dirs:
+                        complex_option_path = Path(
+                            data_dir,
+                            sett_data_dir)
+                        mod_files.append(complex_option_path)
+                        merge_directives.extend(install_setting_obj.merge_directives)
+        return bin_paths, mod_files, merge_directives
 
     async def install_async(self, temp_location: str | Path,
                             game_data_path: str | Path,
                             install_settings: dict[str, Any],
                             existing_content: dict[str, Any],
                             callback_progbar: Callable[[int, int, str, float], Awaitable[None]],
-                            callback_status: Callable[[str], Awaitable[None]]) -> bool:
-        """Use fast async copy, return bool success status of install."""
+                            callback_status: Callable[[str], Awaitable[None]],
+                            direct: bool = True) -> bool:
+        """Use fast async copy, return bool success status of install.
+
+        In direct mode mod files are copied straight to the game and only targets of merge directives
+        are staged in temp location. Otherwise all files are collected in temp location first.
+        """
         start = time.perf_counter()
         try:
 
             temp_location = Path(temp_location)
-            temp_data = temp_location / "data"
             game_data_path = Path(game_data_path)
             logger.info(f"Existing content at the start of install: {existing_content}")
-            mod_files: list[Path] = []
-            merge_directives: list[MergeDirective] = []
-            install_base = install_settings.get("base")
-            if install_base is None:
-                raise KeyError(f"Installation config for base of mod '{self.name}' is broken")
-
-            if install_base == "skip":
-                logger.debug("No base content will be installed")
+            bin_paths, mod_files, merge_directives = self.get_install_paths(install_settings)
+            if direct:
+                await self.install_direct_async(temp_location, game_data_path,
+                                                install_settings=install_settings,
+                                                bin_paths=bin_paths, mod_files=mod_files,
+                                                merge_directives=merge_directives,
+                                                callback_progbar=callback_progbar,
+                                                callback_status=callback_status)
             else:
-                bin_paths = [Path(self.mod_files_root, one_dir) for one_dir in self.bin_dirs]
-                data_paths = [Path(self.mod_files_root, one_dir) for one_dir in self.data_dirs]
-                mod_files.extend(data_paths)
-                merge_directives.extend(self.merge_directives)
-
-                if bin_paths:
-                    await callback_status(tr("copying_base_files_to_temp_dir"))
-                    await copy_from_to_async_fast(bin_paths, temp_location, callback_progbar)
-
-            for install_setting in install_settings:  # noqa: PLC0206
-                if install_setting == "base":
-                    continue
-
-                wip_setting = self.options_dict[install_setting]
-                installation_decision = install_settings[install_setting]
-
-                if installation_decision == "yes":
-                    for data_dir in wip_setting.data_dirs:
-                        simple_option_path = Path(
-                            data_dir,
-                            "data")
-                        mod_files.append(simple_option_path)
-                    merge_directives.extend(wip_setting.merge_directives)
-                elif installation_decision == "skip":
-                    logger.debug(f"Skipping option {install_setting}")
-                    continue
-                else:
-                    custom_install_method = install_settings[install_setting]
-                    install_setting_obj = next(iter([sett for sett in wip_setting.install_settings
-                                           if sett.name == custom_install_method]))
-                    for data_dir in wip_setting.data_dirs:
-                        for sett_data_dir in install_setting_obj.data_dirs:
-                            complex_option_path = Path(
-                                data_dir,
-                                sett_data_dir)
-                            mod_files.append(complex_option_path)
-                            merge_directives.extend(install_setting_obj.merge_directives)
-
-            await callback_status(tr("copying_base_files_to_temp_dir"))
-            await asyncio.sleep(0.01)
-            await copy_from_to_async_fast(mod_files, temp_data, callback_progbar)
-
-            if merge_directives:
-                await callback_status(tr("copying_additional_files_to_temp_dir"))
-                await asyncio.sleep(0.01)
-                directive_base_files = await self.find_missing_targets_for_directives(
-                    temp_data, merge_directives)
-                for relative_path in directive_base_files:
-                    if not (game_data_path / relative_path).exists():
-                        raise ModMissingFileInstallationError(relative_path)
-                await copy_targets_from_to_async(
-                    directive_base_files, game_data_path, temp_data, callback_progbar)
-
-                await callback_status(tr("applying_merge_mod_to_temp_dir"))
-                await asyncio.sleep(0.01)
-                await self.apply_directives(temp_data, merge_directives, callback_progbar)
-
-            await callback_status(tr("copying_final_files_from_temp_dir"))
-            await asyncio.sleep(0.01)
-            await copy_from_to_async_fast(
-                [temp_location], Path(game_data_path).parent, callback_progbar)
-
+                await self.install_staged_async(temp_location, game_data_path,
+                                                bin_paths=bin_paths, mod_files=mod_files,
+                                                merge_directives=merge_directives,
+                                                callback_progbar=callback_progbar,
+                                                callback_status=callback_status)
         except (ModMissingFileInstallationError, ModFilePackagingError, ModInvalidMergeInstallationError):
             logger.error("Handled error occurred when installing the mod!")
             raise
@@ -1044,6 +1152,125 @@ class Mod(BaseModel):
             await asyncio.to_thread(shutil.rmtree, temp_location)
             logger.debug("Deleted temp dir")
 
+    async def install_staged_async(self, temp_location: Path, game_data_path: Path, *,
+                                   bin_paths: list[Path], mod_files: list[Path],
+                                   merge_directives: list[MergeDirective],
+                                   callback_progbar: Callable[[int, int, str, float], Awaitable[None]],
+                                   callback_status: Callable[[str], Awaitable[None]]) -> None:
+        """Collect all files in temp location, apply merges there and copy the result to the game."""
+        temp_data = temp_location / "data"
+        if bin_paths:
+            await callback_status(tr("copying_base_files_to_temp_dir"))
+            await copy_from_to_async_fast(bin_paths, temp_location, callback_progbar)
+
+        await callback_status(tr("copying_base_files_to_temp_dir"))
+        await asyncio.sleep(0.01)
+        await copy_from_to_async_fast(mod_files, temp_data, callback_progbar)
+
+        if merge_directives:
+            await callback_status(tr("copying_additional_files_to_temp_dir"))
+            await asyncio.sleep(0.01)
+            directive_base_files = await self.find_missing_targets_for_directives(
+                temp_data, merge_directives)
+            for relative_path in directive_base_files:
+                if not (game_data_path / relative_path).exists():
+                    raise ModMissingFileInstallationError(relative_path)
+            await copy_targets_from_to_async(
+                directive_base_files, game_data_path, temp_data, callback_progbar)
+
+            await callback_status(tr("applying_merge_mod_to_temp_dir"))
+            await asyncio.sleep(0.01)
+            await self.apply_directives(temp_data, merge_directives, callback_progbar)
+
+        await callback_status(tr("copying_final_files_from_temp_dir"))
+        await asyncio.sleep(0.01)
+        await copy_from_to_async_fast(
+            [temp_location], Path(game_data_path).parent, callback_progbar)
+
+    async def install_direct_async(self, temp_location: Path, game_data_path: Path, *,
+                                   install_settings: dict[str, Any],
+                                   bin_paths: list[Path], mod_files: list[Path],
+                                   merge_directives: list[MergeDirective],
+                                   callback_progbar: Callable[[int, int, str, float], Awaitable[None]],
+                                   callback_status: Callable[[str], Awaitable[None]]) -> None:
+        """Copy mod files straight to the game, staging only targets of merge directives.
+
+        Merges are applied before any game file is changed. Every copied file is recorded
+        in install journal, with the replaced game file kept as backup. Interrupted installation
+        is left pending, to be resumed or rolled back from the GUI or with 'rollback' and 'resume' commands.
+        """
+        game_root = game_data_path.parent
+        temp_data = temp_location / "data"
+        journal = InstallJournal(game_root)
+        if await asyncio.to_thread(journal.is_pending):
+            logger.warning(f"Rolling back interrupted installation found in '{journal.journal_dir}'")
+            await asyncio.to_thread(journal.rollback)
+
+        merge_targets = list(self.plan_directives(merge_directives))
+        if merge_targets:
+            await callback_status(tr("copying_additional_files_to_temp_dir"))
+            await asyncio.sleep(0.01)
+            await self.stage_merge_targets(merge_targets, mod_files, game_data_path, temp_data,
+                                           callback_progbar)
+
+            await callback_status(tr("applying_merge_mod_to_temp_dir"))
+            await asyncio.sleep(0.01)
+            await self.apply_directives(temp_data, merge_directives, callback_progbar)
+
+        await callback_status(tr("copying_final_files_from_temp_dir"))
+        await asyncio.sleep(0.01)
+        await asyncio.to_thread(journal.begin, self.name, self.get_manifest_entry(install_settings),
+                                self.requires_patching(install_settings))
+        # merged files are kept with the journal, so installation can be resumed without temp dir
+        for target in merge_targets:
+            (journal.staged_dir / target).parent.mkdir(parents=True, exist_ok=True)
+            await asyncio.to_thread(shutil.move, temp_data / target, journal.staged_dir / target)
+
+        def plan_copy() -> list[CopyTask]:
+            bin_tasks, bin_dirs = collect_copy_tasks(bin_paths, game_root)
+            data_tasks, data_dirs = collect_copy_tasks(
+                mod_files, game_data_path, exclude=[game_data_path / target for target in merge_targets])
+            merged_tasks, merged_dirs = collect_copy_tasks([journal.staged_dir], game_data_path)
+            # empty dirs shipped by the mod are created too
+            for dest_dir in bin_dirs + data_dirs + merged_dirs:
+                os.makedirs(dest_dir, exist_ok=True)
+            # bin dirs can overlap with data dirs, the last task for the destination is copied
+            return list({os.path.normcase(os.path.normpath(task.destination)): task
+                         for task in bin_tasks + data_tasks + merged_tasks}.values())
+
+        plan_tasks = await asyncio.to_thread(plan_copy)
+        await asyncio.to_thread(journal.record_plan, plan_tasks)
+
+        try:
+            await copy_files_async(plan_tasks, callback_progbar, get_copy_workers_count(game_root),
+                                   copy_batch_function=journal.replace_batch)
+        except BaseException:
+            logger.error(f"Installation of '{self.name}' was interrupted, replaced game files are "
+                         f"recorded in '{journal.journal_path}'. ComMod offers to resume or roll back "
+                         "the installation when the game is opened again, same can be done with "
+                         "'rollback' and 'resume' commands of ComMod executable")
+            raise
+        await asyncio.to_thread(journal.commit)
+
+    @staticmethod
+    async def stage_merge_targets(
+            merge_targets: list[Path], mod_files: list[Path],
+            game_data_path: Path, temp_data: Path,
+            callback_progbar: Callable[[int, int, str, float], Awaitable[None]]) -> None:
+        """Copy files which merge directives will be applied to into the temp data dir.
+
+        Target provided by the mod is taken from the last data dir containing it, from the game otherwise.
+        """
+        tasks = []
+        for target in merge_targets:
+            source = next((data_dir / target for data_dir in reversed(mod_files)
+                           if (data_dir / target).is_file()), game_data_path / target)
+            if not source.is_file():
+                raise ModMissingFileInstallationError(target)
+            (temp_data / target).parent.mkdir(parents=True, exist_ok=True)
+            tasks.append(CopyTask(str(source), str(temp_data / target), source.stat().st_size))
+        await copy_files_async(tasks, callback_progbar, get_copy_workers_count(temp_data))
+
     def check_requirements(self, existing_content: dict, existing_content_descriptions: dict,
                            library_mods_info: dict[str, dict[str, str]] | None) -> tuple[bool, list[str]]:
         """Return bool for cumulative check success result and a list of error message string."""
@@ -26,10 +26,12 @@ from commod.game import data, hd_ui
 from commod.helpers import parse_ops
 from commod.helpers.file_ops import (
     RESOLUTION_OPTION_LIST_SIZE,
+    GameConfigTransaction,
     get_config,
     get_internal_file_path,
     logger,
     patch_offsets,
+    write_config,
     write_xml_to_file,
 )
 from commod.helpers.parse_ops import (
@@ -49,6 +51,8 @@ class MergeDirective(BaseModel, arbitrary_types_allowed = True):
     merge_author: str
 
     _command_list: list[commod.tools.xml_helpers.Command] = []
+    # (mtime_ns, size) of commands file at the moment of parsing _command_list
+    _commands_file_stamp: tuple[int, int] | None = None
 
     @field_validator("raw_targets", mode="before")
     @classmethod
@@ -83,14 +87,22 @@ class MergeDirective(BaseModel, arbitrary_types_allowed = True):
     @computed_field(repr=False)
     @property
     def commands(self) -> list[commod.tools.xml_helpers.Command]:
+        """Commands parsed from commands file, reparsed only if file has changed since the last access.
+
+        Returns new copies of commands on every access, as applying command can change its action.
+        """
         try:
-            cmd_tree = parse_ops.xml_to_objfy(self.commands_file)
-            self._command_list = xml_merge.parse_command_tree(
-                cmd_tree, merge_author=self.merge_author)
+            file_stat = self.commands_file.stat()
+            file_stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+            if file_stamp != self._commands_file_stamp:
+                cmd_tree = parse_ops.xml_to_objfy(self.commands_file)
+                self._command_list = xml_merge.parse_command_tree(
+                    cmd_tree, merge_author=self.merge_author)
+                self._commands_file_stamp = file_stamp
         except Exception as ex:
             raise ValueError(f"Unable to parse commands from '{self.commands_file!r}':\n\n{ex}") from ex
 
-        return self._command_list
+        return [command.model_copy() for command in self._command_list]
 
     @model_validator(mode="after")
     def load_commands(self) -> "MergeDirective":
@@ -1032,7 +1044,7 @@ def correct_damage_coeffs(root_dir: str | Path, gravity: float) -> None:
     if config.attrib.get("ai_clash_coeff") is not None:
         ai_clash_coeff = 0.001 / (gravity / -9.8)
         config.attrib["ai_clash_coeff"] = f"{ai_clash_coeff:.4f}"
-        write_xml_to_file(config, Path(root_dir, "data", "config.cfg"))
+        write_config(config, root_dir)
 
 
 def patch_remaster_icon(f: typing.BinaryIO) -> None:
@@ -1127,8 +1139,8 @@ def apply_compatches_to_exe(target_exe: str, version_choice: str, build_id: str,
     Returns list with a localised description of applied changes
     """
     changes_description = []
-    with open(target_exe, "rb+") as f:
-        game_root_path = Path(target_exe).parent
+    game_root_path = Path(target_exe).parent
+    with open(target_exe, "rb+") as f, GameConfigTransaction(game_root_path):
         width, height = monitor_res
 
         if version_choice == "remaster":
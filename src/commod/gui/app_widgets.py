@@ -53,6 +53,7 @@ from commod.game.environment import (
     GameStatus,
     InstallationContext,
 )
+from commod.game.install_journal import InstallJournal, JournalEntry
 from commod.game.mod import Mod
 from commod.game.mod_auxiliary import (
     OptionalContent,
@@ -361,6 +362,83 @@ class App:
         self.page.open(dlg)
         return loading_text
 
+    async def check_interrupted_install(self) -> None:
+        """Offer to resume or roll back mod installation interrupted in the current game."""
+        if not self.game.game_root_path or (self.dialog is not None and self.dialog.open):
+            return
+        journal = InstallJournal(self.game.game_root_path)
+        try:
+            if not await asyncio.to_thread(journal.is_pending):
+                return
+            begin_entries = await asyncio.to_thread(journal.get_entries, JournalEntry.BEGIN)
+        except Exception:
+            self.logger.exception("Unable to read install journal")
+            return
+        mod_name = "?"
+        requires_patching = False
+        if begin_entries:
+            mod_name = begin_entries[0]["manifest_entry"].get("display_name", begin_entries[0]["mod"])
+            requires_patching = begin_entries[0]["requires_patching"]
+        self.logger.warning(f"Found interrupted installation of '{mod_name}' in '{journal.journal_dir}'")
+
+        async def resume(e: ft.ControlEvent) -> None:
+            self.close_alert()
+            await self.finish_interrupted_install(journal, mod_name, resume=True,
+                                                  requires_patching=requires_patching)
+
+        async def rollback(e: ft.ControlEvent) -> None:
+            self.close_alert()
+            await self.finish_interrupted_install(journal, mod_name, resume=False)
+
+        dlg = ft.AlertDialog(
+            title=Row([Icon(ft.Icons.WARNING_OUTLINED, color=ft.Colors.ERROR),
+                       Text(tr("attention").capitalize())]),
+            shape=ft.RoundedRectangleBorder(radius=10),
+            content=Column([Text(tr("installation_interrupted", mod_name=mod_name)),
+                            Text(tr("installation_interrupted_patching"),
+                                 visible=requires_patching,
+                                 color=ft.Colors.ON_ERROR_CONTAINER)],
+                           spacing=5,
+                           tight=True),
+            actions=[
+                ft.TextButton(tr("resume_installation").capitalize(), on_click=resume),
+                ft.TextButton(tr("rollback_installation").capitalize(), on_click=rollback)],
+            actions_padding=ft.padding.only(left=20, bottom=20, right=20),
+            on_dismiss=self.close_alert)
+        self.dialog = dlg
+        self.page.open(dlg)
+
+    async def finish_interrupted_install(self, journal: InstallJournal, mod_name: str,
+                                         resume: bool, requires_patching: bool = False) -> None:
+        loading_text = await self.show_loading(
+            mod_name, tr("resume_installation" if resume else "rollback_installation").capitalize())
+
+        async def show_progress(file_num: int, files_count: int, file_name: str, file_size: float) -> None:
+            if loading_text is not None:
+                loading_text.value = f"{file_num} {tr('one_of_many')} {files_count}"
+                loading_text.update()
+
+        try:
+            if resume:
+                await journal.resume(show_progress)
+            else:
+                await asyncio.to_thread(journal.rollback)
+            # manifest is written by resume, installed content needs to be reloaded
+            self.game.process_game_install(self.game.game_root_path)
+            self.game.load_installed_descriptions(self.context.validated_mods)
+        except Exception as ex:
+            self.logger.exception("Unable to finish interrupted installation")
+            self.close_alert()
+            await self.show_alert(tr("installation_recovery_error"), str(ex))
+            return
+        self.close_alert()
+        if resume:
+            await self.show_modal(tr("installation_resumed", mod_name=mod_name),
+                                  tr("installation_interrupted_patching") if requires_patching else "")
+        else:
+            await self.show_modal(tr("installation_rolled_back"))
+        await self.refresh_page(self.config.current_section)
+
     async def load_distro_async(self) -> None:
         self.logger.debug("-- Loading distro --")
         try:
@@ -1596,6 +1674,7 @@ class SettingsScreen(ft.Container):
         self.app.config.current_game = item.game_path
         self.app.logger.info(f"Game is now: {self.app.game.target_exe}")
         self.update()
+        await self.app.check_interrupted_install()
 
         if self.app.context.distribution_dir:
             # self.app.context.validated_mods.clear()
@@ -4060,12 +4139,7 @@ class ModInstallWizard(ft.Container):
 
             # install_settings contain mappings between options names (including 'base')
             # and their installation instruction (e.g. 'yes' or 'skip')
-            session.content_in_processing[mod.name] = install_settings.copy()
-            session.content_in_processing[mod.name]["version"] = str(mod.version)
-            session.content_in_processing[mod.name]["build"] = mod.build
-            session.content_in_processing[mod.name]["language"] = mod.language
-            session.content_in_processing[mod.name]["installment"] = str(mod.installment)
-            session.content_in_processing[mod.name]["display_name"] = mod.display_name
+            session.content_in_processing[mod.name] = mod.get_manifest_entry(install_settings)
 
             self.app.logger.debug("Creating temp directory for mod installation")
             temp_dir = tempfile.mkdtemp()
@@ -4088,47 +4162,49 @@ class ModInstallWizard(ft.Container):
                                       if install_settings.get(opt.name) != "skip"
                                       and opt.patcher_options is not None])
 
-            if (not is_comrem_or_patch) and patching_settings:
-                commod.game.mod_auxiliary.patch_configurables(game.target_exe, patching_settings,
-                                                              self.app.context.under_windows)
-                if mod.patcher_options and patching_settings:
-                    configured_gravity = None
-                    for exe_options_config in patching_settings:
-                        if exe_options_config.gravity is not None:
-                            configured_gravity = exe_options_config.gravity
-                    if configured_gravity is not None:
-                        commod.game.mod_auxiliary.correct_damage_coeffs(
-                            game.game_root_path,
-                            configured_gravity)
-
-            if mod.config_options:
-                await game.change_config_values(mod.config_options)
-
-            changes_description = []
-            if is_comrem_or_patch:
-                if is_comrem:
-                    target_dll = os.path.join(game_root, "dxrender9.dll")
-                    if os.path.exists(target_dll):
-                        commod.game.mod_auxiliary.patch_render_dll(target_dll)
-                    else:
-                        raise DXRenderDllNotFoundError
+            # all config.cfg changes made by patching are written once, at the end of the block
+            with file_ops.GameConfigTransaction(game.game_root_path):
+                if (not is_comrem_or_patch) and patching_settings:
+                    commod.game.mod_auxiliary.patch_configurables(game.target_exe, patching_settings,
+                                                                  self.app.context.under_windows)
+                    if mod.patcher_options and patching_settings:
+                        configured_gravity = None
+                        for exe_options_config in patching_settings:
+                            if exe_options_config.gravity is not None:
+                                configured_gravity = exe_options_config.gravity
+                        if configured_gravity is not None:
+                            commod.game.mod_auxiliary.correct_damage_coeffs(
+                                game.game_root_path,
+                                configured_gravity)
+
+                if mod.config_options:
+                    await game.change_config_values(mod.config_options)
+
+                changes_description = []
+                if is_comrem_or_patch:
+                    if is_comrem:
+                        target_dll = os.path.join(game_root, "dxrender9.dll")
+                        if os.path.exists(target_dll):
+                            commod.game.mod_auxiliary.patch_render_dll(target_dll)
+                        else:
+                            raise DXRenderDllNotFoundError
 
-                build_id = mod.build
+                    build_id = mod.build
 
-                changes_description = commod.game.mod_auxiliary.apply_compatches_to_exe(
-                    game.target_exe,
-                    "patch" if is_compatch else "remaster",
-                    build_id,
-                    self.app.context.monitor_res,
-                    patching_settings, # COMPATCHSPECIAL: if is_comrem else None,
-                    self.app.context.under_windows)
-            elif mod.vanilla_mod and not game.patched_version:
-                changes_description = commod.game.mod_auxiliary.patch_memory(
-                    game.target_exe,
-                    mod.installment)
+                    changes_description = commod.game.mod_auxiliary.apply_compatches_to_exe(
+                        game.target_exe,
+                        "patch" if is_compatch else "remaster",
+                        build_id,
+                        self.app.context.monitor_res,
+                        patching_settings, # COMPATCHSPECIAL: if is_comrem else None,
+                        self.app.context.under_windows)
+                elif mod.vanilla_mod and not game.patched_version:
+                    changes_description = commod.game.mod_auxiliary.patch_memory(
+                        game.target_exe,
+                        mod.installment)
 
-                await self.app.game.correct_fullscreen_sd(
-                    monitor_res=self.app.context.monitor_res)
+                    await self.app.game.correct_fullscreen_sd(
+                        monitor_res=self.app.context.monitor_res)
 
             if status_ok:
                 er_message = f"Couldn't dump install manifest to '{game.installed_manifest_path}'!"
@@ -4171,6 +4247,8 @@ class ModInstallWizard(ft.Container):
         except Exception:
             self.app.logger.exception("Installation error!")
             await self.show_install_results(False, [], traceback=traceback.format_exc())
+            # copying could be interrupted after some game files were replaced
+            await self.app.check_interrupted_install()
             return
 
         await self.show_install_results(status_ok, changes_description)
@@ -5989,6 +6067,7 @@ class HomeScreen(ft.Container):
 
         self.app.config.current_game = game_path
         self.app.logger.info(f"Game is now: {game_path}")
+        await self.app.check_interrupted_install()
 
         if self.app.context.distribution_dir:
             # self.app.context.validated_mods.clear()
@@ -259,6 +259,7 @@ async def main(page: ft.Page) -> None:
         app.content_container.content = None
         app.content_container.update()
         await app.change_page(index=app.config.current_section)
+        await app.check_interrupted_install()
 
     if "NUITKA_ONEFILE_PARENT" in os.environ:
         splash_filename = os.path.join(
@@ -8,15 +8,19 @@ from pathlib import Path
 import flet as ft
 from lxml import etree, objectify
 
+from commod.game.environment import InstallationContext
 from commod.gui import app_widgets
 from commod.gui import common_widgets as cw
 from commod.helpers import file_ops, parse_ops
 from commod.localisation.service import SupportedLanguages, get_current_lang, tr
 from commod.tools import xml_diff, xml_merge
-from commod.tools.xml_helpers import ActionType, Command, InvalidMergeCommandError
+from commod.tools.xml_helpers import ActionType, Command, InvalidMergeCommandError, compile_xpath
 
 logger = logging.getLogger("dem")
 
+# only cards of the current page are built, diffs of big files produce tens of thousands of commands
+COMMANDS_PAGE_SIZE = 100
+
 class ModdingTools(ft.Tabs):
     def __init__(self, app: "app_widgets.App", **kwargs) -> None:
         kwargs.setdefault("padding", ft.padding.all(10))
@@ -137,20 +141,18 @@ class MergeTool(ft.Column):
         self.differs = {}
         if diff_guides_path.exists():
             try:
-                diff_guides = []
-                diff_guides_file = file_ops.read_json(diff_guides_path)
-                if isinstance(diff_guides, list):
-                    diff_guides = [xml_diff.DiffGuide(**config) for config in diff_guides_file]
-                    self.differs = {guide.root_tag: xml_diff.Differ(guide) for guide in diff_guides}
-                else:
-                    raise TypeError("Incorrect diff guide provided!")
+                diff_guides = xml_diff.read_diff_guides(diff_guides_path)
+                self.differs = {guide.root_tag: xml_diff.Differ(guide) for guide in diff_guides}
             except (json.decoder.JSONDecodeError, AssertionError, ValueError, TypeError):
                     logger.exception("Failed to load a diff guide!")
 
         logger.info(f"Loaded {len(self.differs)} differ schemes")
+        self.source_tree_cache = xml_diff.AnnotatedTreeCache(
+            Path(InstallationContext.get_local_config_path(), "diff_cache"))
 
         self.command_preview = CommandPreview(modding_tools=self)
-        self.current_command_card: CommandCard | None = None
+        self.current_command: Command | None = None
+        self.commands_page = 0
         self.commands_view = ft.ListView(
             controls=[ft.Container(
                  ft.Placeholder(color=ft.Colors.SECONDARY_CONTAINER),
@@ -158,6 +160,14 @@ class MergeTool(ft.Column):
             padding=ft.padding.only(right=10))
         self.commands_container = ft.Container(
             self.commands_view, expand=True)
+        self.first_page_btn = ft.IconButton(ft.Icons.FIRST_PAGE, data=0, on_click=self.switch_page)
+        self.previous_page_btn = ft.IconButton(ft.Icons.CHEVRON_LEFT, on_click=self.switch_page)
+        self.next_page_btn = ft.IconButton(ft.Icons.CHEVRON_RIGHT, on_click=self.switch_page)
+        self.last_page_btn = ft.IconButton(ft.Icons.LAST_PAGE, on_click=self.switch_page)
+        self.page_text = ft.Text()
+        self.pages_row = ft.Row([self.first_page_btn, self.previous_page_btn, self.page_text,
+                                 self.next_page_btn, self.last_page_btn],
+                                alignment=ft.MainAxisAlignment.CENTER, spacing=0, visible=False)
 
         self.source_path: Path | None = None
         self.modded_path: Path | None = None
@@ -191,6 +201,8 @@ class MergeTool(ft.Column):
         self.source_tree_map: dict[str, objectify.ObjectifiedElement] = {}
         self.modded_tree_map: dict[str, objectify.ObjectifiedElement] = {}
         self.commands: list[Command] = []
+        # indexes of selected commands, checkboxes only exist for the cards of current page
+        self.selected_commands: set[int] = set()
         self.preloaded_commands: dict[str, list[Command]] = {}
 
         self.command_counter = CircleCounter()
@@ -218,22 +230,61 @@ class MergeTool(ft.Column):
             btn.update()
 
     def select_invert(self, e: ft.ControlEvent) -> None:
-        for card in self.commands_view.controls:
-            if isinstance(card, CommandCard):
-                card.checkbox.value = not card.checkbox.value
-        self.commands_view.update()
+        self.selected_commands.symmetric_difference_update(range(len(self.commands)))
+        self.refresh_checkboxes()
 
     def select_all(self, e: ft.ControlEvent) -> None:
-        for card in self.commands_view.controls:
-            if isinstance(card, CommandCard):
-                card.checkbox.value = True
-        self.commands_view.update()
+        self.selected_commands.update(range(len(self.commands)))
+        self.refresh_checkboxes()
 
     def deselect_all(self, e: ft.ControlEvent) -> None:
+        self.selected_commands.clear()
+        self.refresh_checkboxes()
+
+    def refresh_checkboxes(self) -> None:
         for card in self.commands_view.controls:
             if isinstance(card, CommandCard):
-                card.checkbox.value = False
+                card.checkbox.value = card.index in self.selected_commands
+        self.commands_view.update()
+
+    def toggle_selection(self, index: int, selected: bool) -> None:
+        if selected:
+            self.selected_commands.add(index)
+        else:
+            self.selected_commands.discard(index)
+
+    @property
+    def pages_count(self) -> int:
+        return max(1, -(-len(self.commands) // COMMANDS_PAGE_SIZE))
+
+    def build_page(self) -> None:
+        """Build cards only for the commands of the current page."""
+        first_index = self.commands_page * COMMANDS_PAGE_SIZE
+        page_commands = self.commands[first_index:first_index + COMMANDS_PAGE_SIZE]
+        self.commands_view.controls = [
+            CommandCard(self, cmd, index) for index, cmd in enumerate(page_commands, start=first_index)]
+        self.update_pages_row()
+
+    def update_pages_row(self) -> None:
+        last_page = self.pages_count - 1
+        first_index = self.commands_page * COMMANDS_PAGE_SIZE
+        last_index = min(first_index + COMMANDS_PAGE_SIZE, len(self.commands))
+        self.page_text.value = f"{first_index + 1}-{last_index} / {len(self.commands)}"
+        self.previous_page_btn.data = max(self.commands_page - 1, 0)
+        self.next_page_btn.data = min(self.commands_page + 1, last_page)
+        self.last_page_btn.data = last_page
+        self.first_page_btn.disabled = self.previous_page_btn.disabled = self.commands_page == 0
+        self.next_page_btn.disabled = self.last_page_btn.disabled = self.commands_page == last_page
+        self.pages_row.visible = last_page > 0
+
+    def switch_page(self, e: ft.ControlEvent) -> None:
+        if e.control.data is None or e.control.data == self.commands_page:
+            return
+        self.commands_page = e.control.data
+        self.build_page()
+        self.commands_view.scroll_to(offset=0, duration=0)
         self.commands_view.update()
+        self.pages_row.update()
 
     def close_bottom_sheet(self, e: ft.ControlEvent) -> None:
         with contextlib.suppress(ValueError):
@@ -287,8 +338,7 @@ class MergeTool(ft.Column):
             self.show_bottom_sheet(tr("no_selected"))
             return
 
-        cmds = [cmd_card.command for cmd_card in self.commands_view.controls
-                if isinstance(cmd_card, CommandCard) and cmd_card.checkbox.value]
+        cmds = [self.commands[index] for index in sorted(self.selected_commands)]
 
         if not cmds:
             self.show_bottom_sheet(tr("no_selected"))
@@ -390,6 +440,7 @@ class MergeTool(ft.Column):
                     ft.Row([ft.Text(tr("command_list"))],
                            alignment=ft.MainAxisAlignment.CENTER),
                     self.commands_container,
+                    self.pages_row,
                     ], expand=1, horizontal_alignment=ft.CrossAxisAlignment.CENTER),
                 ft.Column([
                     ft.Text(tr("command_preview")),
@@ -421,16 +472,15 @@ class MergeTool(ft.Column):
         ]
 
     def preview_current_node(self) -> None:
-        if self.current_command_card is None:
+        if self.current_command is None:
             return
 
-        self.current_command_card.elevation = 0
-        self.current_command_card.update()
-        cmd = self.current_command_card.command
+        cmd = self.current_command
         self.command_preview.update()
 
+        # copies of nodes are only made for the previewed command
         if cmd.source_node is not None:
-            self.source_node_view.node = cmd.source_node
+            self.source_node_view.node = self.differ.get_node_copy(cmd.source_node)
             self.source_node_view.count = cmd.existing_count
         else:
             self.source_node_view.node = None
@@ -438,30 +488,43 @@ class MergeTool(ft.Column):
         self.source_node_view.file_path = self.source_path
         self.source_node_view.update()
 
-        self.modded_node_view.node = cmd.modded_node if cmd.modded_node is not None else None
+        if cmd.modded_node is not None:
+            self.modded_node_view.node = self.differ.get_node_copy(cmd.modded_node)
+        else:
+            self.modded_node_view.node = None
         self.modded_node_view.count = cmd.desired_count
         self.modded_node_view.file_path = self.modded_path
         self.modded_node_view.update()
 
     def click_command(self, e: ft.ControlEvent) -> None:
-        if self.current_command_card is not None:
-            self.current_command_card.elevation = 7
-            self.current_command_card.update()
-
-        self.current_command_card = e.control.parent
+        for card in self.commands_view.controls:
+            if isinstance(card, CommandCard) and card.command is self.current_command:
+                card.elevation = 7
+                card.update()
+
+        card = e.control.parent
+        card.elevation = 0
+        card.update()
+        self.current_command = card.command
         self.preview_current_node()
 
     def secondary_click_command(self, e: ft.ControlEvent) -> None:
-        e.control.parent.checkbox.value = not e.control.parent.checkbox.value
-        e.control.parent.update()
+        card = e.control.parent
+        card.checkbox.value = not card.checkbox.value
+        self.toggle_selection(card.index, card.checkbox.value)
+        card.update()
 
     def cleanup(self, e: ft.ControlEvent | None = None) -> None:
         self.commands_container.content = None
         self.commands_container.update()
-        self.current_command_card = None
+        self.current_command = None
         self.commands_view.controls.clear()
         self.commands.clear()
+        self.selected_commands.clear()
         self.preloaded_commands.clear()
+        self.commands_page = 0
+        self.update_pages_row()
+        self.pages_row.update()
         self.command_preview.update()
 
         self.source_node_view.reset()
@@ -500,10 +563,14 @@ class MergeTool(ft.Column):
 
         self.toggle_output_btns(enable=False)
 
-        self.current_command_card = None
+        self.current_command = None
         self.commands_view.controls.clear()
         self.commands.clear()
+        self.selected_commands.clear()
         self.preloaded_commands.clear()
+        self.commands_page = 0
+        self.update_pages_row()
+        self.pages_row.update()
 
         self.command_counter.count = 0
         self.node_counter.count = 0
@@ -516,22 +583,23 @@ class MergeTool(ft.Column):
         self.commands_container.update()
 
         try:
-            self.source_tree = parse_ops.xml_to_objfy(self.source_path_field.value)
-            self.modded_tree = parse_ops.xml_to_objfy(self.modded_path_field.value)
-            if self.source_tree.tag != self.modded_tree.tag:
-                raise ValueError(
-                    "Can't produce diff for trees with different root tags: "
-                    f"'{self.source_tree.tag}' vs '{self.modded_tree.tag}'")
-
-            if self.source_tree.xpath(".//*[@_Action]"):
-                raise ValueError(
-                    f"Can't produce diff for file containing commands:\n> {self.source_path_field.value}"
-                )
+            self.source_path = Path(self.source_path_field.value)
+            self.modded_path = Path(self.modded_path_field.value)
+            self.modded_tree = parse_ops.xml_to_objfy(self.modded_path)
             if self.modded_tree.xpath(".//*[@_Action]"):
                 raise ValueError(
                     f"Can't produce diff for file containing commands:\n> {self.modded_path_field.value}"
                 )
 
+            if differ := self.differs.get(str(self.modded_tree.tag)):
+                self.differ = differ
+            else:
+                self.show_bottom_sheet(tr("using_fallback_differ"))
+                logger.info("Unknown file type, diffs will be unusable")
+                self.differ = xml_diff.Differ(
+                    xml_diff.DiffGuide(root_tag=str(self.modded_tree.tag)))
+
+            preload_paths = []
             if self.preload_commands_field.value and not self.preload_commands_field.disabled:
                 for source_file_path in self.preload_commands_field.value.split(","):
                     source_file = Path(source_file_path.strip())
@@ -541,11 +609,29 @@ class MergeTool(ft.Column):
                         logger.warning(f"Incorrect file found in preload commands: '{source_file}', skipping")
                         self.cleanup()
                         raise InvalidMergeCommandError
+                    preload_paths.append(source_file)
+
+            parallel_diff = xml_diff.is_parallel_diff_preferred(self.source_path, self.modded_path)
+
+            # source file and preloaded commands rarely change between diffs,
+            # so annotated source tree is reused while they stay the same
+            cache_key = xml_diff.AnnotatedTreeCache.get_key(self.source_path, preload_paths,
+                                                            self.differ.diff_guide)
+            if cached := self.source_tree_cache.get(cache_key):
+                self.source_tree, self.preloaded_counter.count = cached
+            else:
+                self.source_tree = parse_ops.xml_to_objfy(self.source_path)
+                if self.source_tree.xpath(".//*[@_Action]"):
+                    raise ValueError(
+                        f"Can't produce diff for file containing commands:\n> {self.source_path_field.value}"
+                    )
+
+                for source_file in preload_paths:
                     preloaded_commands = parse_ops.xml_to_objfy(source_file)
                     if preloaded_commands.tag != self.source_tree.tag:
                         await self.app.show_alert(
                             tr("incorrect_commands_for_source",
-                            cmd_path=source_file_path))
+                            cmd_path=str(source_file)))
                     else:
                         try:
                             commands = xml_merge.parse_command_tree(
@@ -553,37 +639,35 @@ class MergeTool(ft.Column):
                             self.preloaded_commands[str(source_file)] = commands
                         except InvalidMergeCommandError as ex:
                             await self.app.show_alert(tr("existing_command_reading_error") +
-                                                      f":\n\n{source_file_path}\n",
+                                                      f":\n\n{source_file}\n",
                                                       str(ex), allow_copy=True)
                             logger.exception("Can't load existing files or commands")
                             self.cleanup()
                             return
-            try:
-                for key, command_list in self.preloaded_commands.items():
-                    logger.info(f"Attempting to apply commands from {key}")
-                    xml_merge.apply_commands(self.source_tree, command_list)
-                    self.preloaded_counter.count += len(command_list)
-                await asyncio.sleep(0.001)
-            except Exception as ex:
-                await self.app.show_alert(tr("unable_to_apply_commands",
-                                             target=self.source_path_field.value), str(ex),
-                                          allow_copy=True)
-                logger.exception("Unable to apply commands to source tree")
-                self.cleanup()
-                return
+                try:
+                    for key, command_list in self.preloaded_commands.items():
+                        logger.info(f"Attempting to apply commands from {key}")
+                        xml_merge.apply_commands(self.source_tree, command_list)
+                        self.preloaded_counter.count += len(command_list)
+                    await asyncio.sleep(0.001)
+                except Exception as ex:
+                    await self.app.show_alert(tr("unable_to_apply_commands",
+                                                 target=self.source_path_field.value), str(ex),
+                                              allow_copy=True)
+                    logger.exception("Unable to apply commands to source tree")
+                    self.cleanup()
+                    return
 
-            if differ := self.differs.get(str(self.source_tree.tag)):
-                self.differ = differ
-            else:
-                self.show_bottom_sheet(tr("using_fallback_differ"))
-                logger.info("Unknown file type, diffs will be unusable")
-                self.differ = xml_diff.Differ(
-                    xml_diff.DiffGuide(root_tag=str(self.source_tree.tag)))
+                self.differ.annotate_tree(self.source_tree)
+                self.source_tree_cache.put(cache_key, self.source_tree, self.preloaded_counter.count)
 
-            self.differ.annotate_tree(self.source_tree)
-            self.differ.annotate_tree(self.modded_tree)
-            self.source_path = Path(self.source_path_field.value)
-            self.modded_path = Path(self.modded_path_field.value)
+            if self.source_tree.tag != self.modded_tree.tag:
+                raise ValueError(
+                    "Can't produce diff for trees with different root tags: "
+                    f"'{self.source_tree.tag}' vs '{self.modded_tree.tag}'")
+
+            # nested nodes are annotated during incremental diff, only for the changed top level nodes
+            self.differ.annotate_tree(self.modded_tree, nested=False)
         except UnicodeDecodeError:
             await self.app.show_alert(tr("cant_load_files_for_diffing"),
                                       f'{tr("unsupported_file_or_encoding")}:\n> '
@@ -609,7 +693,7 @@ class MergeTool(ft.Column):
         start = time.perf_counter()
 
         commands_generator = self.differ.calculate_diff(
-            self.source_tree, self.modded_tree)
+            self.source_tree, self.modded_tree, parallel=parallel_diff, incremental=True)
 
         total_processed = 0
         try:
@@ -618,9 +702,8 @@ class MergeTool(ft.Column):
                 cmd = next(commands_generator)
                 total_processed += 1
             self.commands.append(cmd)
-            cmd_card = CommandCard(self, cmd)
-            self.current_command_card = cmd_card
-            self.commands_view.controls.append(cmd_card)
+            self.current_command = cmd
+            self.commands_view.controls.append(CommandCard(self, cmd, index=0))
             self.command_counter.count = len(self.commands)
             self.node_counter.count = total_processed
             self.commands_view.update()
@@ -651,11 +734,15 @@ class MergeTool(ft.Column):
                     continue
 
                 self.commands.append(cmd)
-                self.commands_view.controls.append(CommandCard(self, cmd))
+                # first page is filled while diffing, cards for the rest are built when switching pages
+                if len(self.commands) <= COMMANDS_PAGE_SIZE:
+                    self.commands_view.controls.append(CommandCard(self, cmd, len(self.commands) - 1))
 
                 if (time.perf_counter() - last_upd_cmds) > self.node_counter.update_timeout:
                     self.command_counter.count = len(self.commands)
+                    self.update_pages_row()
                     self.commands_view.update()
+                    self.pages_row.update()
                     await asyncio.sleep(0.001)
                     last_upd_cmds = time.perf_counter()
 
@@ -670,12 +757,15 @@ class MergeTool(ft.Column):
 
         logger.debug(f"Generated commands from diffs in "
                       f"{round(time.perf_counter() - start, 3)} seconds")
+        logger.debug(f"XPath cache stats: {compile_xpath.cache_info()}")
 
         self.command_counter.count = len(self.commands)
         self.command_counter.counting = False
         self.node_counter.count = total_processed
         self.node_counter.counting = False
+        self.update_pages_row()
         self.commands_view.update()
+        self.pages_row.update()
         self.set_last_differ_paths_to_config()
         self.toggle_output_btns(enable=True)
 
@@ -686,7 +776,7 @@ class CommandPreview(ft.Container):
         self.expand = True
 
     def before_update(self) -> None:
-        if self.modding_tools.current_command_card is None:
+        if self.modding_tools.current_command is None:
             self.content = ft.Column([
                     ft.Row([
                         ft.Container(
@@ -697,7 +787,7 @@ class CommandPreview(ft.Container):
                     scroll=ft.ScrollMode.AUTO)
             return
 
-        cmd = self.modding_tools.current_command_card.command
+        cmd = self.modding_tools.current_command
         serizalized_cmd = xml_diff.Differ.serialize_command(cmd) #, keep_attrs=["_DuplicateCount"])
         objectify.deannotate(serizalized_cmd, cleanup_namespaces=True)
 
@@ -755,7 +845,7 @@ class NodePreview(ft.Container):
             padding=ft.padding.symmetric(horizontal=10, vertical=3))
 
     def before_update(self) -> None:
-        if not self.modding_tools.current_command_card:
+        if self.modding_tools.current_command is None:
             self.reset()
             return
 
@@ -871,10 +961,11 @@ class CircleCounter(ft.Stack):
             self.ring.visible = False
 
 class CommandCard(ft.Card):
-    def __init__(self, modding_tools: "MergeTool", command: Command, **kwargs) -> None:
-        super().__init__(**kwargs, elevation=7)
+    def __init__(self, modding_tools: "MergeTool", command: Command, index: int, **kwargs) -> None:
+        super().__init__(**kwargs, elevation=0 if command is modding_tools.current_command else 7)
         self.modding_tools = modding_tools
         self.command = command
+        self.index = index
         if command.action in [ActionType.ADD,
                               ActionType.REPLACE,
                               ActionType.ADD_OR_REPLACE]:
@@ -886,7 +977,8 @@ class CommandCard(ft.Card):
 
         self.surface_tint_color = type_color
 
-        self.checkbox = ft.Checkbox(scale=0.9)
+        self.checkbox = ft.Checkbox(scale=0.9, value=index in modding_tools.selected_commands,
+                                    on_change=self.toggle_selection)
         self.content = ft.GestureDetector(
             ft.Container(ft.Column([
                 ft.Row([self.checkbox,
@@ -899,4 +991,5 @@ class CommandCard(ft.Card):
             on_secondary_tap=self.modding_tools.secondary_click_command,
             mouse_cursor=ft.MouseCursor.CLICK)
 
-
+    def toggle_selection(self, e: ft.ControlEvent) -> None:
+        self.modding_tools.toggle_selection(self.index, bool(self.checkbox.value))
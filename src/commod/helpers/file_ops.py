@@ -1,21 +1,32 @@
 # ruff: noqa: E721
 
 import asyncio
+import contextvars
+import copy
+import errno
 import json
 import logging
 import math
+import multiprocessing
 import os
 import platform
 import shutil
 import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import typing
 import zipfile
-from collections.abc import Awaitable, Callable, Iterable, Sequence
+from collections import Counter
+from collections.abc import Awaitable, Callable, Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
 from math import ceil
 from pathlib import Path
-from typing import Any
+from typing import Any, Self
 
 import aiofiles
 import psutil
@@ -25,16 +36,43 @@ from flet import Text
 from lxml import etree, objectify
 
 from commod.game.data import ENCODING
-from commod.helpers.parse_ops import beautify_machina_xml, xml_to_objfy
+from commod.helpers.parse_ops import iter_machina_xml, xml_to_objfy
 
 logger = logging.getLogger("dem")
 
 SUPPORTED_IMG_TYPES = (".svg", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp")
 RESOLUTION_OPTION_LIST_SIZE = 5
 
-def process_xml_tree(objectify_tree: objectify.ObjectifiedElement,
-                     machina_beautify: bool = True,
-                     use_utf: bool = False) -> bytes:
+# copy workers for solid state drives, spinning disks get a couple to not thrash the heads
+COPY_WORKERS_SSD = 8
+COPY_WORKERS_HDD = 2
+# small files are copied in batches by a single worker, to not pay for a thread hand-off per file
+COPY_BATCH_MAX_BYTES = 4 * 1024 * 1024
+COPY_BATCH_MAX_FILES = 64
+# progress is reported when enough data was copied or enough time passed since last report
+COPY_PROGRESS_BYTES = 16 * 1024 * 1024
+COPY_PROGRESS_INTERVAL = 0.1
+# suffix of the temporary file next to destination, which atomically replaces it when fully written
+ATOMIC_COPY_SUFFIX = ".commod_tmp"
+# buffer for plain copies, when none of the zero-copy methods are supported
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+# archive members are decompressed and written by chunks of this size
+ZIP_EXTRACT_CHUNK_SIZE = 1024 * 1024
+# Linux ioctl sharing extents of the source file with destination, on btrfs and XFS
+FICLONE = 0x40049409
+# errors meaning that copy method can't be used for the pair of files, rather than failed copy
+COPY_METHOD_UNSUPPORTED_ERRORS = frozenset(
+    code for code in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF,
+                      errno.EOPNOTSUPP, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)))
+
+# Parsed xml files which are read many times during the session, with mtime and size they were read at
+_xml_cache: dict[str, tuple[tuple[int, int], objectify.ObjectifiedElement]] = {}
+_xml_cache_lock = threading.Lock()
+
+def iter_xml_tree_chunks(objectify_tree: objectify.ObjectifiedElement,
+                         machina_beautify: bool = True,
+                         use_utf: bool = False) -> Iterator[bytes]:
+    """Serialize ObjectifiedElement tree, yielding the result in chunks."""
     if use_utf:
         doctype = ""
         encoding = "utf-8"
@@ -42,15 +80,25 @@ def process_xml_tree(objectify_tree: objectify.ObjectifiedElement,
         doctype = f'<?xml version="1.0" encoding="{ENCODING}" standalone="yes" ?>'
         encoding = ENCODING
 
+    if machina_beautify:
+        yield from iter_machina_xml(objectify_tree, encoding=encoding, doctype=doctype)
+        return
+
     etree.indent(objectify_tree, space="    ")
-    xml_string = etree.tostring(
+    yield etree.tostring(
         objectify_tree,
         pretty_print=True,
         xml_declaration=False,
         doctype=doctype,
         encoding=encoding)
 
-    return beautify_machina_xml(xml_string) if machina_beautify else xml_string
+def process_xml_tree(objectify_tree: objectify.ObjectifiedElement,
+                     machina_beautify: bool = True,
+                     use_utf: bool = False) -> bytes:
+    return b"".join(iter_xml_tree_chunks(
+        objectify_tree,
+        machina_beautify=machina_beautify,
+        use_utf=use_utf))
 
 def write_xml_to_file(
     objectify_tree: objectify.ObjectifiedElement,
@@ -62,10 +110,11 @@ def write_xml_to_file(
     files by default. Can skip beautifier and save raw lxml formated file.
     """
     with Path(path).open("wb") as fh:
-        fh.write(process_xml_tree(
+        fh.writelines(iter_xml_tree_chunks(
             objectify_tree,
             machina_beautify=machina_beautify,
             use_utf=use_utf))
+    update_cached_xml(objectify_tree, path)
 
 
 async def write_xml_to_file_async(
@@ -80,10 +129,12 @@ async def write_xml_to_file_async(
     formated file.
     """
     async with aiofiles.open(path, mode="wb") as fh:
-        await fh.write(process_xml_tree(
-            objectify_tree,
-            machina_beautify=machina_beautify,
-            use_utf=use_utf))
+        for chunk in iter_xml_tree_chunks(
+                objectify_tree,
+                machina_beautify=machina_beautify,
+                use_utf=use_utf):
+            await fh.write(chunk)
+    update_cached_xml(objectify_tree, path)
 
 def open_dir_in_os(directory_path: str | Path) -> None:
     """Open directory in Windows Explorer or OS specific equiavalents."""
@@ -151,40 +202,241 @@ async def copy_from_to_async(from_path_list: list[str],
                 await callback_progbar(file_num, files_count, sfile, file_size)
                 file_num += 1
 
-async def copy_relative_paths_and_call_async(
-        relative_path: Path,
-        file_num: list[int],
-        base_from_path: str | Path, base_to_path: str | Path,
-        files_count: int,
-        callback_progbar: Callable[[int, int, str, float], Awaitable[None]]) -> None:
-    from_path = Path(base_from_path, relative_path)
-    to_path = Path(base_to_path, relative_path)
-    # TODO: rethink if something this ugly is really required \/
-    # Note: file num is a dirty hack to pass pointer to mutable int value (index of current file)
-    file_size = round(from_path.stat().st_size / 1024, 2)
+@dataclass(slots=True)
+class CopyTask:
+    source: str
+    destination: str
+    size: int
+
+
+def scan_copy_tree(from_path: str | Path, to_path: str | Path,
+                   tasks: list[CopyTask], dest_dirs: list[str]) -> None:
+    """Collect files to copy and directories to create with a single walk of the tree.
+
+    Files starting with underscore are skipped, as those are mod service files.
+    """
+    pending_dirs = [(str(from_path), str(to_path))]
+    while pending_dirs:
+        from_dir, to_dir = pending_dirs.pop()
+        dest_dirs.append(to_dir)
+        with os.scandir(from_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pending_dirs.append((entry.path, os.path.join(to_dir, entry.name)))
+                elif not entry.name.startswith("_"):
+                    tasks.append(CopyTask(entry.path, os.path.join(to_dir, entry.name),
+                                          entry.stat().st_size))
+
+
+def get_copy_workers_count(path: str | Path) -> int:
+    """Return number of parallel copies worth doing for the drive of the path."""
+    if platform.system() != "Linux":
+        return COPY_WORKERS_SSD
     try:
-        await asyncio.to_thread(shutil.copy2, from_path, to_path)
-    except PermissionError:
-        msg = f"Can't overwrite path '{to_path}', this file is blocked by something, possibly opened"
-        raise PermissionError(msg)  # noqa: B904
-    await callback_progbar(file_num[0], files_count, from_path.name, file_size)
-    await asyncio.sleep(0)
-    file_num[0] += 1
-
-async def copy_file_and_call_async(
-        path: str, file_num: list[int],
-        single_file: str,
-        from_path: str, to_path: str,
-        files_count: int,
-        callback_progbar: Callable[[int, int, str, float], Awaitable[None]]) -> None:
-    # TODO: rethink if something this ugly is really required \/
-    # Note: file num is a dirty hack to pass pointer to mutable int value (index of current file)
-    dest_file = os.path.join(path.replace(from_path, to_path), single_file)
-    file_size = round(Path(os.path.join(path, single_file)).stat().st_size / 1024, 2)
-    await asyncio.to_thread(shutil.copy2, os.path.join(path, single_file), dest_file)
-    await callback_progbar(file_num[0], files_count, single_file, file_size)
-    await asyncio.sleep(0)
-    file_num[0] += 1
+        device = os.stat(path).st_dev
+        block_path = Path(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+        # partitions don't have a queue of their own, it belongs to the parent disk
+        queue_path = block_path / "queue"
+        if not queue_path.exists():
+            queue_path = block_path.resolve().parent / "queue"
+        rotational = (queue_path / "rotational").read_text().strip() == "1"
+    except (OSError, ValueError):
+        return COPY_WORKERS_SSD
+    return COPY_WORKERS_HDD if rotational else COPY_WORKERS_SSD
+
+
+def is_process_pool_supported() -> bool:
+    """Return False if worker processes would start the frozen app again instead of a worker.
+
+    Nuitka handles multiprocessing in compiled builds itself, other frozen builds only
+    support spawned workers on Windows, through freeze_support in the launcher.
+    """
+    if "__compiled__" in globals() or not getattr(sys, "frozen", False):
+        return True
+    return platform.system() == "Windows" or multiprocessing.get_start_method() == "fork"
+
+
+def batch_copy_tasks(tasks: Sequence[CopyTask]) -> list[list[CopyTask]]:
+    """Group small files into batches, big files get a batch of their own."""
+    batches = []
+    batch: list[CopyTask] = []
+    batch_size = 0
+    for task in tasks:
+        if batch and (batch_size + task.size > COPY_BATCH_MAX_BYTES or len(batch) >= COPY_BATCH_MAX_FILES):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(task)
+        batch_size += task.size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class CopyMethod(Enum):
+    REFLINK = "reflink"
+    COPY_FILE_RANGE = "copy_file_range"
+    SENDFILE = "sendfile"
+    BUFFERED = "buffered"
+
+
+class CopyMethodUnsupportedError(Exception):
+    ...
+
+
+def copy_reflink(fsrc: typing.BinaryIO, fdst: typing.BinaryIO, size: int) -> None:
+    import fcntl  # noqa: PLC0415
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    if os.fstat(fdst.fileno()).st_size != size:
+        raise CopyMethodUnsupportedError(f"Reflink produced file of unexpected size, expected {size}")
+
+
+def copy_with_file_range(fsrc: typing.BinaryIO, fdst: typing.BinaryIO, size: int) -> None:
+    copied = 0
+    while copied < size:
+        # some file systems report success without copying anything
+        if not (chunk := os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                            min(COPY_BUFFER_SIZE * 8, size - copied))):
+            raise CopyMethodUnsupportedError(f"copy_file_range stopped after {copied} of {size} bytes")
+        copied += chunk
+
+
+def copy_with_sendfile(fsrc: typing.BinaryIO, fdst: typing.BinaryIO, size: int) -> None:
+    offset = 0
+    while offset < size:
+        if not (sent := os.sendfile(fdst.fileno(), fsrc.fileno(), offset,
+                                    min(COPY_BUFFER_SIZE * 8, size - offset))):
+            raise CopyMethodUnsupportedError(f"sendfile stopped after {offset} of {size} bytes")
+        offset += sent
+
+
+def copy_buffered(fsrc: typing.BinaryIO, fdst: typing.BinaryIO, size: int) -> None:
+    shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+
+
+CopyBackend = Callable[[typing.BinaryIO, typing.BinaryIO, int], None]
+
+def get_copy_backends() -> list[tuple[CopyMethod, CopyBackend]]:
+    """Return copy methods available on the platform, from the cheapest to the most expensive one."""
+    backends: list[tuple[CopyMethod, CopyBackend]] = []
+    if platform.system() == "Linux":
+        backends.append((CopyMethod.REFLINK, copy_reflink))
+        if hasattr(os, "copy_file_range"):
+            backends.append((CopyMethod.COPY_FILE_RANGE, copy_with_file_range))
+        backends.append((CopyMethod.SENDFILE, copy_with_sendfile))
+    backends.append((CopyMethod.BUFFERED, copy_buffered))
+    return backends
+
+COPY_BACKENDS = get_copy_backends()
+
+# methods found to be unsupported for pairs of source and destination devices
+_unsupported_copy_methods: dict[tuple[int, int], set[CopyMethod]] = {}
+
+
+def copy_file(source: str | Path, destination: str | Path) -> CopyMethod:
+    """Copy file with its metadata like shutil.copy2, using the cheapest method that works.
+
+    Methods which failed for a pair of devices are not tried again for it.
+    """
+    with open(source, "rb") as fsrc:
+        src_stat = os.fstat(fsrc.fileno())
+        # destination is truncated only after making sure it's not the source itself
+        dst_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        with open(dst_fd, "wb") as fdst:
+            dst_stat = os.fstat(dst_fd)
+            if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+                raise shutil.SameFileError(f"'{source}' and '{destination}' are the same file")
+            fdst.truncate()
+            devices = (src_stat.st_dev, dst_stat.st_dev)
+            unsupported = _unsupported_copy_methods.setdefault(devices, set())
+            for method, backend in COPY_BACKENDS:
+                if method in unsupported:
+                    continue
+                try:
+                    backend(fsrc, fdst, src_stat.st_size)
+                    break
+                except CopyMethodUnsupportedError as ex:
+                    reason: Exception = ex
+                except OSError as ex:
+                    if method is CopyMethod.BUFFERED or ex.errno not in COPY_METHOD_UNSUPPORTED_ERRORS:
+                        raise
+                    reason = ex
+                logger.debug(f"Copy method '{method.value}' is unsupported for devices {devices}: {reason}")
+                unsupported.add(method)
+                # method might have failed after a partial copy
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+    shutil.copystat(source, destination)
+    return method
+
+
+def copy_batch(batch: list[CopyTask]) -> Counter[CopyMethod]:
+    methods: Counter[CopyMethod] = Counter()
+    for task in batch:
+        try:
+            methods[copy_file(task.source, task.destination)] += 1
+        except PermissionError as ex:
+            msg = (f"Can't overwrite path '{task.destination}', "
+                   "this file is blocked by something, possibly opened")
+            raise PermissionError(msg) from ex
+    return methods
+
+
+def describe_copy_methods(methods: Counter[CopyMethod]) -> str:
+    return ", ".join(f"{method.value}: {count}" for method, count in methods.most_common())
+
+
+async def copy_files_async(
+        tasks: Sequence[CopyTask],
+        callback_progbar: Callable[[int, int, str, float], Awaitable[None]],
+        workers_count: int = COPY_WORKERS_SSD,
+        copy_batch_function: Callable[[list[CopyTask]], Counter[CopyMethod]] | None = None,
+        ) -> Counter[CopyMethod]:
+    """Copy files in batches with bounded number of worker threads, return counts of used copy methods.
+
+    Progress callback is throttled by amount of copied data and time,
+    and is always called for the last copied file.
+    Batches can be copied by a custom function, like the one recording replaced files in install journal.
+    """
+    if copy_batch_function is None:
+        copy_batch_function = copy_batch
+    methods: Counter[CopyMethod] = Counter()
+    if not tasks:
+        return methods
+    batches = batch_copy_tasks(tasks)
+    files_count = len(tasks)
+    copied_count = 0
+    reported_bytes = 0
+    last_report = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=min(workers_count, len(batches)), thread_name_prefix="copy")
+    pending: set[asyncio.Future[Counter[CopyMethod]]] = set()
+    try:
+        pending_batches = {loop.run_in_executor(executor, copy_batch_function, batch): batch
+                           for batch in batches}
+        pending = set(pending_batches)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                methods.update(future.result())
+                batch = pending_batches[future]
+                copied_count += len(batch)
+                reported_bytes += sum(task.size for task in batch)
+                now = time.perf_counter()
+                if (copied_count == files_count or reported_bytes >= COPY_PROGRESS_BYTES
+                        or now - last_report >= COPY_PROGRESS_INTERVAL):
+                    last_task = batch[-1]
+                    await callback_progbar(copied_count, files_count, Path(last_task.source).name,
+                                           round(last_task.size / 1024, 2))
+                    reported_bytes = 0
+                    last_report = now
+    finally:
+        for future in pending:
+            future.cancel()
+        # waiting for running batches blocks, so it's done outside of the event loop thread
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+    return methods
 
 
 async def copy_targets_from_to_async(
@@ -195,69 +447,85 @@ async def copy_targets_from_to_async(
 
     from_base_path = Path(from_base_path)
     to_base_path = Path(to_base_path)
-    files_count = len(targets_list)
-    file_num = []
-    file_num.append(1)
+    tasks = []
     for target in targets_list:
-        file_parent = (to_base_path / target).parent
-        file_parent.mkdir(parents=True, exist_ok=True)
+        from_path = from_base_path / target
+        to_path = to_base_path / target
+        to_path.parent.mkdir(parents=True, exist_ok=True)
+        tasks.append(CopyTask(str(from_path), str(to_path), from_path.stat().st_size))
+
+    methods = await copy_files_async(tasks, callback_progbar, get_copy_workers_count(to_base_path))
+    logger.debug(f"Copied {len(tasks)} targets to '{to_base_path}' ({describe_copy_methods(methods)})")
+
+def collect_copy_tasks(from_path_list: Sequence[str | Path], to_path: str | Path,
+                       exclude: Iterable[str | Path] = ()) -> tuple[list[CopyTask], list[str]]:
+    """Return files to copy from directories to the path and directories to create for them.
+
+    Files of later directories replace files of earlier ones, files with the destination
+    in exclude list are skipped.
+    """
+    tasks: list[CopyTask] = []
+    dest_dirs: list[str] = []
+    for from_path in from_path_list:
+        if os.path.isdir(from_path):
+            scan_copy_tree(from_path, to_path, tasks, dest_dirs)
+    # files are copied in parallel, so instead of relying on the copy order
+    # only the file from the last of source dirs is copied when they overlap
+    excluded = {os.path.normcase(os.path.normpath(path)) for path in exclude}
+    tasks = [task for key, task in {os.path.normcase(os.path.normpath(task.destination)): task
+                                    for task in tasks}.items()
+             if key not in excluded]
+    return tasks, dest_dirs
 
-    await asyncio.gather(*[
-        copy_relative_paths_and_call_async(
-            target, file_num,
-            from_base_path, to_base_path,
-            files_count,
-            callback_progbar) for target in targets_list])
 
 async def copy_from_to_async_fast(
         from_path_list: Sequence[str | Path],
         to_path: str | Path,
         callback_progbar: Callable[[int, int, str, float], Awaitable[None]]) -> None:
-    from_path_list = [str(path_entry) for path_entry in from_path_list]
-    to_path = str(to_path)
-
-    files_count = 0
+    """Copy contents of directories to the path, files of later directories replace files of earlier ones."""
     for from_path in from_path_list:
         logger.debug(f"Copying files from '{from_path}' to '{to_path}'")
-        files_count += count_files(from_path)
-    file_num = []
-    file_num.append(1)
-    for from_path in from_path_list:
-        for path, dirs, _ in os.walk(from_path):
-            for directory in dirs:
-                dest_dir = path.replace(from_path, to_path)
-                os.makedirs(os.path.join(dest_dir, directory), exist_ok=True)
-        for path, _, filenames in os.walk(from_path):
-            await asyncio.gather(*[
-                copy_file_and_call_async(path, file_num, single_file,
-                                         from_path, to_path, files_count,
-                                         callback_progbar) for single_file in filenames
-                                         if not single_file.startswith("_")])
+    tasks, dest_dirs = await asyncio.to_thread(collect_copy_tasks, from_path_list, to_path)
 
+    def make_dirs() -> None:
+        for dest_dir in dest_dirs:
+            os.makedirs(dest_dir, exist_ok=True)
+
+    await asyncio.to_thread(make_dirs)
+    workers_count = get_copy_workers_count(to_path)
+    start = time.perf_counter()
+    methods = await copy_files_async(tasks, callback_progbar, workers_count)
+    logger.debug(f"Copied {len(tasks)} files ({sum(task.size for task in tasks) / 1024 / 1024:.1f}MB) "
+                 f"with {workers_count} workers in {round(time.perf_counter() - start, 3)} seconds "
+                 f"({describe_copy_methods(methods)})")
 
-async def extract_files_from_zip(
-        archive: zipfile.ZipFile,
-        file_names: list[str],
-        path: str | Path,
-        callback: Callable | None = None,
-        files_num: int = 1) -> None:
-    for file_name_raw in file_names:
-        file_name = file_name_raw
-        data = archive.read(file_name)
-        try:
-            file_name.encode("cp437").decode("ascii")
-        except UnicodeDecodeError:
-            file_name = file_name.encode("cp437").decode("cp866")
-        except UnicodeEncodeError:
-            pass
-        filepath = Path(path, file_name)
-        if not filepath.parent.is_dir():
-            os.makedirs(filepath.parent, exist_ok=True)
 
-        async with aiofiles.open(str(filepath), "wb") as fd:
-            await fd.write(data)
-        if callback is not None:
-            await callback(files_num)
+def decode_zip_name(file_name: str) -> str:
+    """Return name of the archive member, names not flagged as utf-8 are usually in cp866."""
+    try:
+        file_name.encode("cp437").decode("ascii")
+    except UnicodeDecodeError:
+        file_name = file_name.encode("cp437").decode("cp866")
+    except UnicodeEncodeError:
+        pass
+    return file_name
+
+
+def extract_zip_batch(archive_path: str | Path, batch: list[CopyTask], readers: threading.local,
+                      opened_archives: list[zipfile.ZipFile]) -> None:
+    """Stream archive members to disk, source of every task is the name of the member.
+
+    Every worker thread reads the archive with its own handle, as ZipFile handle
+    can't be shared between threads reading different members.
+    """
+    archive: zipfile.ZipFile | None = getattr(readers, "archive", None)
+    if archive is None:
+        archive = zipfile.ZipFile(archive_path, "r")
+        readers.archive = archive
+        opened_archives.append(archive)
+    for task in batch:
+        with archive.open(task.source) as member, open(task.destination, "wb") as fh:
+            shutil.copyfileobj(member, fh, ZIP_EXTRACT_CHUNK_SIZE)
 
 
 async def extract_files_from_7z(
@@ -288,59 +556,74 @@ async def extract_archive_from_to(archive_path: str, to_path: str, callback: Cal
 async def extract_zip_from_to(archive_path: str | Path, to_path: str | Path,
                               callback: Callable | None = None,
                               loading_text: Text | None = None) -> None:
+    """Extract archive with a pool of worker threads, decompressing members in parallel.
+
+    Members are streamed to disk in chunks of fixed size, callback is called for every extracted batch.
+    """
     os.makedirs(to_path, exist_ok=True)
+    tasks: list[CopyTask] = []
+    total_size = 0
+    total_compressed_size = 0
+    compression_label = "ZIP"
     with zipfile.ZipFile(archive_path, "r") as archive:
-        only_files = []
-
-        total_size = 0
-        total_compressed_size = 0
-        compression_label = "ZIP"
-
-        namelist = archive.namelist()
-        workers = 100
-        chunksize = ceil(len(namelist) / workers)
-        if chunksize == 0:
-            chunksize = 1
-        tasks = []
-
-        for file in archive.filelist:
-            file_path = file.filename
+        for file in archive.infolist():
+            file_path = Path(to_path, decode_zip_name(file.filename))
             if file.is_dir():
-                try:
-                    file_path.encode("cp437").decode("ascii")
-                except UnicodeDecodeError:
-                    file_path = file_path.encode("cp437").decode("cp866")
-                except UnicodeEncodeError:
-                    pass
-                os.makedirs(Path(to_path) / file_path, exist_ok=True)
-            else:
-                only_files.append(file_path)
-                if loading_text is not None:
-                    total_size += file.file_size
-                    total_compressed_size += file.compress_size
-                    if compression_label == "ZIP":
-                        match file.compress_type:
-                            case 8:
-                                compression_label = "DEFLATE"
-                            case 12:
-                                compression_label = "BZIP2"
-                            case 14:
-                                compression_label = "LZMA"
-                            case _:
-                                pass
-
-        if loading_text is not None:
-            loading_text.value = (f"[{compression_label}] "
-                                  f"{total_compressed_size/1024/1024:.1f}MB -> "
-                                  f"{total_size/1024/1024:.1f}MB")
-            loading_text.update()
-            await asyncio.sleep(0)
-
-        files_num = len(only_files)
-        for i in range(0, files_num, chunksize):
-            file_names = only_files[i:(i + chunksize)]
-            tasks.append(extract_files_from_zip(archive, file_names, to_path, callback, files_num))
-        await asyncio.gather(*tasks)
+                os.makedirs(file_path, exist_ok=True)
+                continue
+            os.makedirs(file_path.parent, exist_ok=True)
+            tasks.append(CopyTask(file.filename, str(file_path), file.file_size))
+            total_size += file.file_size
+            total_compressed_size += file.compress_size
+            if compression_label == "ZIP":
+                match file.compress_type:
+                    case 8:
+                        compression_label = "DEFLATE"
+                    case 12:
+                        compression_label = "BZIP2"
+                    case 14:
+                        compression_label = "LZMA"
+                    case _:
+                        pass
+
+    if loading_text is not None:
+        loading_text.value = (f"[{compression_label}] "
+                              f"{total_compressed_size/1024/1024:.1f}MB -> "
+                              f"{total_size/1024/1024:.1f}MB")
+        loading_text.update()
+        await asyncio.sleep(0)
+    if not tasks:
+        return
+
+    start = time.perf_counter()
+    batches = batch_copy_tasks(tasks)
+    workers_count = min(os.cpu_count() or 1, get_copy_workers_count(to_path), len(batches))
+    files_num = len(tasks)
+    readers = threading.local()
+    opened_archives: list[zipfile.ZipFile] = []
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers_count, thread_name_prefix="unzip")
+    pending: set[asyncio.Future[None]] = set()
+    try:
+        pending_batches = {loop.run_in_executor(executor, extract_zip_batch,
+                                                archive_path, batch, readers, opened_archives): batch
+                           for batch in batches}
+        pending = set(pending_batches)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                future.result()
+                if callback is not None:
+                    await callback(files_num, len(pending_batches[future]))
+    finally:
+        for future in pending:
+            future.cancel()
+        # archives can be closed only when workers reading them are done
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+        for archive in opened_archives:
+            archive.close()
+    logger.debug(f"Extracted {files_num} files ({total_size / 1024 / 1024:.1f}MB) "
+                 f"with {workers_count} workers in {round(time.perf_counter() - start, 3)} seconds")
 
 
 async def extract_7z_from_to(archive_path: str | Path, to_path: str | Path,
@@ -465,8 +748,168 @@ def patch_offsets(f: typing.BinaryIO,
             raise TypeError("Unsuported type given")
 
 
+def _get_xml_cache_key(full_path: str | Path) -> str:
+    return os.path.normcase(os.path.abspath(full_path))
+
+
+def _get_file_stamp(full_path: str | Path) -> tuple[int, int]:
+    file_stat = Path(full_path).stat()
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+def read_xml_cached(full_path: str | Path) -> objectify.ObjectifiedElement:
+    """Return parsed xml file, reusing the previous parse while file is unchanged.
+
+    Cache entry is checked against modification time and size of the file.
+    Caller gets its own deep copy of the tree and is free to modify it.
+    """
+    cache_key = _get_xml_cache_key(full_path)
+    file_stamp = _get_file_stamp(full_path)
+    with _xml_cache_lock:
+        cached = _xml_cache.get(cache_key)
+    if cached is not None and cached[0] == file_stamp:
+        return copy.deepcopy(cached[1])
+
+    xml_tree = xml_to_objfy(full_path)
+    with _xml_cache_lock:
+        _xml_cache[cache_key] = (file_stamp, copy.deepcopy(xml_tree))
+    return xml_tree
+
+
+def update_cached_xml(objectify_tree: objectify.ObjectifiedElement, full_path: str | Path) -> None:
+    """Replace cached tree for the file after it was written, if file was read through the cache."""
+    cache_key = _get_xml_cache_key(full_path)
+    with _xml_cache_lock:
+        if cache_key not in _xml_cache:
+            return
+    file_stamp = _get_file_stamp(full_path)
+    tree_copy = copy.deepcopy(objectify_tree)
+    with _xml_cache_lock:
+        _xml_cache[cache_key] = (file_stamp, tree_copy)
+
+
+def clear_xml_cache() -> None:
+    with _xml_cache_lock:
+        _xml_cache.clear()
+
+
+def write_xml_to_file_atomic(
+        objectify_tree: objectify.ObjectifiedElement,
+        path: str | Path, machina_beautify: bool = True,
+        use_utf: bool = False) -> None:
+    """Write ObjectifiedElement tree to a temp file next to the target and rename it over the target.
+
+    File at path is either left untouched or fully replaced, never half-written.
+    """
+    path = Path(path)
+    temp_fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    temp_path = Path(temp_name)
+    try:
+        with os.fdopen(temp_fd, "wb") as fh:
+            fh.writelines(iter_xml_tree_chunks(
+                objectify_tree,
+                machina_beautify=machina_beautify,
+                use_utf=use_utf))
+        if path.exists():
+            shutil.copymode(path, temp_path)
+        temp_path.replace(path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    update_cached_xml(objectify_tree, path)
+
+
+class GameConfigTransaction:
+    """Collect all config.cfg changes made in the context and write the file once on exit.
+
+    Inside the transaction get_config returns a copy of the pending config with all changes
+    written by write_config so far. Config is written atomically when context exits without
+    an error, pending changes are discarded otherwise. Nested transactions for the same
+    game join the outer one.
+    """
+
+    def __init__(self, root_dir: str | Path) -> None:
+        self.config_path = Path(root_dir, "data", "config.cfg")
+        self.pending_config: objectify.ObjectifiedElement | None = None
+        self._outer: GameConfigTransaction | None = None
+        self._token: contextvars.Token | None = None
+
+    def __enter__(self) -> Self:
+        active = _active_config_transaction.get()
+        if active is not None and active.owns(self.config_path):
+            self._outer = active
+            return active
+        self._token = _active_config_transaction.set(self)
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: object) -> None:
+        if self._outer is not None:
+            self._outer = None
+            return
+        _active_config_transaction.reset(self._token)
+        self._token = None
+        if exc_type is not None:
+            if self.pending_config is not None:
+                logger.warning(f"Discarded config changes for '{self.config_path}' after an error")
+            self.pending_config = None
+            return
+        self.commit()
+
+    def owns(self, config_path: str | Path) -> bool:
+        return _get_xml_cache_key(config_path) == _get_xml_cache_key(self.config_path)
+
+    def get_config(self) -> objectify.ObjectifiedElement:
+        if self.pending_config is None:
+            return read_xml_cached(self.config_path)
+        return copy.deepcopy(self.pending_config)
+
+    def stage(self, config: objectify.ObjectifiedElement) -> None:
+        self.pending_config = copy.deepcopy(config)
+
+    def commit(self) -> None:
+        if self.pending_config is None:
+            return
+        write_xml_to_file_atomic(self.pending_config, self.config_path)
+        logger.debug(f"Config changes written to '{self.config_path}'")
+        self.pending_config = None
+
+
+_active_config_transaction: contextvars.ContextVar[GameConfigTransaction | None] = \
+    contextvars.ContextVar("active_config_transaction", default=None)
+
+
+def _get_config_transaction(config_path: Path) -> GameConfigTransaction | None:
+    active = _active_config_transaction.get()
+    if active is not None and active.owns(config_path):
+        return active
+    return None
+
+
 def get_config(root_dir: str | Path) -> objectify.ObjectifiedElement:
-    return xml_to_objfy(Path(root_dir, "data", "config.cfg"))
+    config_path = Path(root_dir, "data", "config.cfg")
+    transaction = _get_config_transaction(config_path)
+    if transaction is not None:
+        return transaction.get_config()
+    return read_xml_cached(config_path)
+
+
+def write_config(config: objectify.ObjectifiedElement, root_dir: str | Path) -> None:
+    """Write game config, or stage it until the end of GameConfigTransaction if one is active."""
+    config_path = Path(root_dir, "data", "config.cfg")
+    transaction = _get_config_transaction(config_path)
+    if transaction is not None:
+        transaction.stage(config)
+        return
+    write_xml_to_file_atomic(config, config_path)
+
+
+async def write_config_async(config: objectify.ObjectifiedElement, root_dir: str | Path) -> None:
+    config_path = Path(root_dir, "data", "config.cfg")
+    transaction = _get_config_transaction(config_path)
+    if transaction is not None:
+        transaction.stage(config)
+        return
+    await asyncio.to_thread(write_xml_to_file_atomic, config, config_path)
 
 
 def running_in_venv() -> bool:
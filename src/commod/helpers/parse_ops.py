@@ -1,14 +1,16 @@
 import argparse
+import codecs
 import html
 import re
-from collections.abc import Iterable
+import threading
+from collections.abc import Iterable, Iterator
 from functools import cache
 from pathlib import Path
 from typing import Any
 from urllib.parse import urlparse
 
 import markdownify
-from lxml import objectify
+from lxml import etree, objectify
 
 from commod.game import data
 
@@ -27,6 +29,26 @@ def init_input_parser() -> argparse.ArgumentParser:
 
     return parser
 
+def init_diff_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="commod diff", description="Generate merge commands for all changed xml files of the mod")
+    parser.add_argument("vanilla_dir",
+                        help="path to directory with original files, mirroring the game directory")
+    parser.add_argument("modded_dir", help="path to directory with modded files, with the same layout")
+    parser.add_argument("output_dir", help="path to directory for commands and merge instructions")
+    parser.add_argument("-workers", help="number of worker processes, defaults to the count of CPUs",
+                        type=int, default=None, required=False)
+
+    return parser
+
+def init_journal_parser(command: str) -> argparse.ArgumentParser:
+    descriptions = {"rollback": "Restore game files replaced by interrupted mod installation",
+                    "resume": "Finish interrupted mod installation, copying only files not replaced yet"}
+    parser = argparse.ArgumentParser(prog=f"commod {command}", description=descriptions[command])
+    parser.add_argument("game_dir", help="path to game directory")
+
+    return parser
+
 @cache
 def is_url_safe(url: str) -> bool:
     if url:
@@ -115,28 +137,83 @@ def find_element(
         return None
 
 
+# Beautifier works on chunks of serialized xml and yields output in chunks of about the same size
+BEAUTIFY_CHUNK_SIZE = 1024 * 1024
+MACHINA_INDENT = "    "
+
+
+def iter_chunks(data: bytes, chunk_size: int = BEAUTIFY_CHUNK_SIZE) -> Iterator[bytes]:
+    """Split bytes to chunks of fixed size without extra copies of the whole data."""
+    data_view = memoryview(data)
+    for i in range(0, len(data_view), chunk_size):
+        yield bytes(data_view[i:i + chunk_size])
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Split stream of byte chunks to lines, the same way as bytes.splitlines does for a whole string."""
+    remainder = b""
+    for chunk in chunks:
+        buffer = remainder + chunk
+        # line can only be split after the last line break, "\r" at the end can be a part of "\r\n"
+        cut = max(buffer.rfind(b"\n"), buffer.rfind(b"\r", 0, len(buffer) - 1)) + 1
+        if not cut:
+            remainder = buffer
+            continue
+        yield from buffer[:cut].splitlines()
+        remainder = buffer[cut:]
+    if remainder:
+        yield from remainder.splitlines()
+
+
+def _join_in_chunks(parts: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    output_parts = []
+    output_size = 0
+    for part in parts:
+        output_parts.append(part)
+        output_size += len(part)
+        if output_size >= chunk_size:
+            yield b"".join(output_parts)
+            output_parts.clear()
+            output_size = 0
+    if output_parts:
+        yield b"".join(output_parts)
+
+
 def beautify_machina_xml(xml_string: bytes) -> bytes:
     """Format and beautify XML string in the style similar to original Ex Machina dynamicscene.xml files."""
-    never_split_tags = {b"event", b"Point", b"Wheel"}
+    return b"".join(iter_beautify_machina_xml((xml_string,)))
+
+
+def iter_beautify_machina_xml(chunks: Iterable[bytes],
+                              output_chunk_size: int = BEAUTIFY_CHUNK_SIZE) -> Iterator[bytes]:
+    """Streaming beautify_machina_xml, takes serialized XML in chunks and yields formatted chunks."""
+    formatter = _MachinaLineFormatter()
+    yield from _join_in_chunks(map(formatter.format_line, iter_lines(chunks)), output_chunk_size)
+
+
+class _MachinaLineFormatter:
+    """Formats lines of indented lxml output one by one, keeping track of the previous lines."""
+
+    never_split_tags = frozenset((b"event", b"Point", b"Wheel"))
     xml_declaration_prefix = b"<?xml"
     xml_delcaration_suffix = b"?>"
     script_start_tag = b"<script>"
     script_end_tag = b"</script>"
-    indent_symbol = b"    "
+    indent_symbol = MACHINA_INDENT.encode()
 
-    beautified_parts = []
-    previous_line_indent = -1
-    inside_plaintext_block = False
-    plaintext_tag_indent = 0
-    plaintext_block_offset = None
+    def __init__(self) -> None:
+        self.previous_line_indent = -1
+        self.inside_plaintext_block = False
+        self.plaintext_tag_indent = 0
+        self.plaintext_block_offset = None
 
-    for raw_line in xml_string.splitlines():
+    def format_line(self, raw_line: bytes) -> bytes:
+        indent_symbol = self.indent_symbol
         line_stripped = raw_line.lstrip()
 
-        if (line_stripped.startswith(xml_declaration_prefix)
-           and line_stripped.endswith(xml_delcaration_suffix)):
-            beautified_parts.append(raw_line + b"\n\n")
-            continue
+        if (line_stripped.startswith(self.xml_declaration_prefix)
+           and line_stripped.endswith(self.xml_delcaration_suffix)):
+            return raw_line + b"\n\n"
 
         # calculating indent level of parent line to indent attributes
         # We use 4 spaces for indents
@@ -145,52 +222,235 @@ def beautify_machina_xml(xml_string: bytes) -> bytes:
         # Content in plain text blocks (scripts in triggers) will not be treated as xml,
         # but we still need to indent it correctly.
         # We will make sure that script is always indented once, not more or less
-        if inside_plaintext_block:
-            if line_stripped.startswith(script_end_tag):
-                inside_plaintext_block = False
-                line_indent = plaintext_tag_indent
-                previous_line_indent = 0
-                plaintext_tag_indent = 0
-                plaintext_block_offset = None
+        if self.inside_plaintext_block:
+            if line_stripped.startswith(self.script_end_tag):
+                self.inside_plaintext_block = False
+                line_indent = self.plaintext_tag_indent
+                self.previous_line_indent = 0
+                self.plaintext_tag_indent = 0
+                self.plaintext_block_offset = None
             else:
-                if plaintext_block_offset is None:
-                    plaintext_block_offset = previous_line_indent - line_indent + 1
+                if self.plaintext_block_offset is None:
+                    self.plaintext_block_offset = self.previous_line_indent - line_indent + 1
 
                 detabbed_line = raw_line.expandtabs(4) + b"\n"
                 if detabbed_line.isspace():
-                    beautified_parts.append(b"\n")
-                    continue
+                    return b"\n"
 
-                if plaintext_block_offset < 0:
-                    detabbed_line = detabbed_line[len(indent_symbol) * abs(plaintext_block_offset):]
-                else:
-                    detabbed_line = indent_symbol * plaintext_block_offset + detabbed_line
-                beautified_parts.append(detabbed_line)
-
-                continue
+                if self.plaintext_block_offset < 0:
+                    return detabbed_line[len(indent_symbol) * abs(self.plaintext_block_offset):]
+                return indent_symbol * self.plaintext_block_offset + detabbed_line
 
         # Format line based on tag type \ node being comment
         formatted_line = None
 
         tag_prefix = _extract_tag_prefix(line_stripped)
-        if line_stripped.startswith(b"<!--") or tag_prefix in never_split_tags:
+        if line_stripped.startswith(b"<!--") or tag_prefix in self.never_split_tags:
             formatted_line = line_indent * indent_symbol + line_stripped + b"\n"
         else:
             formatted_line = _split_tag_on_attributes(line_stripped, line_indent)
             formatted_line = line_indent * indent_symbol + formatted_line + b"\n"
 
         # Add blank line before tags at the same level (first tag of its tree level)
-        if line_indent == previous_line_indent:
+        if line_indent == self.previous_line_indent:
             formatted_line = b"\n" + formatted_line
 
-        beautified_parts.append(formatted_line)
-        previous_line_indent = line_indent
+        self.previous_line_indent = line_indent
+
+        if line_stripped.startswith(self.script_start_tag):
+            self.inside_plaintext_block = True
+            self.plaintext_tag_indent = line_indent
+
+        return formatted_line
+
+
+def iter_machina_xml(objectify_tree: objectify.ObjectifiedElement,
+                     encoding: str = data.ENCODING,
+                     doctype: str | None = None,
+                     output_chunk_size: int = BEAUTIFY_CHUNK_SIZE) -> Iterator[bytes]:
+    """Serialize tree in the style of original Ex Machina xml files, yielding output in chunks.
+
+    Walks the tree once and writes the final formatting directly, output is the same as
+    etree.indent + etree.tostring + beautify_machina_xml would give. Trees with namespaces,
+    mixed content or entities are passed through that pipeline instead.
+    """
+    if not _is_machina_serializable(objectify_tree):
+        etree.indent(objectify_tree, space=MACHINA_INDENT)
+        xml_string = etree.tostring(
+            objectify_tree,
+            pretty_print=True,
+            xml_declaration=False,
+            doctype=doctype,
+            encoding=encoding)
+        yield from iter_beautify_machina_xml(iter_chunks(xml_string), output_chunk_size)
+        return
+
+    serializer = _MachinaSerializer(encoding)
+    formatted_parts = serializer.iter_formatted(objectify_tree, doctype)
+    output_parts = []
+    output_size = 0
+    for part in formatted_parts:
+        output_parts.append(part)
+        output_size += len(part)
+        if output_size >= output_chunk_size:
+            yield "".join(output_parts).encode(encoding, "xmlcharrefreplace")
+            output_parts.clear()
+            output_size = 0
+    if output_parts:
+        yield "".join(output_parts).encode(encoding, "xmlcharrefreplace")
+
+
+def _is_machina_serializable(tree: objectify.ObjectifiedElement) -> bool:
+    if not etree.iselement(tree) or not isinstance(tree.tag, str) or tree.tail is not None:
+        return False
+    if next(iter(etree.iterwalk(tree, events=("start-ns",))), None) is not None:
+        return False
+    # text next to child nodes would have been kept by etree.indent, making a line of its own
+    if tree.xpath("boolean(descendant::text()[normalize-space()][../node()[not(self::text())]])"):
+        return False
+    return next(tree.iter(etree.Entity), None) is None
+
+
+class _MachinaSerializer:
+    """Single pass serializer producing the same lines as the indent, tostring and beautify pipeline.
+
+    Ordinary element, comment and closing tag lines are formatted right away. Scripts, multiline
+    text and other lines that need special care are rendered the same way lxml would and passed to
+    the line formatter used by the beautifier.
+    """
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        self.formatter = _MachinaLineFormatter()
+        self.indents = [""]
+
+    def get_indent(self, depth: int) -> str:
+        indents = self.indents
+        while len(indents) <= depth:
+            indents.append(indents[-1] + MACHINA_INDENT)
+        return indents[depth]
+
+    def iter_formatted(self, root: objectify.ObjectifiedElement, doctype: str | None) -> Iterator[str]:
+        if doctype is not None:
+            # lxml puts doctype on a line of its own, even an empty one
+            yield self.format_raw(f"{doctype}\n")
+
+        # element is known to be a leaf only when the next event is its own end
+        started = None
+        depth = -1
+        for event, node in etree.iterwalk(root, events=("start", "end", "comment", "pi")):
+            if started is not None:
+                if event == "end":
+                    yield self.format_element(started, depth, is_leaf=True)
+                    started = None
+                    depth -= 1
+                    continue
+                yield self.format_element(started, depth, is_leaf=False)
+                started = None
+
+            if event == "start":
+                depth += 1
+                started = node
+            elif event == "end":
+                yield self.format_closing_tag(node.tag, depth)
+                depth -= 1
+            else:
+                yield self.format_non_element(node, depth + 1)
+
+    def format_raw(self, raw_piece: str) -> str:
+        """Format lines the same way as lxml would output them, using the beautifier line formatter."""
+        encoding = self.encoding
+        raw_lines = raw_piece.encode(encoding, "xmlcharrefreplace").splitlines()
+        return b"".join(map(self.formatter.format_line, raw_lines)).decode(encoding)
+
+    def format_element(self, node: objectify.ObjectifiedElement, depth: int, is_leaf: bool) -> str:
+        tag = node.tag
+        indent = self.get_indent(depth)
+        if not is_leaf:
+            tag_end = ">"
+        elif (text := node.text) is None:
+            tag_end = "/>"
+        else:
+            tag_end = f">{_escape_text(text)}</{tag}>"
+
+        # all values are escaped at once, NUL can't be a part of xml text
+        values = "\0".join(node.values())
+        attributes = [f'{key}="{value}"'
+                      for key, value in zip(node.keys(), _escape_attribute(values).split("\0"), strict=False)]
+
+        formatter = self.formatter
+        if (formatter.inside_plaintext_block
+           or tag == "script"
+           or "\n" in tag_end or "\t" in tag_end or '"' in tag_end
+           # value ending with "=" can be mistaken for a start of the next attribute by beautifier
+           or values.endswith("=") or "=\0" in values):
+            attributes_string = "".join(" " + attribute for attribute in attributes)
+            return self.format_raw(f"{indent}<{tag}{attributes_string}{tag_end}")
+
+        if not attributes:
+            line = f"{indent}<{tag}{tag_end}\n"
+        elif tag in NEVER_SPLIT_TAGS:
+            line = f"{indent}<{tag} {' '.join(attributes)}{tag_end}\n"
+        else:
+            separator = "\n" + self.get_indent(depth + 1)
+            line = f"{indent}<{tag}{separator}{separator.join(attributes)}{tag_end}\n"
 
-        if line_stripped.startswith(script_start_tag):
-            inside_plaintext_block = True
-            plaintext_tag_indent = line_indent
+        # Add blank line before tags at the same level (first tag of its tree level)
+        if depth == formatter.previous_line_indent:
+            line = "\n" + line
+        formatter.previous_line_indent = depth
+        return line
+
+    def format_non_element(self, node: objectify.ObjectifiedElement, depth: int) -> str:
+        line = self.get_indent(depth) + etree.tostring(node, encoding=str, with_tail=False)
+        formatter = self.formatter
+        if (formatter.inside_plaintext_block
+           or not line.endswith("-->")
+           or "\n" in line or "\r" in line or "\t" in line):
+            return self.format_raw(line)
+
+        # comments are never split on attributes
+        if depth == formatter.previous_line_indent:
+            line = "\n" + line
+        formatter.previous_line_indent = depth
+        return line + "\n"
+
+    def format_closing_tag(self, tag: str, depth: int) -> str:
+        line = f"{self.get_indent(depth)}</{tag}>"
+        formatter = self.formatter
+        if formatter.inside_plaintext_block:
+            return self.format_raw(line)
+        if depth == formatter.previous_line_indent:
+            line = "\n" + line
+        formatter.previous_line_indent = depth
+        return line + "\n"
+
+
+NEVER_SPLIT_TAGS = frozenset(tag.decode() for tag in _MachinaLineFormatter.never_split_tags)
+
+
+def _escape_text(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\r" in text:
+        text = text.replace("\r", "&#13;")
+    return text
+
+
+def _escape_attribute(value: str) -> str:
+    value = _escape_text(value)
+    if '"' in value:
+        value = value.replace('"', "&quot;")
+    if "\n" in value:
+        value = value.replace("\n", "&#10;")
+    if "\t" in value:
+        value = value.replace("\t", "&#9;")
+    return value
 
-    return b"".join(beautified_parts)
 
 def _extract_tag_prefix(tag_line: bytes) -> bytes:
     """
@@ -245,18 +505,62 @@ def _split_tag_on_attributes(xml_line: bytes, line_indent: int) -> bytes:
     return tag_name + indent.join(parts)
 
 
-def xml_to_objfy(full_path: str | Path) -> objectify.ObjectifiedElement:
-    with Path(full_path).open("rb") as fh:
-        byte_string = fh.read()
+# Size of pieces in which files are checked to be a valid utf-8, to avoid decoding whole file at once
+ENCODING_CHECK_CHUNK_SIZE = 64 * 1024
+
+_thread_parsers = threading.local()
+
+
+def get_objectify_parser(encoding: str) -> etree.XMLParser:
+    """Return recovering objectify parser for encoding, reused between calls in the same thread."""
+    parsers = getattr(_thread_parsers, "by_encoding", None)
+    if parsers is None:
+        parsers = _thread_parsers.by_encoding = {}
+    parser = parsers.get(encoding)
+    if parser is None:
+        parser = objectify.makeparser(recover=True, encoding=encoding, collect_ids=False)
+        objectify.enable_recursive_str(True)
+        parsers[encoding] = parser
+    return parser
+
+
+@cache
+def _get_undecodable_bytes(single_byte_encoding: str) -> tuple[bytes, ...]:
+    undecodable = []
+    for byte in range(256):
         try:
-            encoding = "utf-8"
-            byte_string.decode(encoding)
+            bytes((byte,)).decode(single_byte_encoding)
         except UnicodeDecodeError:
-            encoding = data.ENCODING
+            undecodable.append(bytes((byte,)))
+    return tuple(undecodable)
+
+
+def detect_xml_encoding(byte_string: bytes) -> str:
+    """Return utf-8 for valid utf-8 files, game encoding otherwise.
+
+    Check stops at the first invalid utf-8 byte and never decodes the whole file at once.
+    Declared encoding or BOM are not trusted, as files with utf-8 content and windows-1251
+    declaration are common among mods.
+    """
+    if byte_string.isascii():
+        return "utf-8"
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    data_view = memoryview(byte_string)
+    try:
+        for i in range(0, len(data_view), ENCODING_CHECK_CHUNK_SIZE):
+            decoder.decode(data_view[i:i + ENCODING_CHECK_CHUNK_SIZE])
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        # parser silently drops text with bytes undefined in game encoding, fail loudly instead
+        if any(byte in byte_string for byte in _get_undecodable_bytes(data.ENCODING)):
             byte_string.decode(data.ENCODING)
+        return data.ENCODING
+    return "utf-8"
 
-        parser_recovery = objectify.makeparser(recover=True, encoding=encoding, collect_ids=False)
-        objectify.enable_recursive_str(True)
 
-        # objectify.parse(f, parser_recovery)
-        return objectify.fromstring(byte_string, parser_recovery)
+def xml_to_objfy(full_path: str | Path) -> objectify.ObjectifiedElement:
+    with Path(full_path).open("rb") as fh:
+        byte_string = fh.read()
+    encoding = detect_xml_encoding(byte_string)
+    return objectify.fromstring(byte_string, get_objectify_parser(encoding))
@@ -125,6 +125,9 @@ stored = LocalizationService(get_default_lang(), get_strings_dict())
 def get_current_lang() -> SupportedLanguages:
     return stored.language
 
+def set_current_lang(lang: str) -> None:
+    stored.language = lang
+
 def is_known_lang(lang: str) -> bool:
     return lang in KnownLangFlags.list_names()
 
@@ -0,0 +1,149 @@
+import filecmp
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+from commod.helpers import file_ops, parse_ops
+from commod.tools import xml_diff
+
+logger = logging.getLogger("dem")
+
+COMMANDS_FILE_SUFFIX = "_commands.xml"
+MERGE_INSTRUCTIONS_NAME = "merge_instructions.yaml"
+
+@dataclass
+class FileDiffResult:
+    relative_path: Path
+    commands_count: int = 0
+    fallback_guide: bool = False
+    elapsed: float = 0.0
+    error: str | None = None
+
+    @property
+    def commands_path(self) -> Path:
+        return self.relative_path.with_name(f"{self.relative_path.stem}{COMMANDS_FILE_SUFFIX}")
+
+    def describe(self) -> str:
+        if self.error is not None:
+            return f"{self.relative_path.as_posix()}: failed in {self.elapsed:.2f}s - {self.error}"
+        description = (f"{self.relative_path.as_posix()}: {self.commands_count} commands "
+                       f"in {self.elapsed:.2f}s")
+        if self.fallback_guide:
+            description += " (unknown file type, commands might be unusable)"
+        return description
+
+# differs of the worker process by root tag, created once by pool initializer
+_worker_differs: dict[str, xml_diff.Differ] = {}
+
+def init_batch_diff_worker(diff_guides: list[xml_diff.DiffGuide]) -> None:
+    _worker_differs.clear()
+    _worker_differs.update({guide.root_tag: xml_diff.Differ(guide) for guide in diff_guides})
+
+def diff_file(relative_path: Path, vanilla_dir: Path, modded_dir: Path, output_dir: Path) -> FileDiffResult:
+    """Write commands for the changed file, used in the worker processes."""
+    start = time.perf_counter()
+    result = FileDiffResult(relative_path)
+    try:
+        base_tree = parse_ops.xml_to_objfy(vanilla_dir / relative_path)
+        modded_tree = parse_ops.xml_to_objfy(modded_dir / relative_path)
+        differ = _worker_differs.get(str(base_tree.tag))
+        if differ is None:
+            result.fallback_guide = True
+            differ = xml_diff.Differ(xml_diff.DiffGuide(root_tag=str(base_tree.tag)))
+        result.commands_count = xml_diff.save_xml_diff(
+            base_tree, modded_tree, output_dir / result.commands_path, differ)
+    except Exception as ex:
+        logger.debug(f"Can't produce diff for '{relative_path}'", exc_info=True)
+        result.error = str(ex) or type(ex).__name__
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def find_changed_files(vanilla_dir: Path, modded_dir: Path,
+                       output_dir: Path | None = None) -> tuple[list[Path], list[Path]]:
+    """Return relative paths of modded xml files that differ from vanilla ones, and of new xml files."""
+    changed_files = []
+    new_files = []
+    for modded_path in sorted(modded_dir.rglob("*")):
+        if not modded_path.is_file() or modded_path.suffix.lower() != ".xml":
+            continue
+        if output_dir is not None and modded_path.is_relative_to(output_dir):
+            continue
+        relative_path = modded_path.relative_to(modded_dir)
+        vanilla_path = vanilla_dir / relative_path
+        if not vanilla_path.is_file():
+            new_files.append(relative_path)
+        elif not filecmp.cmp(vanilla_path, modded_path, shallow=False):
+            changed_files.append(relative_path)
+    return changed_files, new_files
+
+def write_merge_instructions(results: list[FileDiffResult], output_dir: Path) -> Path:
+    instructions = [{"commands": result.commands_path.as_posix(),
+                     "targets": result.relative_path.as_posix()}
+                    for result in sorted(results, key=lambda result: result.relative_path)
+                    if result.error is None and result.commands_count]
+    instructions_path = output_dir / MERGE_INSTRUCTIONS_NAME
+    file_ops.dump_yaml(instructions, instructions_path, sort_keys=False)
+    return instructions_path
+
+def run_batch_diff(vanilla_dir: Path, modded_dir: Path, output_dir: Path,
+                   max_workers: int | None = None) -> int:
+    """Diff all changed xml files of the mod against vanilla ones, return exit code.
+
+    Both directories are expected to mirror the game directory, so the relative paths of files
+    are used as merge targets. Commands are written to the output directory with the same layout,
+    along with merge instructions for all of them.
+    """
+    start = time.perf_counter()
+    vanilla_dir = vanilla_dir.resolve()
+    modded_dir = modded_dir.resolve()
+    output_dir = output_dir.resolve()
+    for directory in (vanilla_dir, modded_dir):
+        if not directory.is_dir():
+            print(f"Directory doesn't exist: '{directory}'")
+            return 2
+
+    changed_files, new_files = find_changed_files(vanilla_dir, modded_dir, output_dir)
+    print(f"Found {len(changed_files)} changed and {len(new_files)} new xml files "
+          f"in {time.perf_counter() - start:.2f}s")
+    for relative_path in new_files:
+        print(f"  new file, not diffed: {relative_path.as_posix()}")
+    if not changed_files:
+        return 0
+
+    diff_guides = xml_diff.read_diff_guides(file_ops.get_internal_file_path("assets/diff_guides.json"))
+    # biggest files go first, so they don't end up being the last ones to finish
+    changed_files.sort(key=lambda relative_path: (modded_dir / relative_path).stat().st_size, reverse=True)
+    max_workers = min(max_workers or os.cpu_count() or 1, len(changed_files))
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    results: list[FileDiffResult] = []
+    if not file_ops.is_process_pool_supported():
+        max_workers = 1
+        init_batch_diff_worker(diff_guides)
+        for count, relative_path in enumerate(changed_files, start=1):
+            result = diff_file(relative_path, vanilla_dir, modded_dir, output_dir)
+            results.append(result)
+            print(f"[{count}/{len(changed_files)}] {result.describe()}")
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=init_batch_diff_worker,
+                                 initargs=(diff_guides,)) as executor:
+            pending = [executor.submit(diff_file, relative_path, vanilla_dir, modded_dir, output_dir)
+                       for relative_path in changed_files]
+            for count, future in enumerate(as_completed(pending), start=1):
+                result = future.result()
+                results.append(result)
+                print(f"[{count}/{len(pending)}] {result.describe()}")
+
+    instructions_path = write_merge_instructions(results, output_dir)
+    failed = [result for result in results if result.error is not None]
+    equivalent = [result for result in results if result.error is None and not result.commands_count]
+    print(f"Diffed {len(results)} files with {max_workers} workers in {time.perf_counter() - start:.2f}s "
+          f"(total of {sum(result.elapsed for result in results):.2f}s per file): "
+          f"{sum(result.commands_count for result in results)} commands, "
+          f"{len(equivalent)} equivalent files, {len(failed)} failed")
+    print(f"Merge instructions: '{instructions_path}'")
+    return 1 if failed else 0
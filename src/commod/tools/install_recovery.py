@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from pathlib import Path
+
+from commod.game.install_journal import InstallJournal, JournalEntry
+
+logger = logging.getLogger("dem")
+
+async def print_progress(file_num: int, files_count: int, file_name: str, file_size: float) -> None:
+    print(f"[{file_num}/{files_count}] {file_name}")
+
+def get_pending_journal(game_dir: Path) -> InstallJournal | None:
+    journal = InstallJournal(game_dir)
+    if not journal.is_pending():
+        print(f"No interrupted installation found in '{game_dir}'")
+        return None
+    return journal
+
+def run_rollback(game_dir: Path) -> int:
+    """Restore game files replaced by interrupted installation, return exit code."""
+    game_dir = game_dir.resolve()
+    if not (game_dir / "data").is_dir():
+        print(f"Game directory doesn't exist: '{game_dir}'")
+        return 2
+    journal = get_pending_journal(game_dir)
+    if journal is None:
+        return 0
+    try:
+        restored_count = journal.rollback()
+    except Exception as ex:
+        logger.debug("Rollback of installation failed", exc_info=True)
+        print(f"Rollback failed: {ex}")
+        return 1
+    print(f"Rolled back {restored_count} replaced files")
+    return 0
+
+def run_resume(game_dir: Path) -> int:
+    """Copy the rest of files of interrupted installation, return exit code.
+
+    Files already replaced by the interrupted installation are not copied again.
+    """
+    game_dir = game_dir.resolve()
+    if not (game_dir / "data").is_dir():
+        print(f"Game directory doesn't exist: '{game_dir}'")
+        return 2
+    journal = get_pending_journal(game_dir)
+    if journal is None:
+        return 0
+    mod_name = "unknown"
+    requires_patching = False
+    try:
+        begin_entries = journal.get_entries(JournalEntry.BEGIN)
+        if begin_entries:
+            mod_name = begin_entries[0]["mod"]
+            requires_patching = begin_entries[0]["requires_patching"]
+        copied_count, skipped_count = asyncio.run(journal.resume(print_progress))
+    except Exception as ex:
+        logger.debug("Resume of installation failed", exc_info=True)
+        print(f"Resume of '{mod_name}' installation failed: {ex}")
+        return 1
+    print(f"Resumed installation of '{mod_name}': copied {copied_count} files, "
+          f"{skipped_count} were already in place")
+    if requires_patching:
+        print("Mod also patches the game, install it again with ComMod to finish the installation")
+    return 0
@@ -1,19 +1,26 @@
 import logging
 import math
+import os
+import re
 import time
+from array import array
+from collections import Counter
 from collections.abc import Iterable, Iterator
-from copy import copy
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy, deepcopy
 from dataclasses import dataclass
 from enum import Enum
-from functools import cached_property
+from functools import cached_property, lru_cache
+from hashlib import blake2b
 from itertools import batched
 from pathlib import Path
 
-from lxml import objectify
+from lxml import etree, objectify
 from pydantic import BaseModel, computed_field, model_validator
 
-from commod.helpers import parse_ops
-from commod.tools.xml_helpers import ActionType, Command, InvalidMergeCommandError
+from commod.game.data import OWN_VERSION
+from commod.helpers import file_ops, parse_ops
+from commod.tools.xml_helpers import ActionType, Command, InvalidMergeCommandError, compile_xpath
 
 # Some nodes use unique tag names, we can handle them safely if we know that.
 # UNIQUE_TAGS = ["TargetNamesForDestroy", "params", "Files"]
@@ -48,6 +55,43 @@ from commod.tools.xml_helpers import ActionType, Command, InvalidMergeCommandErr
 
 logger = logging.getLogger("dem")
 
+# selectors by tag or attributes, i.e. Object[@Name='name'], with quoted values stripped
+ATTR_SELECTOR_SHAPE = re.compile(r"[^\[\]]+(?:\[@[^=\[\]]+=''\])*")
+QUOTED_VALUE = re.compile(r"'[^']*'")
+ATTR_PREDICATE = re.compile(r"\[@([^=\[\]]+)='([^']*)'\]")
+# selectors by values of children, i.e. Object[Post[1][@ServerObjName='name'] and Post[2]...]
+NESTED_SELECTOR_PREFIX = re.compile(r"([^\[\]]+)\[([^\[\]]+)\[1\]\[@([^=\[\]]+)='([^']*)'\]")
+
+# bytes in blake2b digests used for _ChildrenHash
+CHILDREN_HASH_SIZE = 16
+
+# starting worker processes only pays off for big files
+PARALLEL_DIFF_MIN_FILE_SIZE = 4 * 1024 * 1024
+# more partitions than workers to even out the load when partitions take uneven time
+PARTITIONS_PER_WORKER = 4
+
+# annotated source trees kept on disk between diffs
+ANNOTATED_TREE_CACHE_SIZE = 8
+
+# float lists with the same value are parsed once, most of them are equal in both diffed trees
+FLOAT_LIST_CACHE_SIZE = 64 * 1024
+# game engine doesn't guarantee stable precision of coordinates
+FLOAT_LIST_TOLERANCE = 0.05
+
+@lru_cache(maxsize=FLOAT_LIST_CACHE_SIZE)
+def parse_float_list(value: str) -> array | None:
+    """Return numbers of whitespace separated list, None if list contains anything but plain decimals."""
+    parts = value.split()
+    # cast to float to check will allow "infinity", "100e-1" etc. to pass, invalid here
+    if not all(part.removeprefix("-").replace(".", "", 1).isdigit() for part in parts):
+        return None
+    return array("d", map(float, parts))
+
+@lru_cache
+def parse_float_list_keys(value: str | None) -> frozenset[str]:
+    """Return names of attributes listed in _FloatLists."""
+    return frozenset(value.split(",")) if value else frozenset()
+
 class NodeSignature(BaseModel):
     tag: str | None = None
     parent_tag: str | None = None
@@ -145,6 +189,83 @@ class Diff:
     source: objectify.ObjectifiedElement | None = None
     result: objectify.ObjectifiedElement | None = None
 
+# left node, right node and count of left nodes matching the right one
+MatchedNodes = tuple[objectify.ObjectifiedElement | None, objectify.ObjectifiedElement | None, int]
+# serialized base and modded nodes, with flags of presence of each node and matches count for every pair
+DiffPartition = tuple[bytes, bytes, list[tuple[bool, bool, int]]]
+
+
+@dataclass(frozen=True, slots=True)
+class _CompiledSignature:
+    signature: NodeSignature
+    tag: str | None
+    parent_tag: str | None
+    unique_mask: int
+    significant_mask: int
+    children_tags: frozenset[str]
+    first_child: "_SignatureTable | None"
+
+
+class _SignatureTable:
+    """Signatures applicable to a tag, compiled to bitmasks of required keys in order of precedence."""
+
+    def __init__(self, signatures: Iterable[NodeSignature]) -> None:
+        signatures = list(signatures)
+        self.key_bits: dict[str, int] = {}
+        for sig in signatures:
+            for key in [*(sig.unique_keys or []), *(sig.significant_keys or [])]:
+                self.key_bits.setdefault(key, 1 << len(self.key_bits))
+        self.signatures = [self.compile_signature(sig) for sig in signatures]
+
+    def get_mask(self, keys: Iterable[str] | None) -> int:
+        mask = 0
+        for key in keys or []:
+            mask |= self.key_bits[key]
+        return mask
+
+    def compile_signature(self, sig: NodeSignature) -> _CompiledSignature:
+        return _CompiledSignature(
+            signature=sig,
+            tag=sig.tag or None,
+            parent_tag=sig.parent_tag or None,
+            unique_mask=self.get_mask(sig.unique_keys),
+            significant_mask=self.get_mask(sig.significant_keys),
+            children_tags=frozenset(sig.children_tags or []),
+            # nested signatures are validated to have a single child fingerprint
+            first_child=_SignatureTable(sig.children[:1]) if sig.children else None)
+
+    def match(self, node: objectify.ObjectifiedElement) -> NodeSignature | None:
+        """Return first signature matching the node, same as checking NodeSignature.is_matching in order."""
+        present_keys = 0
+        non_empty_keys = 0
+        for key, value in node.attrib.items():
+            if bit := self.key_bits.get(key):
+                present_keys |= bit
+                if value:
+                    non_empty_keys |= bit
+
+        child_tags = None
+        for sig in self.signatures:
+            if sig.tag is not None and sig.tag != node.tag:
+                continue
+            if sig.parent_tag is not None:
+                parent_node = node.getparent()
+                if parent_node is None or parent_node.tag != sig.parent_tag:
+                    continue
+            if sig.unique_mask & ~non_empty_keys or sig.significant_mask & ~present_keys:
+                continue
+            if sig.children_tags:
+                if child_tags is None:
+                    child_tags = frozenset(child.tag for child in node.iterchildren())
+                if not sig.children_tags <= child_tags:
+                    continue
+            if sig.first_child is not None:
+                first_child = next(node.iterchildren(), None)
+                if first_child is None or sig.first_child.match(first_child) is None:
+                    continue
+            return sig.signature
+        return None
+
 
 class DiffGuide(BaseModel):
     root_tag: str
@@ -165,14 +286,155 @@ class DiffGuide(BaseModel):
                 if node.tag is None or node.tag == tag_name])
         return sig_dict
 
+    @cached_property
+    def float_list_attribs(self) -> frozenset[str]:
+        return frozenset(self.float_list_to_round)
+
     def get_signatures_for_tag(self, tag: str) -> list[NodeSignature]:
         if tag in self.signatures_dict:
             return self.signatures_dict[tag]
         return self.signatures_dict.get(None, [])
 
+    @cached_property
+    def signature_tables(self) -> dict[str | None, _SignatureTable]:
+        start = time.perf_counter()
+        tables = {tag: _SignatureTable(sigs) for tag, sigs in self.signatures_dict.items()}
+        tables.setdefault(None, _SignatureTable([]))
+        logger.debug(f"Compiled signatures for '{self.root_tag}' diff guide in "
+                     f"{round(time.perf_counter() - start, 4)} seconds")
+        return tables
+
+    def match_signature(self, node: objectify.ObjectifiedElement) -> NodeSignature | None:
+        table = self.signature_tables.get(str(node.tag)) or self.signature_tables[None]
+        return table.match(node)
+
+    @cached_property
+    def version(self) -> str:
+        """Digest of the guide contents, changes whenever the guide would annotate trees differently."""
+        guide_json = self.model_dump_json(exclude={"signatures_dict"})
+        return blake2b(guide_json.encode("utf-8"), digest_size=CHILDREN_HASH_SIZE).hexdigest()
+
+class _SelectorIndex:
+    """Remaining children of the node, indexed by their annotated selectors.
+
+    Lookup returns the same nodes in the same order as evaluating the selector via xpath
+    against the parent, but without walking all the siblings for each lookup.
+    """
+
+    def __init__(self, parent: objectify.ObjectifiedElement) -> None:
+        self.parent = parent
+        self.positions: dict[int, int] = {}
+        self.shapes: dict[int, str | None] = {}
+        self.by_selector: dict[str, dict[int, objectify.ObjectifiedElement]] = {}
+        self.by_tag: dict[str, dict[int, objectify.ObjectifiedElement]] = {}
+        # built lazily for (tag, attribute) pairs used in lookups
+        self.by_value: dict[tuple[str, str], dict[str | None, dict[int, objectify.ObjectifiedElement]]] = {}
+        # same for (tag, child tag, attribute) of the first child with the tag, used by nested selectors
+        self.by_child_value: dict[tuple[str, str, str],
+                                  dict[str | None, dict[int, objectify.ObjectifiedElement]]] = {}
+        self.child_values: dict[tuple[str, str, str], dict[int, str | None]] = {}
+        for position, node in enumerate(parent.getchildren()):
+            selector = Differ.get_annotated_selector(node)
+            self.positions[id(node)] = position
+            self.shapes[id(node)] = self.get_shape(selector)
+            self.by_selector.setdefault(selector, {})[id(node)] = node
+            self.by_tag.setdefault(str(node.tag), {})[id(node)] = node
+
+    @staticmethod
+    def get_shape(selector: str) -> str | None:
+        """Return selector with values stripped, None if selector can't be matched by value."""
+        shape = QUOTED_VALUE.sub("''", selector)
+        if ATTR_SELECTOR_SHAPE.fullmatch(shape) is None:
+            return None
+        return shape
+
+    def get_value_index(self, tag: str,
+                        key: str) -> dict[str | None, dict[int, objectify.ObjectifiedElement]]:
+        value_index = self.by_value.get((tag, key))
+        if value_index is None:
+            value_index = {}
+            for node_id, node in self.by_tag.get(tag, {}).items():
+                value_index.setdefault(node.get(key), {})[node_id] = node
+            self.by_value[(tag, key)] = value_index
+        return value_index
+
+    @staticmethod
+    def get_first_child_value(node: objectify.ObjectifiedElement, child_tag: str, key: str) -> str | None:
+        child = node.find(child_tag)
+        return child.get(key) if child is not None else None
+
+    def get_child_value_index(self, tag: str, child_tag: str,
+                              key: str) -> dict[str | None, dict[int, objectify.ObjectifiedElement]]:
+        value_index = self.by_child_value.get((tag, child_tag, key))
+        if value_index is None:
+            value_index = {}
+            child_values = self.child_values[(tag, child_tag, key)] = {}
+            for node_id, node in self.by_tag.get(tag, {}).items():
+                child_values[node_id] = self.get_first_child_value(node, child_tag, key)
+                value_index.setdefault(child_values[node_id], {})[node_id] = node
+            self.by_child_value[(tag, child_tag, key)] = value_index
+        return value_index
+
+    def find_nested(self, selector: str) -> list[objectify.ObjectifiedElement]:
+        """Find nodes by selector of their children values, checking only nodes with the first value."""
+        nested = NESTED_SELECTOR_PREFIX.match(selector)
+        if nested is None:
+            return compile_xpath(selector)(self.parent)
+
+        tag, child_tag, key, value = nested.groups()
+        is_matching = compile_xpath(f"self::{selector}")
+        candidates = self.get_child_value_index(tag, child_tag, key).get(value, {})
+        matching_nodes = [node for node in candidates.values() if is_matching(node)]
+        matching_nodes.sort(key=lambda node: self.positions[id(node)])
+        return matching_nodes
+
+    def find(self, selector: str) -> list[objectify.ObjectifiedElement]:
+        shape = self.get_shape(selector)
+        if shape is None:
+            return self.find_nested(selector)
+
+        # selectors of the same shape only match when equal, differently shaped ones
+        # are checked directly, but only for nodes that have the first of the required values.
+        # Xpath doesn't decode entities, so selectors with escaped quotes are always checked directly
+        escaped = "&apos;" in selector or "&quot;" in selector
+        matching_nodes = [] if escaped else list(self.by_selector.get(selector, {}).values())
+        tag = shape.partition("[")[0]
+        if predicates := ATTR_PREDICATE.findall(selector):
+            key, value = predicates[0]
+            candidates = self.get_value_index(tag, key).get(value, {})
+        else:
+            candidates = self.by_tag.get(tag, {})
+
+        other_nodes = [node for node_id, node in candidates.items()
+                       if escaped or self.shapes[node_id] != shape]
+        if other_nodes:
+            is_matching = compile_xpath(f"self::{selector}")
+            other_matches = [node for node in other_nodes if is_matching(node)]
+            if other_matches:
+                matching_nodes.extend(other_matches)
+                matching_nodes.sort(key=lambda node: self.positions[id(node)])
+        return matching_nodes
+
+    def remove(self, node: objectify.ObjectifiedElement) -> None:
+        tag = str(node.tag)
+        del self.by_selector[Differ.get_annotated_selector(node)][id(node)]
+        del self.by_tag[tag][id(node)]
+        for (indexed_tag, key), value_index in self.by_value.items():
+            if indexed_tag == tag:
+                del value_index[node.get(key)][id(node)]
+        for (indexed_tag, child_tag, key), value_index in self.by_child_value.items():
+            if indexed_tag == tag:
+                del value_index[self.child_values[(indexed_tag, child_tag, key)].pop(id(node))][id(node)]
+        self.parent.remove(node)
+
 class Differ:
     def __init__(self, diff_guide: DiffGuide) -> None:
         self.diff_guide = diff_guide
+        # accumulated time of matching nodes to signatures, allows to compare guides
+        self.classified_count = 0
+        self.classification_time = 0.0
+        # commands of matched top level nodes from the previous incremental diff
+        self.previous_commands: dict[bytes, list[list[Command | None]]] = {}
 
     @staticmethod
     def describe_diff(
@@ -200,41 +462,50 @@ class Differ:
         return Diff(change, selector, parent_xpath, left_node, right_node)
 
     @staticmethod
-    def get_child_fingerprint(node: objectify.ObjectifiedElement) -> str:
-        children_hash = ""
-        for child in node.getchildren():
-            significant_attribs = [(k, v) for k, v in child.attrib.items() if not k.startswith("_")]
-            child_hash = str(child.tag) + str(sorted(significant_attribs, key=lambda d: d[0]))
-            if child.text:
-                # ignoring whitespace and comments, currently tuned to increase uniqueness check for triggers
-                child_hash += "\n".join([line.strip() for line in child.text.strip().split()
-                                         if not line.strip().startswith("--")])
-            children_hash += child_hash
-            if child.countchildren():
-                children_hash += "".join(Differ.get_child_fingerprint(child))
-        return children_hash
+    def get_child_fingerprint(child: objectify.ObjectifiedElement) -> str:
+        """Return significant content of the node itself: tag, attributes and normalized text."""
+        significant_attribs = sorted((k, v) for k, v in child.attrib.items() if not k.startswith("_"))
+        fingerprint = "\0".join([str(child.tag), *(f"{k}\1{v}" for k, v in significant_attribs)])
+        if child.text:
+            # ignoring whitespace and comments, currently tuned to increase uniqueness check for triggers
+            fingerprint += "\0" + "\n".join([line.strip() for line in child.text.strip().split()
+                                               if not line.strip().startswith("--")])
+        return fingerprint
+
+    @staticmethod
+    def get_subtree_digest(child: objectify.ObjectifiedElement, children_hash: str) -> bytes:
+        return blake2b(f"{Differ.get_child_fingerprint(child)}\0\0{children_hash}".encode(),
+                       digest_size=CHILDREN_HASH_SIZE).digest()
 
     @staticmethod
     def get_child_hash(node: objectify.ObjectifiedElement) -> str:
+        """Return Merkle hash of node children, stable between runs.
+
+        Computed bottom-up in a single pass, hashes of all nested nodes are memoized in _ChildrenHash
+        """
         children_hash = node.get("_ChildrenHash") or ""
         if children_hash:
             return children_hash
 
-        fingerprint = ""
-        subchildren_hashes = []
-        for child in node.getchildren():
-            significant_attribs = [(k, v) for k, v in child.attrib.items() if not k.startswith("_")]
-            child_fingerprint = str(child.tag) + str(sorted(significant_attribs, key=lambda d: d[0]))
-            if child.text:
-                # ignoring whitespace and comments, currently tuned to increase uniqueness check for triggers
-                child_fingerprint += "\n".join([line.strip() for line in child.text.strip().split()
-                                                if not line.strip().startswith("--")])
-            fingerprint += child_fingerprint
-            if child.countchildren():
-                subchildren_hashes.append(Differ.get_child_hash(child))
-        if fingerprint:
-            children_hash = "".join([str(hash(fingerprint)), *subchildren_hashes])
-            node.set("_ChildrenHash", children_hash)
+        walker = etree.iterwalk(node, events=("start", "end", "comment", "pi"))
+        children_digests: list[list[bytes]] = []
+        for event, element in walker:
+            if event == "start":
+                if element is not node and element.get("_ChildrenHash"):
+                    walker.skip_subtree()
+                children_digests.append([])
+                continue
+            if event in {"comment", "pi"}:
+                children_digests[-1].append(Differ.get_subtree_digest(element, ""))
+                continue
+
+            digests = children_digests.pop()
+            children_hash = element.get("_ChildrenHash") or ""
+            if digests and not children_hash:
+                children_hash = blake2b(b"".join(digests), digest_size=CHILDREN_HASH_SIZE).hexdigest()
+                element.set("_ChildrenHash", children_hash)
+            if children_digests:
+                children_digests[-1].append(Differ.get_subtree_digest(element, children_hash))
         return children_hash
 
     @staticmethod
@@ -268,7 +539,7 @@ class Differ:
 
         keys_selector = "".join(f"[@{unique_key}]" for unique_key in unique_keys)
         all_child_selector = f"{child_tag}{keys_selector}"
-        children = node.xpath(all_child_selector)
+        children = compile_xpath(all_child_selector)(node)
 
         if not children:
             raise IncorrectDiffGuideError("Nested unique node must contain children!")
@@ -313,15 +584,24 @@ class Differ:
 
     #     return any(child.tag in child_tags for child in node.getchildren())
 
-    def get_selector_non_unique(self, node: objectify.ObjectifiedElement,
-                            signature: NodeSignature) -> str:
+    @staticmethod
+    def get_non_unique_attrs(node: objectify.ObjectifiedElement,
+                             signature: NodeSignature) -> list[tuple[str, str]]:
         if signature.significant_keys:
-            significant_attrs = [(key, val) for key, val in node.attrib.items()
-                                 if key in signature.significant_keys]
-        else:
-            significant_attrs = [(key, val) for key, val in node.attrib.items()
-                                 if not key.startswith("_")]
+            return [(key, val) for key, val in node.attrib.items()
+                    if key in signature.significant_keys]
+        return [(key, val) for key, val in node.attrib.items()
+                if not key.startswith("_")]
 
+    @staticmethod
+    def get_non_unique_key(node: objectify.ObjectifiedElement,
+                           signature: NodeSignature) -> tuple[str, frozenset[tuple[str, str]]]:
+        """Return key that is equal for duplicates of non unique node."""
+        return str(node.tag), frozenset(Differ.get_non_unique_attrs(node, signature))
+
+    def get_selector_non_unique(self, node: objectify.ObjectifiedElement,
+                            signature: NodeSignature) -> str:
+        significant_attrs = self.get_non_unique_attrs(node, signature)
         selector = "".join(f"[@{key}='{value.replace("'", "&apos;").replace('"', "&quot;")}']"
                            for key, value in significant_attrs)
         return f"{node.tag}{selector}"
@@ -345,10 +625,13 @@ class Differ:
 
     def generate_selector(
             self, node: objectify.ObjectifiedElement) -> tuple[str, NodeSignature | None]:
-        unique_sigs = self.diff_guide.get_signatures_for_tag(str(node.tag))
-        for sig in unique_sigs:
-            if sig.is_matching(node):
-                return self.generate_selector_by_signature(node, sig), sig
+        start = time.perf_counter()
+        sig = self.diff_guide.match_signature(node)
+        self.classification_time += time.perf_counter() - start
+        self.classified_count += 1
+
+        if sig is not None:
+            return self.generate_selector_by_signature(node, sig), sig
 
         return self.generate_selector_by_attr(node), None
 
@@ -377,7 +660,8 @@ class Differ:
                 cmd_node.set(k, v)
 
         if command.children_nodes:
-            cmd_node.extend(command.children_nodes)
+            # children stay in the diffed node, so command can be serialized again and previewed
+            cmd_node.extend(copy(child) for child in command.children_nodes)
         return cmd_node
 
     @staticmethod
@@ -398,16 +682,12 @@ class Differ:
             if not (val := node.get(attrib_name)):
                 continue
 
-            parts = val.split()
-            if len(parts) not in (3, 4):
-                continue
-
-            # cast to float to check will allow "infinity", "100e-1" etc. to pass, invalid here
-            if not all(part.removeprefix("-").replace(".", "", 1).isdigit() for part in parts):
+            float_list = parse_float_list(val)
+            if float_list is None or len(float_list) not in (3, 4):
                 continue
 
             node.set(f"_{attrib_name}", val)
-            parts = [round(float(part), 1) for part in parts]
+            parts = [round(part, 1) for part in float_list]
             annotated_attrib = " ".join([str(part) if part != -0.0 else "0.0" for part in parts])
             node.set(attrib_name, annotated_attrib)
 
@@ -428,40 +708,39 @@ class Differ:
             Differ.cleanup_temp_attributes(child, floatl_attribs)
         return node
 
+    def get_node_copy(self, node: objectify.ObjectifiedElement) -> objectify.ObjectifiedElement:
+        """Copy of the diffed node without temporary attributes, as it appears in the file."""
+        return self.cleanup_temp_attributes(copy(node), self.diff_guide.float_list_to_round)
+
     @staticmethod
     def annotate_float_lists(node: objectify.ObjectifiedElement,
                              float_list_attribs: Iterable[str]) -> objectify.ObjectifiedElement:
-        if node.attrib and (coord_attrib := set(node.attrib) & set(float_list_attribs)):
+        if node.attrib and (coord_attrib := set(node.attrib).intersection(float_list_attribs)):
             Differ.annotate_float_list_attr(node, coord_attrib)
 
         return node
 
     @staticmethod
     def float_list_is_close(first_list: str, second_list: str) -> bool:
-        first_parts = first_list.split()
-        second_parts = second_list.split()
+        if first_list == second_list:
+            return parse_float_list(first_list) is not None
 
-        if len(first_parts) != len(second_parts):
+        first_floats = parse_float_list(first_list)
+        second_floats = parse_float_list(second_list)
+        if first_floats is None or second_floats is None or len(first_floats) != len(second_floats):
             return False
 
-        if (not all(part.removeprefix("-").replace(".", "", 1).isdigit() for part in first_parts)
-           or not all(part.removeprefix("-").replace(".", "", 1).isdigit() for part in second_parts)):
-            return False
-
-        f_parts_float = [float(part) for part in first_parts]
-        s_parts_float = [float(part) for part in second_parts]
-
-        return all(math.isclose(f_parts_float[i], s_parts_float[i], abs_tol=0.05)
-                   for i in range(len(f_parts_float)))
-
-
+        return all(math.isclose(first, second, abs_tol=FLOAT_LIST_TOLERANCE)
+                   for first, second in zip(first_floats, second_floats, strict=True))
 
     def annotate_tree(self, tree: objectify.ObjectifiedElement,
                       unique_keys: Iterable[str] | None = None,
-                      parent_selector: str | None = None) -> objectify.ObjectifiedElement:
+                      parent_selector: str | None = None,
+                      nested: bool = True) -> objectify.ObjectifiedElement:
         # if unique_keys is None:
             # unique_keys = self.diff_guide.primary_unique_keys
 
+        pending_nodes = []
         for node in tree.getchildren():
             if node.tag == "comment" or node.get("_Duplicate"):
                 tree.remove(node)
@@ -471,6 +750,23 @@ class Differ:
                 # already annotated
                 continue
 
+            selector, signature = self.generate_selector(node)
+            pending_nodes.append((node, selector, signature))
+
+        # non unique nodes are collapsed into the first one of them, with a count of duplicates
+        duplicate_counts = Counter(self.get_non_unique_key(node, signature)
+                                   for node, _, signature in pending_nodes
+                                   if signature and signature.node_type == NodeType.NON_UNIQUE)
+        collapsed_keys = set()
+
+        for node, selector, signature in pending_nodes:
+            if signature and signature.node_type == NodeType.NON_UNIQUE:
+                non_unique_key = self.get_non_unique_key(node, signature)
+                if non_unique_key in collapsed_keys:
+                    tree.remove(node)
+                    continue
+                collapsed_keys.add(non_unique_key)
+
             # we use two separate code paths to handle rounding errors in some float vectors/lists
             # 1) in case of shallow nodes (here), we directly compare closeness of these attributes for nodes
             # For that we specify list of attributes that require this type of comparison in _FloatLists
@@ -478,22 +774,19 @@ class Differ:
             # we first annotate lists by rounding them, thus helping produce more similar child hashes
             # Later we deanotate these lists, returning original, non rounded lists for the final command
             # See logic below for ATOMIC and UNIQUE_NESTED
-            if coord_attrib := set(node.attrib) & set(self.diff_guide.float_list_to_round):
+            if coord_attrib := self.diff_guide.float_list_attribs.intersection(node.attrib):
                 node.set("_FloatLists", ",".join(coord_attrib))
 
             if parent_selector:
                 node.set("_ParentXPath", parent_selector)
-            selector, signature = self.generate_selector(node)
             if signature and signature.node_type == NodeType.NON_UNIQUE:
                 if signature.ignored_keys:
                     for key in signature.ignored_keys:
                         if node.get(key):
                             node.attrib.pop(key)
 
-                matching_nodes = tree.xpath(selector)
-                node.set("_DuplicateCount", str(len(matching_nodes)))
-                for matching_node in matching_nodes:
-                    matching_node.set("_Duplicate", "True")
+                node.set("_DuplicateCount", str(duplicate_counts[non_unique_key]))
+                node.set("_Duplicate", "True")
 
             node_type = signature.node_type if signature else NodeType.NON_UNIQUE
 
@@ -505,63 +798,66 @@ class Differ:
                     node.set("_SelectorKeys", ",".join(signature.significant_keys))
             node.set("_NodeType", node_type.value)
 
-            if node_type in [NodeType.ATOMIC, NodeType.UNIQUE_NESTED]:
-                for child in node.getchildren():
-                    # required explicitly because _ChildrenHash will change based on the annotation
-                    self.annotate_float_lists(child, self.diff_guide.float_list_to_round)
-                node.set("_ChildrenHash", self.get_child_hash(node))
-            else:
-                full_parent_selector = f"{parent_selector}/{selector}" if parent_selector else selector
-                self.annotate_tree(node, unique_keys, full_parent_selector)
+            if nested:
+                self.annotate_nested(node, unique_keys)
 
         return tree
 
+    def annotate_nested(self, node: objectify.ObjectifiedElement,
+                        unique_keys: Iterable[str] | None = None) -> None:
+        """Annotate contents of the node, which itself is already annotated."""
+        if node.get("_NodeType") in [NodeType.ATOMIC.value, NodeType.UNIQUE_NESTED.value]:
+            if node.get("_ChildrenHash") is not None:
+                return
+            for child in node.getchildren():
+                # required explicitly because _ChildrenHash will change based on the annotation
+                self.annotate_float_lists(child, self.diff_guide.float_list_attribs)
+            node.set("_ChildrenHash", self.get_child_hash(node))
+        else:
+            parent_selector = node.get("_ParentXPath")
+            selector = node.get("_Selector")
+            full_parent_selector = f"{parent_selector}/{selector}" if parent_selector else selector
+            self.annotate_tree(node, unique_keys, full_parent_selector)
+
     @staticmethod
     def are_equivalent_nodes(first_node: objectify.ObjectifiedElement,
                              second_node: objectify.ObjectifiedElement) -> bool:
-
-        if first_float_list := first_node.get("_FloatLists"):
-            first_node_float_list_attrs = {key:val for key,val in first_node.attrib.items()
-                                           if key in first_float_list.split(",")}
-        else:
-            first_node_float_list_attrs = {}
-
-        if second_float_list := second_node.get("_FloatLists"):
-            second_node_float_list_attrs = {key:val for key,val in second_node.attrib.items()
-                                            if key in second_float_list.split(",")}
-        else:
-            second_node_float_list_attrs = {}
-
-        if first_node_float_list_attrs.keys() != second_node_float_list_attrs.keys():
-            return False
-
-        float_lists_are_close = all(
-            Differ.float_list_is_close(val, second_node_float_list_attrs[key])
-            for key, val in first_node_float_list_attrs.items())
-
-        if not float_lists_are_close:
+        # cheap checks go first, most of compared nodes are either equal or differ in attributes
+        if (first_node.tag != second_node.tag
+           or first_node.get("_DuplicateCount") != second_node.get("_DuplicateCount")
+           or first_node.get("_ChildrenHash") != second_node.get("_ChildrenHash")):
             return False
 
-        if first_node.get("_DuplicateCount") != second_node.get("_DuplicateCount"):
+        first_float_keys = parse_float_list_keys(first_node.get("_FloatLists"))
+        second_float_keys = parse_float_list_keys(second_node.get("_FloatLists"))
+
+        first_node_attrs = {}
+        first_node_float_list_attrs = {}
+        for key, val in first_node.attrib.items():
+            if key in first_float_keys:
+                first_node_float_list_attrs[key] = val
+            elif not key.startswith("_"):
+                first_node_attrs[key] = val
+
+        second_node_attrs = {}
+        second_node_float_list_attrs = {}
+        for key, val in second_node.attrib.items():
+            if key in second_float_keys:
+                second_node_float_list_attrs[key] = val
+            elif not key.startswith("_"):
+                second_node_attrs[key] = val
+
+        if (first_node_attrs != second_node_attrs
+           or first_node_float_list_attrs.keys() != second_node_float_list_attrs.keys()):
             return False
 
-        first_node_attrs = {key:val for key,val in first_node.attrib.items()
-                            if not key.startswith("_") and key not in first_node_float_list_attrs}
-        second_node_attrs = {key:val for key,val in second_node.attrib.items()
-                             if not key.startswith("_") and key not in second_node_float_list_attrs}
-
         first_node_text = first_node.text.replace("\n", "").strip() if first_node.text is not None else ""
         second_node_text = second_node.text.replace("\n", "").strip() if second_node.text is not None else ""
+        if first_node_text != second_node_text:
+            return False
 
-        first_children_hash = first_node.get("_ChildrenHash")
-        second_children_hash = second_node.get("_ChildrenHash")
-
-        return all([
-            first_node.tag == second_node.tag,
-            first_node_attrs == second_node_attrs,
-            first_node_text == second_node_text,
-            first_children_hash == second_children_hash,
-            ])
+        return all(Differ.float_list_is_close(val, second_node_float_list_attrs[key])
+                   for key, val in first_node_float_list_attrs.items())
 
     @staticmethod
     def get_annotated_selector(node: objectify.ObjectifiedElement) -> str:
@@ -571,62 +867,62 @@ class Differ:
         return selector
 
     @staticmethod
-    def parse_diffs(base_tree: objectify.ObjectifiedElement,
-                    modded_tree: objectify.ObjectifiedElement) -> Iterator[Diff]:
+    def match_nodes(
+            base_tree: objectify.ObjectifiedElement,
+            modded_tree: objectify.ObjectifiedElement) -> Iterator[MatchedNodes]:
+        """Pair children of modded tree with matching children of base tree.
+
+        Matched nodes are removed from both trees, unmatched base nodes are paired with None at the end.
+        """
+        # hash join of sibling groups by annotated selector instead of xpath lookup per node
+        base_index = _SelectorIndex(base_tree)
         for right_node in modded_tree.getchildren():
             selector = Differ.get_annotated_selector(right_node)
             try:
-                matching_base_nodes = base_tree.xpath(selector)
+                matching_base_nodes = base_index.find(selector)
             except Exception as ex:
                 raise InvalidDiffError("Unable to diff trees") from ex
 
             left_node = matching_base_nodes[0] if matching_base_nodes else None
-
-            if left_node is not None and Differ.are_equivalent_nodes(left_node, right_node):
-                if left_node.get("_NodeType") not in [NodeType.ATOMIC.value, NodeType.UNIQUE_NESTED.value]:
-                    for diff in Differ.parse_diffs(left_node, right_node):
-                        yield diff
-                base_tree.remove(left_node)
-                modded_tree.remove(right_node)
-                yield Diff(change_type=Change.NONE)
-                continue
-
-            if len(matching_base_nodes) > 1:
-                # TODO
-                logger.warning(f"Multiple matching nodes found for selector '{selector}'")
-
-            diff = Differ.describe_diff(left_node, right_node)
             modded_tree.remove(right_node)
-
             if left_node is not None:
-                base_tree.remove(left_node)
+                base_index.remove(left_node)
 
-            yield diff
+            yield left_node, right_node, len(matching_base_nodes)
 
+        # all modded nodes were matched and removed above, so remaining base nodes are removed in mod
         for left_node in base_tree.getchildren():
-            selector = Differ.get_annotated_selector(left_node)
-            matching_modded_nodes = modded_tree.xpath(selector)
-
-            if len(matching_modded_nodes) == 1:
-                raise ValueError(
-                    "Debug: unexpected result, matching node should have been proccessed earlier!")
+            yield left_node, None, 0
 
-            if len(matching_modded_nodes) > 1:
-                raise ValueError(
-                    "Debug: unexpected result, matching node should have been proccessed earlier!")
-                # TODO
-                # logger.warning(f"Multiple matching nodes found for selector '{selector}'")
-                # continue
-
-            diff = Differ.describe_diff(left_node, None)
-            yield diff
+    @staticmethod
+    def diff_matched_nodes(left_node: objectify.ObjectifiedElement | None,
+                           right_node: objectify.ObjectifiedElement | None,
+                           matches_count: int = 1) -> Iterator[Diff]:
+        if left_node is not None and right_node is not None and Differ.are_equivalent_nodes(left_node,
+                                                                                              right_node):
+            if left_node.get("_NodeType") not in [NodeType.ATOMIC.value, NodeType.UNIQUE_NESTED.value]:
+                yield from Differ.parse_diffs(left_node, right_node)
+            yield Diff(change_type=Change.NONE)
+            return
+
+        if matches_count > 1 and right_node is not None:
+            # TODO
+            logger.warning(f"Multiple matching nodes found for selector '{right_node.get('_Selector')}'")
+
+        yield Differ.describe_diff(left_node, right_node)
 
-        # return diffs
+    @staticmethod
+    def parse_diffs(base_tree: objectify.ObjectifiedElement,
+                    modded_tree: objectify.ObjectifiedElement) -> Iterator[Diff]:
+        for left_node, right_node, matches_count in Differ.match_nodes(base_tree, modded_tree):
+            yield from Differ.diff_matched_nodes(left_node, right_node, matches_count)
 
     def calculate_diff(self,
                        base_tree: objectify.ObjectifiedElement,
                        modded_tree: objectify.ObjectifiedElement,
-                       unique_keys: Iterable[str] | None = None) -> Iterator[Command | None]:
+                       unique_keys: Iterable[str] | None = None,
+                       parallel: bool = False,
+                       incremental: bool = False) -> Iterator[Command | None]:
         # if unique_keys is None:
             # unique_keys = self.diff_guide.primary_unique_keys
 
@@ -635,11 +931,21 @@ class Differ:
                 "Can't produce diff for trees with different root tags: "
                 f"'{base_tree.tag}' vs '{modded_tree.tag}'")
 
+        if incremental:
+            yield from self.calculate_diff_incremental(base_tree, modded_tree, parallel=parallel)
+            return
+        if parallel:
+            yield from self.calculate_diff_parallel(base_tree, modded_tree)
+            return
+
         start = time.perf_counter()
+        self.classified_count = 0
+        self.classification_time = 0.0
         base_tree = self.annotate_tree(base_tree)
         modded_tree = self.annotate_tree(modded_tree)
         logger.debug(f"Annotated trees in "
-              f"{round(time.perf_counter() - start, 3)} seconds")
+              f"{round(time.perf_counter() - start, 3)} seconds, "
+              f"classified {self.classified_count} nodes in {round(self.classification_time, 3)} seconds")
 
         # file_ops.write_xml_to_file(base_tree, DESKTOP / "base.xml",
         #                            machina_beautify=True, use_utf=False)
@@ -650,6 +956,138 @@ class Differ:
         for diff in self.parse_diffs(base_tree, modded_tree):
             yield self.generate_command_from_diff(diff)
 
+    def calculate_diff_parallel(self,
+                                base_tree: objectify.ObjectifiedElement,
+                                modded_tree: objectify.ObjectifiedElement,
+                                max_workers: int | None = None) -> Iterator[Command | None]:
+        """Diff matched top level nodes of the trees in a pool of worker processes.
+
+        Only the top level is annotated and matched in the current process,
+        commands are produced in the same order as by sequential diff.
+        """
+        matched_nodes = self.match_top_level_nodes(base_tree, modded_tree)
+        for commands in self.diff_top_level_nodes_parallel(str(base_tree.tag), matched_nodes, max_workers):
+            yield from commands
+
+    def calculate_diff_incremental(self,
+                                   base_tree: objectify.ObjectifiedElement,
+                                   modded_tree: objectify.ObjectifiedElement,
+                                   parallel: bool = False,
+                                   max_workers: int | None = None) -> Iterator[Command | None]:
+        """Diff only top level nodes that changed since the previous incremental diff.
+
+        Commands are stored for each pair of matched top level nodes, keyed by the contents of the pair.
+        Pairs that are the same as in the previous diff reuse its commands, others are diffed as usual.
+        """
+        matched_nodes = self.match_top_level_nodes(base_tree, modded_tree)
+        matched_keys = [self.get_matched_nodes_key(*matched) for matched in matched_nodes]
+
+        # identical pairs are possible, each of them needs own commands as those hold their nodes
+        reusable_commands = {key: list(commands) for key, commands in self.previous_commands.items()}
+        reused_commands = []
+        changed_nodes = []
+        for matched, key in zip(matched_nodes, matched_keys, strict=True):
+            if reusable_commands.get(key):
+                reused_commands.append(reusable_commands[key].pop())
+            else:
+                reused_commands.append(None)
+                changed_nodes.append(matched)
+        logger.debug(f"Reusing commands for {len(matched_nodes) - len(changed_nodes)} "
+                     f"of {len(matched_nodes)} top level nodes")
+
+        if parallel and changed_nodes:
+            changed_commands = self.diff_top_level_nodes_parallel(str(base_tree.tag), changed_nodes,
+                                                                  max_workers)
+        else:
+            changed_commands = (self.diff_top_level_nodes(*matched) for matched in changed_nodes)
+
+        current_commands = {}
+        for key, reused in zip(matched_keys, reused_commands, strict=True):
+            commands = reused if reused is not None else next(changed_commands)
+            current_commands.setdefault(key, []).append(commands)
+            yield from commands
+        self.previous_commands = current_commands
+
+    def match_top_level_nodes(self,
+                              base_tree: objectify.ObjectifiedElement,
+                              modded_tree: objectify.ObjectifiedElement) -> list[MatchedNodes]:
+        start = time.perf_counter()
+        self.annotate_tree(base_tree, nested=False)
+        self.annotate_tree(modded_tree, nested=False)
+        matched_nodes = list(self.match_nodes(base_tree, modded_tree))
+        logger.debug(f"Matched {len(matched_nodes)} top level nodes in "
+                     f"{round(time.perf_counter() - start, 3)} seconds")
+        return matched_nodes
+
+    @staticmethod
+    def get_matched_nodes_key(left_node: objectify.ObjectifiedElement | None,
+                              right_node: objectify.ObjectifiedElement | None,
+                              matches_count: int) -> bytes:
+        """Digest of everything the commands for the matched nodes are produced from."""
+        digest = blake2b(str(matches_count).encode(), digest_size=CHILDREN_HASH_SIZE)
+        for node in (left_node, right_node):
+            digest.update(b"\0")
+            if node is not None:
+                digest.update(etree.tostring(node, encoding="utf-8", with_tail=False))
+        return digest.digest()
+
+    def diff_top_level_nodes(self,
+                             left_node: objectify.ObjectifiedElement | None,
+                             right_node: objectify.ObjectifiedElement | None,
+                             matches_count: int) -> list[Command | None]:
+        for node in (left_node, right_node):
+            if node is not None:
+                self.annotate_nested(node)
+        return [self.generate_command_from_diff(diff)
+                for diff in self.diff_matched_nodes(left_node, right_node, matches_count)]
+
+    def diff_top_level_nodes_parallel(self, root_tag: str, matched_nodes: list[MatchedNodes],
+                                      max_workers: int | None = None) -> Iterator[list[Command | None]]:
+        """Yield commands for each of matched top level nodes, diffed in a pool of worker processes."""
+        start = time.perf_counter()
+        max_workers = max_workers or os.cpu_count() or 1
+        partitions = self.pack_partitions(root_tag, matched_nodes, max_workers * PARTITIONS_PER_WORKER)
+        logger.debug(f"Packed {len(matched_nodes)} top level nodes into {len(partitions)} partitions in "
+                     f"{round(time.perf_counter() - start, 3)} seconds")
+
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(partitions) or 1),
+                                 initializer=init_diff_worker,
+                                 initargs=(self.diff_guide,)) as executor:
+            for partition_commands in executor.map(diff_partition, partitions):
+                yield from partition_commands
+
+    @staticmethod
+    def pack_partitions(root_tag: str, matched_nodes: list[MatchedNodes],
+                        partitions_count: int) -> list[DiffPartition]:
+        """Split matched nodes into serialized partitions of similar size, keeping the order."""
+        weights = [sum(1 for node in (left_node, right_node) if node is not None for _ in node.iter())
+                   for left_node, right_node, _ in matched_nodes]
+        partition_weight = sum(weights) / max(partitions_count, 1)
+
+        partitions = []
+        current_weight = 0
+        base_root = etree.Element(root_tag)
+        modded_root = etree.Element(root_tag)
+        pairs = []
+        for (left_node, right_node, matches_count), weight in zip(matched_nodes, weights, strict=True):
+            if left_node is not None:
+                base_root.append(left_node)
+            if right_node is not None:
+                modded_root.append(right_node)
+            pairs.append((left_node is not None, right_node is not None, matches_count))
+            current_weight += weight
+            if current_weight >= partition_weight:
+                partitions.append((etree.tostring(base_root, encoding="utf-8"),
+                                   etree.tostring(modded_root, encoding="utf-8"), pairs))
+                current_weight = 0
+                base_root = etree.Element(root_tag)
+                modded_root = etree.Element(root_tag)
+                pairs = []
+        if pairs:
+            partitions.append((etree.tostring(base_root, encoding="utf-8"),
+                               etree.tostring(modded_root, encoding="utf-8"), pairs))
+        return partitions
+
     def generate_command_from_diff(self, diff: Diff) -> Command | None:
         start = time.perf_counter()
         if diff.change_type == Change.NONE:
@@ -766,18 +1204,6 @@ class Differ:
 
         self.cleanup_temp_attributes(primary_node, self.diff_guide.float_list_to_round)
 
-        if diff.source is not None:
-            source = self.cleanup_temp_attributes(copy(diff.source),
-                                                  self.diff_guide.float_list_to_round)
-        else:
-            source = None
-
-        if diff.result is not None:
-            result = self.cleanup_temp_attributes(copy(diff.result),
-                                                  self.diff_guide.float_list_to_round)
-        else:
-            result = None
-
         attr_dict = {attr: primary_node.get(attr) for attr in attr_list}
         selector_keys = selector_keys if all(key in attr_dict for key in selector_keys) else []
         if selector_keys and set(selector_keys) == set(attr_dict.keys()) and len(selector_keys) != 1:
@@ -798,31 +1224,160 @@ class Differ:
             node_attrs=attr_dict,
             selector_keys=selector_keys,
             children_nodes=children,
-            source_node=source,
-            modded_node=result,
+            source_node=diff.source,
+            modded_node=diff.result,
             existing_count=existing_count,
             desired_count=desired_count)
 
+# differ of the worker process, created once by pool initializer
+_worker_differ: Differ | None = None
+
+def init_diff_worker(diff_guide: DiffGuide) -> None:
+    global _worker_differ  # noqa: PLW0603
+    _worker_differ = Differ(diff_guide)
+
+def diff_partition(partition: DiffPartition) -> list[list[Command | None]]:
+    """Produce commands for each of matched top level nodes in the partition, used in the worker processes."""
+    if _worker_differ is None:
+        raise InvalidDiffError("Diff worker wasn't initialized with a diff guide")
+
+    base_chunk, modded_chunk, pairs = partition
+    parser = parse_ops.get_objectify_parser("utf-8")
+    base_nodes = iter(objectify.fromstring(base_chunk, parser).getchildren())
+    modded_nodes = iter(objectify.fromstring(modded_chunk, parser).getchildren())
+
+    commands = []
+    for has_left, has_right, matches_count in pairs:
+        left_node = next(base_nodes) if has_left else None
+        right_node = next(modded_nodes) if has_right else None
+        commands.append(_worker_differ.diff_top_level_nodes(left_node, right_node, matches_count))
+    return commands
+
+def is_parallel_diff_preferred(*paths: Path | str) -> bool:
+    """Parallel diff only pays off for large files, like DynamicScene of big maps."""
+    return ((os.cpu_count() or 1) > 1
+            and file_ops.is_process_pool_supported()
+            and any(Path(path).stat().st_size >= PARALLEL_DIFF_MIN_FILE_SIZE for path in paths))
+
+class AnnotatedTreeCache:
+    """Source trees with preloaded commands applied and annotated, persisted between diffs.
+
+    Entries are keyed by the contents of the source and preloaded command files,
+    and by the version of the diff guide used for annotation.
+    Trees are always handed out as copies, as diffing consumes the annotated trees.
+    """
+
+    def __init__(self, cache_dir: Path, max_entries: int = ANNOTATED_TREE_CACHE_SIZE) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        # last used entry, skips parsing the cache file on repeated diffs of the same source
+        self.last_key: str | None = None
+        self.last_tree: objectify.ObjectifiedElement | None = None
+        self.last_preloaded_count = 0
+
+    @staticmethod
+    def get_key(source_path: Path, preload_paths: Iterable[Path], diff_guide: DiffGuide) -> str:
+        digest = blake2b(digest_size=CHILDREN_HASH_SIZE)
+        for value in (OWN_VERSION, diff_guide.version):
+            digest.update(value.encode("utf-8"))
+            digest.update(b"\0")
+        for path in (source_path, *preload_paths):
+            digest.update(Path(path).name.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(blake2b(Path(path).read_bytes()).digest())
+        return digest.hexdigest()
+
+    def get_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.xml"
+
+    def get(self, key: str) -> tuple[objectify.ObjectifiedElement, int] | None:
+        """Return copy of the cached annotated tree and count of commands applied to it, if cached."""
+        if key != self.last_key:
+            cache_path = self.get_path(key)
+            try:
+                # unlike the game files, cache entries are expected to be well formed
+                parser = objectify.makeparser(encoding="utf-8", collect_ids=False)
+                tree = objectify.fromstring(cache_path.read_bytes(), parser)
+                preloaded_count = int(tree.attrib.pop("_PreloadedCount", 0))
+                # keeps recently used entries from being pruned
+                os.utime(cache_path)
+            except FileNotFoundError:
+                return None
+            except (OSError, ValueError, etree.XMLSyntaxError):
+                logger.warning(f"Ignoring unreadable annotated tree cache entry: '{cache_path}'")
+                return None
+            self.last_key = key
+            self.last_tree = tree
+            self.last_preloaded_count = preloaded_count
+
+        logger.debug(f"Using cached annotated source tree '{key}'")
+        return deepcopy(self.last_tree), self.last_preloaded_count
+
+    def put(self, key: str, tree: objectify.ObjectifiedElement, preloaded_count: int) -> None:
+        self.last_key = key
+        self.last_tree = deepcopy(tree)
+        self.last_preloaded_count = preloaded_count
+
+        cache_path = self.get_path(key)
+        temp_path = cache_path.with_suffix(".tmp")
+        self.last_tree.set("_PreloadedCount", str(preloaded_count))
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temp_path.write_bytes(etree.tostring(self.last_tree, encoding="utf-8"))
+            temp_path.replace(cache_path)
+            self.prune()
+        except OSError:
+            logger.warning(f"Unable to save annotated tree cache entry: '{cache_path}'", exc_info=True)
+        finally:
+            self.last_tree.attrib.pop("_PreloadedCount")
+
+    def prune(self) -> None:
+        """Remove least recently used entries over the limit."""
+        entries = sorted(self.cache_dir.glob("*.xml"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for stale_path in entries[self.max_entries:]:
+            stale_path.unlink(missing_ok=True)
+
+def read_diff_guides(diff_guides_path: Path) -> list[DiffGuide]:
+    diff_guides_file = file_ops.read_json(diff_guides_path)
+    if not isinstance(diff_guides_file, list):
+        raise TypeError("Incorrect diff guide provided!")
+    return [DiffGuide(**config) for config in diff_guides_file]
+
 def create_xml_diff(base_path: Path, modded_path: Path, output_path: Path,
-                    differ: Differ | None = None) -> None:
+                    differ: Differ | None = None, parallel: bool | None = None) -> int:
     base_tree = parse_ops.xml_to_objfy(base_path)
     modded_tree = parse_ops.xml_to_objfy(modded_path)
 
     differ = Differ(DiffGuide(root_tag=str(base_tree.tag))) if differ is None else differ
+    if parallel is None:
+        parallel = is_parallel_diff_preferred(base_path, modded_path)
+
+    return save_xml_diff(base_tree, modded_tree, output_path, differ, parallel)
 
+def save_xml_diff(base_tree: objectify.ObjectifiedElement, modded_tree: objectify.ObjectifiedElement,
+                  output_path: Path, differ: Differ, parallel: bool = False) -> int:
+    """Write commands for the diff of trees to output path, return count of commands.
+
+    Nothing is written if trees are equivalent.
+    """
     start = time.perf_counter()
-    commands = differ.calculate_diff(base_tree, modded_tree)
+    commands = differ.calculate_diff(base_tree, modded_tree, parallel=parallel)
 
     list_of_commands = []
     for batch in batched(commands, 25):  # noqa: B911
         list_of_commands.extend([cmd for cmd in batch if cmd is not None])
     logger.debug(f"Calculated diffs in "
           f"{round(time.perf_counter() - start, 3)} seconds")
+    logger.debug(f"XPath cache stats: {compile_xpath.cache_info()}")
+
+    if not list_of_commands:
+        return 0
 
     start = time.perf_counter()
     commands_xml = Differ.serialize_commands(list_of_commands, root_tag=str(base_tree.tag))
     logger.debug(f"Serialized commands in "
           f"{round(time.perf_counter() - start, 3)} seconds")
 
-    # file_ops.write_xml_to_file(commands_xml, output_path, machina_beautify=True, use_utf=False)
-
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    file_ops.write_xml_to_file(commands_xml, output_path, machina_beautify=True, use_utf=False)
+    return len(list_of_commands)
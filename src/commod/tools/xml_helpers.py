@@ -1,9 +1,23 @@
 from enum import Enum
+from functools import lru_cache
 from typing import Annotated
 
-from lxml import objectify
+from lxml import etree, objectify
 from pydantic import BaseModel, Field, model_validator
 
+# Same selectors and parent paths repeat across hundreds of merge commands and diffed nodes,
+# cache compiled expressions instead of recompiling them on every element.xpath call
+XPATH_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=XPATH_CACHE_SIZE)
+def compile_xpath(expression: str) -> etree.XPath:
+    """Return compiled XPath for expression from a shared LRU cache.
+
+    Hit and miss counters are available via compile_xpath.cache_info()
+    """
+    return etree.XPath(expression)
+
 
 class ActionType(Enum):
     ADD = "Add"
@@ -30,6 +44,7 @@ class Command(BaseModel, arbitrary_types_allowed = True):
     merge_author: str = ""
     existing_count: Annotated[int, Field(ge=1, le=50)] = 1
     desired_count: Annotated[int, Field(ge=1, le=50)] = 1
+    # diffed nodes themselves rather than copies, might still hold temporary attributes of the differ
     source_node: objectify.ObjectifiedElement | None = Field(default=None, repr=False)
     modded_node: objectify.ObjectifiedElement | None = Field(default=None, repr=False)
 
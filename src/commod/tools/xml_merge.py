@@ -1,4 +1,5 @@
 import contextlib
+import re
 from copy import deepcopy
 from pathlib import Path
 
@@ -7,10 +8,24 @@ from lxml import etree, objectify
 from commod.helpers import file_ops, parse_ops
 from commod.localisation.service import tr
 from commod.tools.xml_diff import Differ
-from commod.tools.xml_helpers import ActionType, AmbiguousMergeCommandError, Command, InvalidMergeCommandError
+from commod.tools.xml_helpers import (
+    ActionType,
+    AmbiguousMergeCommandError,
+    Command,
+    InvalidMergeCommandError,
+    compile_xpath,
+)
 
 COMMAND_LIMIT = 100000
 
+# Simple location steps like Object[@Name='x'][@Belong="y"], the only selector form that can be
+# resolved through the MergeIndex. Anything else (positions, nested predicates, axes) goes to XPath
+_XPATH_NAME = r"[A-Za-z_][\w.\-]*"
+_XPATH_PREDICATE = re.compile(rf"""\[@({_XPATH_NAME})=(?:'([^']*)'|"([^"]*)")\]""")
+_XPATH_STEP = re.compile(rf"""({_XPATH_NAME})((?:\[@{_XPATH_NAME}=(?:'[^']*'|"[^"]*")\])*)""")
+
+SimpleStep = tuple[str, tuple[str, ...], tuple[str, ...]]
+
 def reformat_xml(input_path: Path, output_path: Path) -> None:
     input_tree = parse_ops.xml_to_objfy(input_path)
     file_ops.write_xml_to_file(input_tree, output_path, machina_beautify=True, use_utf=False)
@@ -22,7 +37,7 @@ def traverse_path(tree: objectify.ObjectifiedElement, full_path: str) -> objecti
         return element
 
     full_path = full_path.replace(f"//{element.tag}/", "//")
-    elements = tree.xpath(full_path)
+    elements = compile_xpath(full_path)(tree)
 
     if not elements:
         raise InvalidMergeCommandError(
@@ -33,6 +48,184 @@ def traverse_path(tree: objectify.ObjectifiedElement, full_path: str) -> objecti
     return elements[0]
 
 
+def _parse_simple_step(step_match: re.Match) -> SimpleStep:
+    tag, predicates = step_match.groups()
+    keys = []
+    values = []
+    for predicate in _XPATH_PREDICATE.finditer(predicates):
+        key, single_quoted, double_quoted = predicate.groups()
+        keys.append(key)
+        values.append(single_quoted if single_quoted is not None else double_quoted)
+    return tag, tuple(keys), tuple(values)
+
+
+def parse_simple_selector(selector: str) -> SimpleStep | None:
+    """Parse 'tag[@key='value']...' selector to (tag, keys, values), None if selector is not that simple."""
+    step_match = _XPATH_STEP.fullmatch(selector)
+    if step_match is None:
+        return None
+    return _parse_simple_step(step_match)
+
+
+def parse_simple_path(full_path: str) -> list[SimpleStep] | None:
+    """Parse relative path of simple selectors separated by '/', None if path is not that simple."""
+    steps = []
+    pos = 0
+    while True:
+        step_match = _XPATH_STEP.match(full_path, pos)
+        if step_match is None:
+            return None
+        steps.append(_parse_simple_step(step_match))
+        pos = step_match.end()
+        if pos == len(full_path):
+            return steps
+        if full_path[pos] != "/":
+            return None
+        pos += 1
+
+
+class MergeIndex:
+    """Index of element children by tag and attribute values, used to resolve merge commands.
+
+    Lookup tables are built lazily for each (parent, tag, selector keys) combination on first use
+    and are kept in sync with the tree, so all changes to the indexed tree must go through
+    append, remove and set methods. Elements are tracked by identity, as objectify leafs
+    compare by their text value.
+    """
+
+    def __init__(self, root: objectify.ObjectifiedElement) -> None:
+        self.root = root
+        # id(parent) -> (parent, {tag: {keys: {values: [children in document order]}}})
+        self._parents: dict[int, tuple[objectify.ObjectifiedElement,
+                                       dict[str, dict[tuple[str, ...],
+                                                      dict[tuple[str, ...],
+                                                           list[objectify.ObjectifiedElement]]]]]] = {}
+
+    @staticmethod
+    def _get_values(node: objectify.ObjectifiedElement, keys: tuple[str, ...]) -> tuple[str, ...] | None:
+        values = tuple(node.get(key) for key in keys)
+        if None in values:
+            return None
+        return values
+
+    def _get_tag_tables(
+            self, parent: objectify.ObjectifiedElement,
+            tag: str) -> dict[tuple[str, ...], dict[tuple[str, ...], list[objectify.ObjectifiedElement]]]:
+        parent_entry = self._parents.get(id(parent))
+        if parent_entry is None:
+            parent_entry = (parent, {})
+            self._parents[id(parent)] = parent_entry
+        return parent_entry[1].setdefault(tag, {})
+
+    def find(self, parent: objectify.ObjectifiedElement,
+             step: SimpleStep) -> list[objectify.ObjectifiedElement]:
+        """Return children of parent matching the step, same as parent.xpath(step) would."""
+        tag, keys, values = step
+        tag_tables = self._get_tag_tables(parent, tag)
+        table = tag_tables.get(keys)
+        if table is None:
+            table = {}
+            for child in parent.iterchildren(tag):
+                child_values = self._get_values(child, keys)
+                if child_values is not None:
+                    table.setdefault(child_values, []).append(child)
+            tag_tables[keys] = table
+        return list(table.get(values, ()))
+
+    def select(self, parent: objectify.ObjectifiedElement,
+               selector: str) -> list[objectify.ObjectifiedElement] | None:
+        """Return children matching selector, None if selector can't be resolved through index."""
+        step = parse_simple_selector(selector)
+        if step is None:
+            return None
+        return self.find(parent, step)
+
+    def traverse_path(self, full_path: str) -> objectify.ObjectifiedElement | None:
+        """Index based equivalent of traverse_path, None if path can't be resolved through index."""
+        if full_path == f"//{self.root.tag}":
+            return self.root
+
+        steps = parse_simple_path(full_path)
+        if steps is None:
+            return None
+
+        # like XPath, every step is applied to all elements matched by the previous one,
+        # children of parents in document order are in document order too
+        elements = [self.root]
+        for step in steps:
+            elements = [child for element in elements for child in self.find(element, step)]
+            if not elements:
+                break
+        if not elements:
+            raise InvalidMergeCommandError(
+                f"No elements found for path '{full_path}'")
+        if len(elements) > 1:
+            raise AmbiguousMergeCommandError(
+                f"Multiple possible elements found for path '{full_path}'")
+        return elements[0]
+
+    def append(self, parent: objectify.ObjectifiedElement, node: objectify.ObjectifiedElement) -> None:
+        parent.append(node)
+        parent_entry = self._parents.get(id(parent))
+        if parent_entry is None:
+            return
+        for keys, table in parent_entry[1].get(node.tag, {}).items():
+            values = self._get_values(node, keys)
+            if values is not None:
+                table.setdefault(values, []).append(node)
+
+    def remove(self, parent: objectify.ObjectifiedElement, node: objectify.ObjectifiedElement) -> None:
+        parent.remove(node)
+        parent_entry = self._parents.get(id(parent))
+        if parent_entry is None:
+            return
+        for keys, table in parent_entry[1].get(node.tag, {}).items():
+            values = self._get_values(node, keys)
+            if values is None:
+                continue
+            indexed = table.get(values, [])
+            for i, indexed_node in enumerate(indexed):
+                if indexed_node is node:
+                    del indexed[i]
+                    break
+
+    def set(self, node: objectify.ObjectifiedElement, key: str, value: str) -> None:
+        old_value = node.get(key)
+        node.set(key, value)
+        if old_value == value:
+            return
+        parent = node.getparent()
+        if parent is None or (parent_entry := self._parents.get(id(parent))) is None:
+            return
+        tag_tables = parent_entry[1].get(node.tag, {})
+        # keeping document order on reindexing is costly, changes to selector keys are rare
+        for keys in [keys for keys in tag_tables if key in keys]:
+            del tag_tables[keys]
+
+
+def _append_node(parent: objectify.ObjectifiedElement, node: objectify.ObjectifiedElement,
+                 index: MergeIndex | None) -> None:
+    if index is not None:
+        index.append(parent, node)
+    else:
+        parent.append(node)
+
+
+def _remove_node(parent: objectify.ObjectifiedElement, node: objectify.ObjectifiedElement,
+                 index: MergeIndex | None) -> None:
+    if index is not None:
+        index.remove(parent, node)
+    else:
+        parent.remove(node)
+
+
+def _set_attr(node: objectify.ObjectifiedElement, key: str, value: str,
+              index: MergeIndex | None) -> None:
+    if index is not None:
+        index.set(node, key, value)
+    else:
+        node.set(key, value)
+
 
 def parse_commands(xml_node: objectify.ObjectifiedElement,
                    commands: list[Command],
@@ -48,8 +241,8 @@ def parse_commands(xml_node: objectify.ObjectifiedElement,
 
     if parent_path:
         try:
-            xml_node.xpath(parent_path)
-        except etree.XPathEvalError:
+            compile_xpath(parent_path)(xml_node)
+        except etree.XPathError:
             raise InvalidMergeCommandError(
                 f"Invalid ParentXPath specified: '{parent_path}'") from None
 
@@ -133,11 +326,16 @@ def parse_commands(xml_node: objectify.ObjectifiedElement,
 
     return commands
 
-def apply_command(tree: objectify.ObjectifiedElement, command: Command) -> objectify.ObjectifiedElement:
+def apply_command(tree: objectify.ObjectifiedElement, command: Command,
+                  index: MergeIndex | None = None) -> objectify.ObjectifiedElement:
     # if not command.parent_path.startswith(f"//{tree.tag}"):
         # raise InvalidMergeCommandError
 
-    base_element = traverse_path(tree, command.parent_path) if command.parent_path else tree
+    base_element = None
+    if index is not None and command.parent_path:
+        base_element = index.traverse_path(command.parent_path)
+    if base_element is None:
+        base_element = traverse_path(tree, command.parent_path) if command.parent_path else tree
 
     if command.selector_keys:
         selector = command.tag + "".join(f'[@{key}="{command.node_attrs.get(key)}"]'
@@ -145,17 +343,19 @@ def apply_command(tree: objectify.ObjectifiedElement, command: Command) -> objec
     else:
         selector = command.selector
 
-    try:
-        elements = base_element.xpath(selector)
-    except Exception as ex:
-        raise InvalidMergeCommandError(f"Command with invalid selector: {command}") from ex
+    elements = index.select(base_element, selector) if index is not None else None
+    if elements is None:
+        try:
+            elements = compile_xpath(selector)(base_element)
+        except Exception as ex:
+            raise InvalidMergeCommandError(f"Command with invalid selector: {command}") from ex
 
     if command.action == ActionType.ADD_OR_REPLACE:
         if not elements:
             command.action = ActionType.ADD
         else:
             command.action = ActionType.REPLACE
-        apply_command(tree, command)
+        apply_command(tree, command, index)
     elif command.action == ActionType.ADD:
         new_elm = objectify.Element(command.tag)
         for attr_key, attr_val in command.node_attrs.items():
@@ -185,11 +385,11 @@ def apply_command(tree: objectify.ObjectifiedElement, command: Command) -> objec
             if command.desired_count < len(elements):
                 while command.desired_count != len(elements):
                     existing_elem = elements.pop()
-                    base_element.remove(existing_elem)
+                    _remove_node(base_element, existing_elem, index)
                 return tree
 
         for _ in range(command.desired_count - len(elements)):
-            base_element.append(deepcopy(new_elm))
+            _append_node(base_element, deepcopy(new_elm), index)
 
     elif command.action == ActionType.REPLACE:
         new_elm = objectify.Element(command.tag)
@@ -207,10 +407,10 @@ def apply_command(tree: objectify.ObjectifiedElement, command: Command) -> objec
 
         while elements:
             existing_elem = elements.pop()
-            base_element.remove(existing_elem)
+            _remove_node(base_element, existing_elem, index)
 
         for _ in range(command.desired_count):
-            base_element.append(deepcopy(new_elm))
+            _append_node(base_element, deepcopy(new_elm), index)
 
     elif command.action in [ActionType.MODIFY, ActionType.MODIFY_OR_FAIL]:
         if not elements:
@@ -221,8 +421,8 @@ def apply_command(tree: objectify.ObjectifiedElement, command: Command) -> objec
         for elem in elements:
             for attr_key, attr_val in command.node_attrs.items():
                 if not attr_key.startswith("_") and attr_key not in command.selector_keys:
-                    elem.set(attr_key, attr_val)
-            elem.set("_MergeAuthor", command.merge_author)
+                    _set_attr(elem, attr_key, attr_val, index)
+            _set_attr(elem, "_MergeAuthor", command.merge_author, index)
     elif command.action == ActionType.REMOVE:
         if not elements:
             if command.action == ActionType.REMOVE_OR_FAIL:
@@ -232,15 +432,22 @@ def apply_command(tree: objectify.ObjectifiedElement, command: Command) -> objec
             return tree
         while elements:
             element = elements.pop()
-            base_element.remove(element)
+            _remove_node(base_element, element, index)
     else:
         raise InvalidMergeCommandError(f"Unknown merge command: {command.action}")
     return tree
 
-def apply_commands(base_tree: objectify.ObjectifiedElement, commands: list[Command]) -> objectify.ObjectifiedElement:
+def apply_commands(base_tree: objectify.ObjectifiedElement, commands: list[Command],
+                   indexed: bool = False) -> objectify.ObjectifiedElement:
+    """Apply commands to the tree in place.
+
+    Indexed mode resolves simple selectors and parent paths through a MergeIndex instead of
+    evaluating XPath against the whole tree for every command, which pays off on big files.
+    """
+    index = MergeIndex(base_tree) if indexed else None
     for command in commands:
         try:
-            apply_command(base_tree, command)
+            apply_command(base_tree, command, index)
         except InvalidMergeCommandError as ex:
             raise InvalidMergeCommandError((f"{ex.error_desc}\n\n" if ex.error_desc else "")  # noqa: B904
                                            + f"{command!s}")
@@ -269,11 +476,21 @@ def combine_two_xmls(base_path: Path, commands_file: Path,
 
     commands = parse_command_tree(commands_tree, merge_author)
 
-    updated_tree = apply_commands(base_tree, commands)
+    updated_tree = apply_commands(base_tree, commands, indexed=True)
     file_ops.write_xml_to_file(updated_tree, output_path, machina_beautify=True)
     print(f"Combined xmls, output: {output_path}")
 
 def update_file_with_commands(source_path: Path, commands: list[Command]) -> None:
     source_tree = parse_ops.xml_to_objfy(source_path)
-    updated_tree = apply_commands(source_tree, commands)
+    updated_tree = apply_commands(source_tree, commands, indexed=True)
     file_ops.write_xml_to_file(updated_tree, source_path, machina_beautify=True)
+
+def update_file_with_command_files(source_path: Path, command_files: list[tuple[Path, str]]) -> None:
+    """Parse (commands_file, merge_author) pairs and apply commands to source file.
+
+    Takes only paths and strings, so can be used in the worker processes.
+    """
+    commands = []
+    for commands_file, merge_author in command_files:
+        commands.extend(parse_command_tree(parse_ops.xml_to_objfy(commands_file), merge_author))
+    update_file_with_commands(source_path, commands)
@@ -0,0 +1,77 @@
+import errno
+import os
+import shutil
+import tempfile
+import typing
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from commod.helpers import file_ops
+from commod.helpers.file_ops import CopyMethod, copy_buffered, copy_file
+
+
+def copy_half_and_fail(fsrc: typing.BinaryIO, fdst: typing.BinaryIO, size: int) -> None:
+    fdst.write(fsrc.read(size // 2))
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+
+class TestCopyFile(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.source = Path(temp_dir.name, "source.bin")
+        self.destination = Path(temp_dir.name, "destination.bin")
+        self.content = os.urandom(300_000)
+        self.source.write_bytes(self.content)
+        os.utime(self.source, ns=(1_000_000_000, 1_000_000_000))
+        # methods found unsupported are remembered for devices, tests start without that knowledge
+        self.unsupported_methods = file_ops._unsupported_copy_methods  # noqa: SLF001
+        unsupported_patch = mock.patch.dict(self.unsupported_methods, clear=True)
+        unsupported_patch.start()
+        self.addCleanup(unsupported_patch.stop)
+
+    def assert_copied(self) -> None:
+        self.assertEqual(self.destination.read_bytes(), self.content)
+        self.assertEqual(self.destination.stat().st_mtime_ns, self.source.stat().st_mtime_ns)
+
+    def test_fallback_after_partial_copy_error(self) -> None:
+        backends = [(CopyMethod.SENDFILE, copy_half_and_fail), (CopyMethod.BUFFERED, copy_buffered)]
+        with mock.patch.object(file_ops, "COPY_BACKENDS", backends):
+            self.assertIs(copy_file(self.source, self.destination), CopyMethod.BUFFERED)
+            self.assert_copied()
+            self.assertEqual(list(self.unsupported_methods.values()), [{CopyMethod.SENDFILE}])
+
+    @unittest.skipUnless(hasattr(os, "copy_file_range"), "copy_file_range is not available")
+    def test_fallback_when_copy_file_range_copies_nothing(self) -> None:
+        self.destination.write_bytes(b"previous content")
+        backends = [(CopyMethod.COPY_FILE_RANGE, file_ops.copy_with_file_range),
+                    (CopyMethod.BUFFERED, copy_buffered)]
+        with (mock.patch.object(file_ops, "COPY_BACKENDS", backends),
+              mock.patch.object(os, "copy_file_range", return_value=0)):
+            self.assertIs(copy_file(self.source, self.destination), CopyMethod.BUFFERED)
+        self.assert_copied()
+
+    @unittest.skipUnless(hasattr(os, "sendfile"), "sendfile is not available")
+    def test_fallback_when_sendfile_stops_early(self) -> None:
+        real_sendfile = os.sendfile
+        calls = []
+
+        def sendfile_once(out_fd: int, in_fd: int, offset: int, count: int) -> int:
+            calls.append(offset)
+            return real_sendfile(out_fd, in_fd, offset, min(count, 1000)) if len(calls) == 1 else 0
+
+        backends = [(CopyMethod.SENDFILE, file_ops.copy_with_sendfile), (CopyMethod.BUFFERED, copy_buffered)]
+        with (mock.patch.object(file_ops, "COPY_BACKENDS", backends),
+              mock.patch.object(os, "sendfile", sendfile_once)):
+            self.assertIs(copy_file(self.source, self.destination), CopyMethod.BUFFERED)
+        self.assert_copied()
+
+    def test_same_file_is_not_truncated(self) -> None:
+        with self.assertRaises(shutil.SameFileError):
+            copy_file(self.source, self.source)
+        self.assertEqual(self.source.read_bytes(), self.content)
+
+
+if __name__ == "__main__":
+    unittest.main()
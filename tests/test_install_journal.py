@@ -0,0 +1,112 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from commod.game.install_journal import InstallJournal, InstallJournalError, JournalEntry
+from commod.helpers.file_ops import CopyTask, read_yaml
+
+
+async def ignore_progress(file_num: int, files_count: int, file_name: str, file_size: float) -> None:
+    pass
+
+
+class TestInstallJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.game_root = Path(temp_dir.name, "game")
+        self.mod_root = Path(temp_dir.name, "mod")
+        self.write(self.game_root / "game.exe", "original exe")
+        self.write(self.game_root / "data/a.txt", "original a")
+        self.write(self.game_root / "data/keep.txt", "keep")
+        self.write(self.mod_root / "game.exe", "mod exe")
+        self.write(self.mod_root / "data/a.txt", "mod a")
+        self.write(self.mod_root / "data/new/b.txt", "mod b")
+        self.write(self.mod_root / "data/new/c.txt", "mod c")
+        self.journal = InstallJournal(self.game_root)
+        self.plan = [self.get_task(relative_path)
+                     for relative_path in ("game.exe", "data/a.txt", "data/new/b.txt", "data/new/c.txt")]
+
+    @staticmethod
+    def write(path: Path, text: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+
+    def get_task(self, relative_path: str) -> CopyTask:
+        source = self.mod_root / relative_path
+        return CopyTask(str(source), str(self.game_root / relative_path), source.stat().st_size)
+
+    def read_game_file(self, relative_path: str) -> str:
+        return (self.game_root / relative_path).read_text(encoding="utf-8")
+
+    def begin(self) -> None:
+        self.journal.begin("test_mod", {"base": "yes", "version": "1.0"}, requires_patching=False)
+        self.journal.record_plan(self.plan)
+
+    def assert_original_game(self) -> None:
+        self.assertEqual(self.read_game_file("game.exe"), "original exe")
+        self.assertEqual(self.read_game_file("data/a.txt"), "original a")
+        self.assertEqual(self.read_game_file("data/keep.txt"), "keep")
+        self.assertFalse((self.game_root / "data/new/b.txt").exists())
+        self.assertFalse((self.game_root / "data/new/c.txt").exists())
+        self.assertFalse(self.journal.journal_dir.exists())
+
+    def test_rollback_of_partial_install(self) -> None:
+        self.begin()
+        self.journal.replace_batch(self.plan[:3])
+        self.assertEqual(self.read_game_file("data/a.txt"), "mod a")
+        self.assertTrue(self.journal.is_pending())
+
+        self.assertEqual(InstallJournal(self.game_root).rollback(), 3)
+        self.assert_original_game()
+
+    def test_resume_copies_only_missing_files(self) -> None:
+        self.begin()
+        self.journal.replace_batch(self.plan[:2])
+        replaced_mtime = (self.game_root / "data/a.txt").stat().st_mtime_ns
+
+        journal = InstallJournal(self.game_root)
+        copied_count, skipped_count = asyncio.run(journal.resume(ignore_progress))
+        self.assertEqual((copied_count, skipped_count), (2, 2))
+        self.assertEqual((self.game_root / "data/a.txt").stat().st_mtime_ns, replaced_mtime)
+        self.assertEqual(self.read_game_file("data/new/c.txt"), "mod c")
+        self.assertFalse(journal.is_pending())
+        self.assertFalse(journal.journal_dir.exists())
+        manifest = read_yaml(self.game_root / "data/mod_manifest.yaml")
+        self.assertEqual(manifest, {"test_mod": {"base": "yes", "version": "1.0"}})
+
+    def test_truncated_last_entry_is_ignored(self) -> None:
+        self.begin()
+        self.journal.replace_batch(self.plan[:1])
+        with open(self.journal.journal_path, "a", encoding="utf-8") as fh:
+            fh.write('{"entry": "replace", "target": "data/a.tx')
+
+        journal = InstallJournal(self.game_root)
+        self.assertTrue(journal.is_pending())
+        self.assertEqual(journal.read_entries()[-1]["entry"], JournalEntry.REPLACE.value)
+        self.assertEqual(journal.rollback(), 1)
+        self.assert_original_game()
+
+    def test_plan_is_required(self) -> None:
+        self.journal.begin("test_mod", {}, requires_patching=False)
+        with self.assertRaises(InstallJournalError):
+            self.journal.get_plan()
+        with self.assertRaises(InstallJournalError):
+            asyncio.run(self.journal.resume(ignore_progress))
+
+    def test_rollback_of_file_replaced_twice(self) -> None:
+        self.begin()
+        self.journal.replace_batch(self.plan[:3])
+        # resumed installation copies files again when their mtime differs, like on FAT drives
+        journal = InstallJournal(self.game_root)
+        journal.replace_batch(self.plan[1:3])
+        self.assertEqual(self.read_game_file("data/new/b.txt"), "mod b")
+        self.assertFalse((journal.backup_dir / "data/new/b.txt").exists())
+
+        self.assertEqual(journal.rollback(), 3)
+        self.assert_original_game()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from collections.abc import Callable
+from copy import deepcopy
+from pathlib import Path
+
+from lxml import etree, objectify
+
+from commod.game.data import ENCODING
+from commod.helpers import parse_ops
+
+ASSETS_PATH = Path(__file__).parent / "assets"
+# inputs which the single pass serializer passes to the indent, tostring and beautify pipeline
+FALLBACK_INPUTS = frozenset(("machina_entities.xml", "machina_mixed_content.xml", "machina_namespaces.xml"))
+# output settings used when writing files in game encoding and in utf-8
+OUTPUT_FORMATS = ((ENCODING, f'<?xml version="1.0" encoding="{ENCODING}" standalone="yes" ?>'),
+                  ("utf-8", ""))
+
+
+def parse_keeping_entities(path: Path) -> objectify.ObjectifiedElement:
+    parser = objectify.makeparser(recover=True, resolve_entities=False, collect_ids=False)
+    return objectify.parse(str(path), parser).getroot()
+
+
+PARSERS: dict[str, Callable[[Path], objectify.ObjectifiedElement]] = {
+    "xml_to_objfy": parse_ops.xml_to_objfy,
+    "keeping_entities": parse_keeping_entities,
+}
+
+
+def beautify(tree: objectify.ObjectifiedElement, encoding: str, doctype: str) -> bytes:
+    tree = deepcopy(tree)
+    etree.indent(tree, space=parse_ops.MACHINA_INDENT)
+    xml_string = etree.tostring(tree, pretty_print=True, xml_declaration=False,
+                                doctype=doctype, encoding=encoding)
+    return b"".join(parse_ops.iter_beautify_machina_xml((xml_string,)))
+
+
+class TestMachinaSerializer(unittest.TestCase):
+    def test_same_as_beautified_tostring(self) -> None:
+        for path in sorted(ASSETS_PATH.glob("*.xml")):
+            for parser_name, parse in PARSERS.items():
+                for encoding, doctype in OUTPUT_FORMATS:
+                    for output_chunk_size in (7, parse_ops.BEAUTIFY_CHUNK_SIZE):
+                        with self.subTest(path=path.name, parser=parser_name, encoding=encoding,
+                                          output_chunk_size=output_chunk_size):
+                            tree = parse(path)
+                            expected = beautify(tree, encoding, doctype)
+                            self.assertEqual(b"".join(parse_ops.iter_machina_xml(
+                                tree, encoding, doctype, output_chunk_size)), expected)
+
+    def test_fallback_inputs_not_serialized_in_single_pass(self) -> None:
+        for path in sorted(ASSETS_PATH.glob("*.xml")):
+            with self.subTest(path=path.name):
+                self.assertEqual(parse_ops._is_machina_serializable(parse_keeping_entities(path)),  # noqa: SLF001
+                                 path.name not in FALLBACK_INPUTS)
+
+
+if __name__ == "__main__":
+    unittest.main()
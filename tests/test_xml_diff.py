@@ -0,0 +1,114 @@
+import unittest
+from collections.abc import Iterable
+from pathlib import Path
+
+from lxml import etree
+
+from commod.helpers import file_ops, parse_ops
+from commod.tools.xml_diff import Differ, DiffGuide, _SelectorIndex, read_diff_guides
+from commod.tools.xml_helpers import Command
+
+ASSETS_PATH = Path(__file__).parent / "assets"
+SCENE_BASE = ASSETS_PATH / "diff_scene_base.xml"
+SCENE_MODDED = ASSETS_PATH / "diff_scene_modded.xml"
+SCENE_MODDED_AGAIN = ASSETS_PATH / "diff_scene_modded_again.xml"
+SELECTORS_BASE = ASSETS_PATH / "diff_selectors_base.xml"
+SELECTORS_MODDED = ASSETS_PATH / "diff_selectors_modded.xml"
+
+
+def get_scene_guides() -> list[DiffGuide]:
+    """Shipped guide of the scene, and the empty one which makes every node fall back to full selectors."""
+    diff_guides = read_diff_guides(file_ops.get_internal_file_path("assets/diff_guides.json"))
+    return [next(guide for guide in diff_guides if guide.root_tag == "DynamicScene"),
+            DiffGuide(root_tag="DynamicScene")]
+
+
+def serialize(commands: Iterable[Command | None]) -> str:
+    return etree.tostring(Differ.serialize_commands([cmd for cmd in commands if cmd is not None],
+                                                    root_tag="DynamicScene"), encoding="unicode")
+
+
+def diff_files(differ: Differ, base_path: Path, modded_path: Path, **kwargs: bool) -> str:
+    # diff annotates and consumes the trees, so every diff gets freshly parsed ones
+    return serialize(differ.calculate_diff(parse_ops.xml_to_objfy(base_path),
+                                           parse_ops.xml_to_objfy(modded_path), **kwargs))
+
+
+def read_commands(commands_path: Path) -> str:
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.parse(commands_path, parser).getroot(), encoding="unicode")
+
+
+class TestDiffCommands(unittest.TestCase):
+    """Diffs of the fixture files are compared with expected commands, produced with the shipped guide."""
+
+    def assert_expected_commands(self, case: str) -> None:
+        differ = Differ(get_scene_guides()[0])
+        self.assertEqual(diff_files(differ, ASSETS_PATH / f"diff_{case}_base.xml",
+                                    ASSETS_PATH / f"diff_{case}_modded.xml"),
+                         read_commands(ASSETS_PATH / f"diff_{case}_commands.xml"))
+
+    def test_nodes_matched_by_selector_keys(self) -> None:
+        # reordered nodes, same key of different tags, ambiguous keys and nodes without any signature
+        self.assert_expected_commands("selectors")
+
+    def test_selector_index_same_as_xpath(self) -> None:
+        for guide in get_scene_guides():
+            differ = Differ(guide)
+            base_tree = differ.annotate_tree(parse_ops.xml_to_objfy(SELECTORS_BASE))
+            modded_tree = differ.annotate_tree(parse_ops.xml_to_objfy(SELECTORS_MODDED))
+            index = _SelectorIndex(base_tree)
+            for node in modded_tree.getchildren():
+                selector = node.get("_Selector")
+                with self.subTest(signatures=len(guide.unique_signatures), selector=selector):
+                    self.assertEqual(index.find(selector), base_tree.xpath(selector))
+
+    def test_non_unique_duplicates_collapsed(self) -> None:
+        # counts of duplicates ignoring positions and flags, not only of adjacent ones
+        self.assert_expected_commands("duplicates")
+
+    def test_duplicates_collapsed_into_first_one(self) -> None:
+        differ = Differ(get_scene_guides()[0])
+        base_tree = differ.annotate_tree(parse_ops.xml_to_objfy(ASSETS_PATH / "diff_duplicates_base.xml"))
+        vehicles = base_tree.find("Object").find("Vehicles")
+        self.assertEqual([(item.get("Prototype"), item.get("PosX"), item.get("_DuplicateCount"))
+                          for item in vehicles.getchildren()],
+                         [("truck", None, "3"), ("bike", None, "1"), ("bus", None, "1")])
+
+    def test_nodes_classified_by_signatures(self) -> None:
+        # nested, atomic, keyed, tag only and parent dependent signatures, and fallbacks when keys are missing
+        self.assert_expected_commands("signatures")
+
+    def test_signature_table_same_as_signatures_in_order(self) -> None:
+        guide = get_scene_guides()[0]
+        for path in (ASSETS_PATH / "diff_signatures_base.xml", ASSETS_PATH / "diff_signatures_modded.xml"):
+            for node in parse_ops.xml_to_objfy(path).iterdescendants():
+                expected = next((sig for sig in guide.get_signatures_for_tag(str(node.tag))
+                                 if sig.is_matching(node)), None)
+                with self.subTest(path=path.name, node=node.tag, line=node.sourceline):
+                    self.assertIs(guide.match_signature(node), expected)
+
+
+class TestDiffModes(unittest.TestCase):
+    def test_parallel_diff_same_as_sequential(self) -> None:
+        for guide in get_scene_guides():
+            with self.subTest(signatures=len(guide.unique_signatures)):
+                expected = diff_files(Differ(guide), SCENE_BASE, SCENE_MODDED)
+                self.assertIn("_Action", expected)
+                self.assertEqual(diff_files(Differ(guide), SCENE_BASE, SCENE_MODDED, parallel=True), expected)
+
+    def test_repeated_incremental_diff_same_as_sequential(self) -> None:
+        # unchanged, partially changed and again previous modded file, later diffs reuse earlier commands
+        modded_paths = [SCENE_MODDED, SCENE_MODDED, SCENE_MODDED_AGAIN, SCENE_MODDED]
+        for guide in get_scene_guides():
+            for parallel in (False, True):
+                differ = Differ(guide)
+                for step, modded_path in enumerate(modded_paths):
+                    with self.subTest(signatures=len(guide.unique_signatures), parallel=parallel, step=step):
+                        self.assertEqual(
+                            diff_files(differ, SCENE_BASE, modded_path, incremental=True, parallel=parallel),
+                            diff_files(Differ(guide), SCENE_BASE, modded_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
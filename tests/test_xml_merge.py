@@ -0,0 +1,50 @@
+import unittest
+
+from lxml import etree, objectify
+
+from commod.tools.xml_helpers import AmbiguousMergeCommandError, InvalidMergeCommandError
+from commod.tools.xml_merge import apply_commands, parse_command_tree
+
+
+def merge(base: str, commands: str, indexed: bool) -> str:
+    base_tree = objectify.fromstring(base)
+    command_list = parse_command_tree(objectify.fromstring(commands), "test")
+    return etree.tostring(apply_commands(base_tree, command_list, indexed=indexed), encoding="unicode")
+
+
+class TestIndexedMerge(unittest.TestCase):
+    def assert_same_as_xpath(self, base: str, commands: str) -> None:
+        results = []
+        for indexed in (False, True):
+            try:
+                results.append(merge(base, commands, indexed))
+            except (InvalidMergeCommandError, AmbiguousMergeCommandError) as ex:
+                results.append(type(ex).__name__)
+        self.assertEqual(results[0], results[1])
+
+    def test_parent_path_with_ambiguous_intermediate_step(self) -> None:
+        base = ("<DynamicScene><Object Name='town'><Vehicles/></Object>"
+                "<Object Name='town' Prototype='marker'/></DynamicScene>")
+        commands = ("<DynamicScene><Item _Action='Add' _ParentXPath=\"Object[@Name='town']/Vehicles\" "
+                    "_SelectorKeys='Prototype' Prototype='truck'/></DynamicScene>")
+        self.assert_same_as_xpath(base, commands)
+        self.assertIn("truck", merge(base, commands, indexed=True))
+
+    def test_parent_path_ambiguous_at_last_step(self) -> None:
+        base = ("<DynamicScene><Object Name='town'><Vehicles/></Object>"
+                "<Object Name='town'><Vehicles/></Object></DynamicScene>")
+        commands = ("<DynamicScene><Item _Action='Add' _ParentXPath=\"Object[@Name='town']/Vehicles\" "
+                    "_SelectorKeys='Prototype' Prototype='truck'/></DynamicScene>")
+        self.assert_same_as_xpath(base, commands)
+        with self.assertRaises(InvalidMergeCommandError):
+            merge(base, commands, indexed=True)
+
+    def test_parent_path_missing(self) -> None:
+        base = "<DynamicScene><Object Name='town'/></DynamicScene>"
+        commands = ("<DynamicScene><Item _Action='Add' _ParentXPath=\"Object[@Name='town']/Vehicles\" "
+                    "_SelectorKeys='Prototype' Prototype='truck'/></DynamicScene>")
+        self.assert_same_as_xpath(base, commands)
+
+
+if __name__ == "__main__":
+    unittest.main()